@@ -1,20 +1,2311 @@
-import tkinter as tk
-from tkinter import ttk, messagebox, filedialog
+import argparse
+import asyncio
+import bisect
+import codecs
 import csv
-import pandas as pd
+import difflib
+import functools
+import io
+import itertools
+import importlib
+import importlib.util
 from datetime import datetime
 import json
 import os
+import sqlite3
+import subprocess
+import sys
 import traceback
-from PIL import Image, ImageTk
+import cProfile
+import pstats
+import hashlib
+import http.client
+import re
+import shutil
+import socket
+import uuid
+import zipfile
+import tempfile
+import posixpath
+import xml.etree.ElementTree as ET
+from xml.sax.saxutils import escape as xml_escape
+import threading
+import queue
+import time
+import weakref
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from collections import Counter, OrderedDict, deque, namedtuple
+from urllib.parse import urlsplit
+from contextlib import contextmanager
+
+class _LazyModule:
+    """Module stand-in that imports the real module on first use.
+    
+    Keeps pandas and numpy out of GUI startup and tkinter out of headless
+    runs, where it may not even be installed.
+    """
+    
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+    
+    def __getattr__(self, attr):
+        if self._module is None:
+            self._module = importlib.import_module(self._name)
+        return getattr(self._module, attr)
+
+tk = _LazyModule('tkinter')
+ttk = _LazyModule('tkinter.ttk')
+messagebox = _LazyModule('tkinter.messagebox')
+filedialog = _LazyModule('tkinter.filedialog')
+np = _LazyModule('numpy')
+pd = _LazyModule('pandas')
+
+# Rows committed per write; large enough to amortise per-batch overhead on
+# end-of-term loads while keeping a failed batch cheap to report on.
+IMPORT_BATCH_SIZE = 5000
+
+# How often the dialog drains its worker queue, in milliseconds
+WORKER_POLL_MS = 100
+
+DEFAULT_DB_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'school.db')
+
+# Parsed uploads are spilled here as Feather files when pyarrow is available
+DEFAULT_CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '.migration_cache')
+
+# Spill files older than this, or beyond this total size (least recently
+# used first), are deleted
+SPILL_MAX_BYTES = 512 * 1024 * 1024
+SPILL_MAX_AGE_SECONDS = 7 * 24 * 3600
+
+# Rejected rows of dialog imports are written here, one CSV per import
+DEFAULT_REJECTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'rejects')
+
+# Errors kept in memory and shown in the results pane; the rejects file
+# has all of them
+ERROR_EXAMPLES = 50
+
+# Opt-in profiling of dialog imports: MIGRATION_PROFILE=cpu,memory
+PROFILE_FLAGS = {flag.strip() for flag in os.environ.get('MIGRATION_PROFILE', '').split(',') if flag.strip()}
+
+# Functions listed from a cProfile capture
+PROFILE_TOP_FUNCTIONS = 15
+
+# Import job service that the dialog and CLI hand imports to when set:
+# MIGRATION_SERVICE=unix:/path/to/socket or http://127.0.0.1:8765
+SERVICE_ADDRESS = os.environ.get('MIGRATION_SERVICE')
+DEFAULT_SERVICE_PORT = 8765
+
+# Jobs the service will hold waiting, over all schools, before refusing
+# more; and finished jobs it remembers for status queries
+SERVICE_MAX_QUEUED = 64
+SERVICE_JOB_HISTORY = 200
+
+# One table per migration template; columns mirror the template fields
+STORE_SCHEMA = {
+    "students": """
+        CREATE TABLE IF NOT EXISTS students (
+            id INTEGER PRIMARY KEY,
+            name TEXT NOT NULL,
+            birth_date TEXT NOT NULL,
+            gender TEXT NOT NULL,
+            admission_number TEXT NOT NULL UNIQUE,
+            current_grade TEXT
+        )""",
+    "parents": """
+        CREATE TABLE IF NOT EXISTS parents (
+            id INTEGER PRIMARY KEY,
+            student_admission TEXT NOT NULL REFERENCES students(admission_number),
+            name TEXT NOT NULL,
+            phone TEXT NOT NULL,
+            relationship TEXT NOT NULL,
+            email TEXT
+        )""",
+    "teachers": """
+        CREATE TABLE IF NOT EXISTS teachers (
+            id INTEGER PRIMARY KEY,
+            name TEXT NOT NULL,
+            tsc_number TEXT NOT NULL UNIQUE,
+            specialization TEXT NOT NULL,
+            phone TEXT,
+            email TEXT,
+            classes_teaching TEXT,
+            subjects_teaching TEXT
+        )""",
+    "assessments": """
+        CREATE TABLE IF NOT EXISTS assessments (
+            id INTEGER PRIMARY KEY,
+            student_admission TEXT NOT NULL REFERENCES students(admission_number),
+            name TEXT NOT NULL,
+            subject TEXT NOT NULL,
+            score REAL NOT NULL,
+            date TEXT NOT NULL,
+            term TEXT,
+            competency_area TEXT
+        )""",
+    "payments": """
+        CREATE TABLE IF NOT EXISTS payments (
+            id INTEGER PRIMARY KEY,
+            student_admission TEXT NOT NULL REFERENCES students(admission_number),
+            amount REAL NOT NULL,
+            payment_date TEXT NOT NULL,
+            payment_method TEXT,
+            bank_slip_no TEXT,
+            term TEXT,
+            description TEXT
+        )""",
+    "import_checkpoints": """
+        CREATE TABLE IF NOT EXISTS import_checkpoints (
+            file_hash TEXT NOT NULL,
+            data_type TEXT NOT NULL,
+            rows_done INTEGER NOT NULL,
+            updated_at TEXT NOT NULL,
+            PRIMARY KEY (file_hash, data_type)
+        )""",
+    "row_hashes": """
+        CREATE TABLE IF NOT EXISTS row_hashes (
+            data_type TEXT NOT NULL,
+            row_key INTEGER NOT NULL,
+            row_hash INTEGER NOT NULL,
+            PRIMARY KEY (data_type, row_key)
+        ) WITHOUT ROWID""",
+    "store_settings": """
+        CREATE TABLE IF NOT EXISTS store_settings (
+            name TEXT PRIMARY KEY,
+            value TEXT NOT NULL
+        ) WITHOUT ROWID""",
+    "mapping_profiles": """
+        CREATE TABLE IF NOT EXISTS mapping_profiles (
+            data_type TEXT NOT NULL,
+            signature TEXT NOT NULL,
+            mapping TEXT NOT NULL,
+            updated_at TEXT NOT NULL,
+            PRIMARY KEY (data_type, signature)
+        )""",
+    "term_fees": """
+        CREATE TABLE IF NOT EXISTS term_fees (
+            term TEXT NOT NULL,
+            grade TEXT NOT NULL DEFAULT '',
+            amount REAL NOT NULL,
+            PRIMARY KEY (term, grade)
+        ) WITHOUT ROWID""",
+    "fee_ledger": """
+        CREATE TABLE IF NOT EXISTS fee_ledger (
+            student_admission TEXT NOT NULL,
+            term TEXT NOT NULL,
+            paid REAL NOT NULL,
+            payments INTEGER NOT NULL,
+            last_payment_date TEXT,
+            PRIMARY KEY (student_admission, term)
+        ) WITHOUT ROWID""",
+    "assessment_stats": """
+        CREATE TABLE IF NOT EXISTS assessment_stats (
+            grade TEXT NOT NULL,
+            term TEXT NOT NULL,
+            subject TEXT NOT NULL,
+            count INTEGER NOT NULL,
+            total REAL NOT NULL,
+            total_squares REAL NOT NULL,
+            min_score REAL,
+            max_score REAL,
+            PRIMARY KEY (grade, term, subject)
+        ) WITHOUT ROWID""",
+    "competency_stats": """
+        CREATE TABLE IF NOT EXISTS competency_stats (
+            grade TEXT NOT NULL,
+            term TEXT NOT NULL,
+            competency_area TEXT NOT NULL,
+            count INTEGER NOT NULL,
+            total REAL NOT NULL,
+            total_squares REAL NOT NULL,
+            min_score REAL,
+            max_score REAL,
+            PRIMARY KEY (grade, term, competency_area)
+        ) WITHOUT ROWID""",
+    "ranked_classes": """
+        CREATE TABLE IF NOT EXISTS ranked_classes (
+            grade TEXT NOT NULL,
+            term TEXT NOT NULL,
+            ranked_at TEXT NOT NULL,
+            PRIMARY KEY (grade, term)
+        ) WITHOUT ROWID""",
+    "class_rankings": """
+        CREATE TABLE IF NOT EXISTS class_rankings (
+            grade TEXT NOT NULL,
+            term TEXT NOT NULL,
+            student_admission TEXT NOT NULL,
+            subjects INTEGER NOT NULL,
+            average REAL NOT NULL,
+            position INTEGER NOT NULL,
+            PRIMARY KEY (grade, term, student_admission)
+        ) WITHOUT ROWID""",
+    "subject_rankings": """
+        CREATE TABLE IF NOT EXISTS subject_rankings (
+            grade TEXT NOT NULL,
+            term TEXT NOT NULL,
+            student_admission TEXT NOT NULL,
+            subject TEXT NOT NULL,
+            score REAL NOT NULL,
+            position INTEGER NOT NULL,
+            PRIMARY KEY (grade, term, student_admission, subject)
+        ) WITHOUT ROWID""",
+    # name_key is name_key(name): names are matched on it, in Python and
+    # in SQL alike, rather than with NOCASE, which only folds ASCII
+    "classes": """
+        CREATE TABLE IF NOT EXISTS classes (
+            id INTEGER PRIMARY KEY,
+            name TEXT NOT NULL,
+            name_key TEXT NOT NULL UNIQUE
+        )""",
+    "subjects": """
+        CREATE TABLE IF NOT EXISTS subjects (
+            id INTEGER PRIMARY KEY,
+            name TEXT NOT NULL,
+            name_key TEXT NOT NULL UNIQUE
+        )""",
+    "teacher_classes": """
+        CREATE TABLE IF NOT EXISTS teacher_classes (
+            class_id INTEGER NOT NULL REFERENCES classes(id),
+            tsc_number TEXT NOT NULL REFERENCES teachers(tsc_number),
+            PRIMARY KEY (class_id, tsc_number)
+        ) WITHOUT ROWID""",
+    "teacher_subjects": """
+        CREATE TABLE IF NOT EXISTS teacher_subjects (
+            subject_id INTEGER NOT NULL REFERENCES subjects(id),
+            tsc_number TEXT NOT NULL REFERENCES teachers(tsc_number),
+            PRIMARY KEY (subject_id, tsc_number)
+        ) WITHOUT ROWID""",
+    # The school that first wrote each admission number, when imports name
+    # one. Natural keys have no school column, so another school's rows
+    # with the same number are rejected instead of upserted over it.
+    "student_schools": """
+        CREATE TABLE IF NOT EXISTS student_schools (
+            admission_number TEXT PRIMARY KEY,
+            school TEXT NOT NULL
+        ) WITHOUT ROWID""",
+}
+
+STORE_INDEXES = [
+    "CREATE INDEX IF NOT EXISTS idx_parents_student ON parents(student_admission)",
+    "CREATE INDEX IF NOT EXISTS idx_assessments_student ON assessments(student_admission)",
+    "CREATE INDEX IF NOT EXISTS idx_payments_student ON payments(student_admission)",
+    "CREATE INDEX IF NOT EXISTS idx_assessments_subject ON assessments(subject, term)",
+    "CREATE INDEX IF NOT EXISTS idx_assessments_competency ON assessments(competency_area, term)",
+    "CREATE INDEX IF NOT EXISTS idx_teacher_classes_teacher ON teacher_classes(tsc_number)",
+    "CREATE INDEX IF NOT EXISTS idx_teacher_subjects_teacher ON teacher_subjects(tsc_number)",
+]
+
+# Teacher list fields stored as interned names: the lookup table, the
+# teacher link table and its id column, for each template field
+TEACHER_LISTS = {
+    "classes_teaching": ("classes", "teacher_classes", "class_id"),
+    "subjects_teaching": ("subjects", "teacher_subjects", "subject_id"),
+}
+
+# Assessment aggregate tables and the column each groups by, besides
+# grade and term. Grade is the student's current grade; a students import
+# that moves students to another grade recounts both grades.
+ASSESSMENT_STAT_TABLES = {
+    "assessment_stats": "subject",
+    "competency_stats": "competency_area",
+}
+
+# Natural keys that make re-imports upserts instead of duplicates.
+# A payment is keyed by its bank slip, per student since one slip can pay
+# for siblings; payments without a slip have no natural key and stay
+# insert-only, and resuming from a checkpoint keeps them from being
+# written twice.
+STORE_NATURAL_KEYS = {
+    "students": ["admission_number"],
+    "teachers": ["tsc_number"],
+    "parents": ["student_admission", "name"],
+    "assessments": ["student_admission", "name", "subject", "date"],
+    "payments": ["student_admission", "bank_slip_no"],
+}
+
+# Duplicated keys listed when a natural key cannot be created
+KEY_CONFLICT_EXAMPLES = 5
+
+def _all_present(columns):
+    """SQL condition that none of the columns is NULL"""
+    return ' AND '.join(f"{column} IS NOT NULL" for column in columns)
+
+# Tuned for bulk loads: WAL lets readers continue during an import and
+# synchronous=NORMAL is durable at every commit under WAL.
+STORE_PRAGMAS = [
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA foreign_keys=ON",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA cache_size=-65536",
+    "PRAGMA mmap_size=268435456",
+    "PRAGMA busy_timeout=5000",
+]
+
+class AdmissionIndex:
+    """In-memory hash index of the admission numbers in the store.
+    
+    Loaded from the students table on first use and then kept current as
+    student batches are committed, so referential checks are a single
+    set-membership pass over a column instead of a query per row.
+    Commits by other connections, such as another process importing into
+    the same database, are noticed through PRAGMA data_version before
+    each lookup and make the next one reload.
+    """
+    
+    def __init__(self, store):
+        self.store = store
+        self.lock = threading.Lock()
+        self._numbers = None
+        self._owners = None
+        self._data_version = None
+        # Numbers written inside a dry-run transaction that will be rolled back
+        self._staged = set()
+        self._staged_owners = {}
+    
+    def _check_store(self):
+        """Forget the loaded sets if another connection has committed since.
+        
+        Takes the store lock before, never while, holding self.lock.
+        """
+        with self.store.lock:
+            version = self.store.conn.execute("PRAGMA data_version").fetchone()[0]
+        with self.lock:
+            if version != self._data_version:
+                self._numbers = None
+                self._owners = None
+                self._data_version = version
+    
+    def _load(self):
+        if self._numbers is None:
+            with self.store.lock:
+                rows = self.store.conn.execute("SELECT admission_number FROM students")
+                self._numbers = {row[0] for row in rows}
+        return self._numbers
+    
+    def _load_owners(self):
+        if self._owners is None:
+            with self.store.lock:
+                self._owners = dict(self.store.conn.execute(
+                    "SELECT admission_number, school FROM student_schools"
+                ))
+        return self._owners
+    
+    def claimed_elsewhere(self, values, school):
+        """Boolean Series marking admission numbers another school has claimed"""
+        self._check_store()
+        with self.lock:
+            values = values.astype(object)
+            owner = values.map(self._load_owners())
+            if self._staged_owners:
+                owner = owner.fillna(values.map(self._staged_owners))
+            return owner.notna() & (owner != school)
+    
+    def claim(self, numbers, school, staged=False):
+        """Record the school of newly written admission numbers; the first claim stands"""
+        with self.lock:
+            owners = self._load_owners()
+            target = self._staged_owners if staged else owners
+            for number in numbers:
+                if number not in owners:
+                    target.setdefault(number, school)
+    
+    def contains(self, values):
+        """Boolean Series marking which values are known admission numbers"""
+        self._check_store()
+        with self.lock:
+            found = _in_set(values, self._load())
+            if self._staged:
+                found |= _in_set(values, self._staged)
+            return found
+    
+    def add(self, numbers, staged=False):
+        """Record newly written admission numbers.
+        
+        Staged numbers belong to a dry run; they count for lookups until
+        discard_staged() is called when its transaction is rolled back.
+        """
+        with self.lock:
+            if staged:
+                self._staged.update(numbers)
+            else:
+                self._load().update(numbers)
+    
+    def discard_staged(self):
+        """Forget a rolled-back dry run's numbers.
+        
+        Sets loaded during the dry run read its uncommitted rows, so they
+        are dropped as well and reloaded on the next lookup.
+        """
+        with self.lock:
+            self._numbers = None
+            self._owners = None
+            self._staged.clear()
+            self._staged_owners.clear()
+    
+    def reset(self):
+        """Forget the cached numbers; the next lookup reloads from the store"""
+        with self.lock:
+            self._numbers = None
+            self._owners = None
+            self._staged.clear()
+            self._staged_owners.clear()
+    
+    def __len__(self):
+        self._check_store()
+        with self.lock:
+            return len(self._load())
+
+# Read size for the binary record counter
+COUNT_CHUNK_SIZE = 1 << 20
+
+# Shared field_rules patterns for the migration templates. Only explicit
+# ASCII classes: \d and \s are Unicode-aware in Python's re, which
+# object columns use, but ASCII-only in pyarrow's RE2, so they would
+# judge the same value by how the file happened to be read.
+PHONE_PATTERN = r"\+?[0-9]{9,15}"
+EMAIL_PATTERN = r"[^@ \t\r\n]+@[^@ \t\r\n]+\.[^@ \t\r\n]+"
+
+# Rows per chunk when a file is read incrementally
+READ_CHUNK_SIZE = 50000
+
+# Rows read to check a file's header in step 2
+PREVIEW_ROWS = 5
+
+# The step 2 preview shows a window of rows over the whole file, read in
+# pages on demand; only the window is ever inserted into the Treeview
+PREVIEW_WINDOW_ROWS = 20
+PREVIEW_PAGE_ROWS = 1000
+PREVIEW_CACHED_PAGES = 8
+
+# Step 1 choice for importing every data type from one workbook or zip
+PACKAGE_DATA_TYPE = 'all'
+
+# File types picked up when a bulk import is pointed at a directory
+SUPPORTED_EXTENSIONS = ('.csv', '.xls', '.xlsx')
+
+# Files at least this large are streamed through the import in chunks
+# instead of being parsed whole and cached
+STREAM_THRESHOLD_BYTES = 100 * 1024 * 1024
+
+_XLSX_DIMENSION = re.compile(rb'<(?:\w+:)?dimension\s+ref="[A-Z]*(\d+)(?::[A-Z]*(\d+))?"')
+_XLSX_ROW = re.compile(rb'<(?:\w+:)?row[\s>]')
+_XLSX_NS = {
+    'main': 'http://schemas.openxmlformats.org/spreadsheetml/2006/main',
+    'rel': 'http://schemas.openxmlformats.org/officeDocument/2006/relationships',
+    'pkg': 'http://schemas.openxmlformats.org/package/2006/relationships',
+}
+
+def count_csv_records(file_path):
+    """Count the data records in a CSV without parsing it.
+    
+    Scans the file in large binary chunks and counts newlines that fall
+    outside quoted fields, so quoted values containing newlines are not
+    mistaken for extra records. The header line is not counted.
+    """
+    lines = 0
+    in_quotes = False
+    last_byte = b'\n'
+    with open(file_path, 'rb') as f:
+        while True:
+            chunk = f.read(COUNT_CHUNK_SIZE)
+            if not chunk:
+                break
+            if not in_quotes and b'"' not in chunk:
+                lines += chunk.count(b'\n')
+            else:
+                # Splitting on quotes alternates between outside and inside
+                # segments; an escaped "" just toggles twice
+                for segment in chunk.split(b'"'):
+                    if not in_quotes:
+                        lines += segment.count(b'\n')
+                    in_quotes = not in_quotes
+                in_quotes = not in_quotes  # The last segment did not end in a quote
+            last_byte = chunk[-1:]
+    
+    if last_byte != b'\n':
+        lines += 1  # Final record without a trailing newline
+    return max(lines - 1, 0)
+
+def csv_record_offsets(file_path, every):
+    """Byte offsets of every `every`-th data record of a CSV.
+    
+    The same quote-aware scan as count_csv_records, vectorized over each
+    chunk. Record n * every starts at offsets[n], so any record is one seek
+    and a short read away.
+    """
+    offsets = []
+    records = 0  # Newlines outside quotes so far; the first ends the header
+    in_quotes = False
+    base = 0
+    with open(file_path, 'rb') as f:
+        while True:
+            chunk = f.read(COUNT_CHUNK_SIZE)
+            if not chunk:
+                break
+            data = np.frombuffer(chunk, dtype=np.uint8)
+            newlines = np.flatnonzero(data == ord('\n'))
+            quotes = data == ord('"')
+            if in_quotes or quotes.any():
+                inside = (np.cumsum(quotes)[newlines] + in_quotes) % 2 == 1
+                newlines = newlines[~inside]
+                in_quotes = (int(quotes.sum()) + in_quotes) % 2 == 1
+            # The record after the newline numbered n is record n
+            numbers = records + np.arange(len(newlines))
+            offsets.extend((newlines[numbers % every == 0] + base + 1).tolist())
+            records += len(newlines)
+            base += len(chunk)
+    return [offset for offset in offsets if offset < base]
+
+# Bytes sampled from the start of a CSV to detect its encoding and dialect
+SNIFF_BYTES = 64 * 1024
+
+# Delimiters recognized in CSV exports, in order of preference
+CSV_DELIMITERS = ',;\t|'
+
+# Size of the record-aligned blocks a large CSV is streamed in; each block
+# is parsed with every core when pyarrow is available
+CSV_BLOCK_BYTES = 64 * 1024 * 1024
+
+CsvFormat = namedtuple('CsvFormat', 'encoding delimiter')
+
+def sniff_csv(file_path):
+    """Encoding and delimiter of a CSV, detected once per file version"""
+    stat = os.stat(file_path)
+    return _sniff_csv(os.path.abspath(file_path), stat.st_size, stat.st_mtime_ns)
+
+@functools.lru_cache(maxsize=64)
+def _sniff_csv(path, size, mtime_ns):
+    with open(path, 'rb') as f:
+        sample = f.read(SNIFF_BYTES)
+    encoding = _sniff_encoding(sample)
+    text = sample.decode(encoding, errors='replace')
+    return CsvFormat(encoding, _sniff_delimiter(text, complete=size <= SNIFF_BYTES))
+
+def _sniff_encoding(sample):
+    """Encoding of a CSV from a byte prefix.
+    
+    A BOM decides it; otherwise UTF-8 if the sample decodes, else the
+    Windows code page that Excel exports use.
+    """
+    if sample.startswith(codecs.BOM_UTF8):
+        return 'utf-8-sig'
+    if sample.startswith((codecs.BOM_UTF16_LE, codecs.BOM_UTF16_BE)):
+        return 'utf-16'
+    try:
+        sample.decode('utf-8')
+        return 'utf-8'
+    except UnicodeDecodeError as e:
+        # A character cut in half by the end of the sample is still UTF-8
+        if e.reason == 'unexpected end of data' and e.start >= len(sample) - 3:
+            return 'utf-8'
+    try:
+        sample.decode('cp1252')
+        return 'cp1252'
+    except UnicodeDecodeError:
+        return 'latin-1'
+
+def _sniff_delimiter(text, complete=True):
+    """The delimiter that splits the sample into the most consistent rows"""
+    best, best_score = ',', None
+    for delimiter in CSV_DELIMITERS:
+        rows = [len(row) for row in csv.reader(io.StringIO(text), delimiter=delimiter) if row]
+        if not complete:
+            rows = rows[:-1]  # The sample may end mid-record
+        if not rows or rows[0] < 2:
+            continue
+        score = (sum(1 for fields in rows if fields == rows[0]), rows[0])
+        if best_score is None or score > best_score:
+            best, best_score = delimiter, score
+    return best
+
+def _ascii_compatible(encoding):
+    """Whether newlines and quotes are single ASCII bytes in the encoding"""
+    return not codecs.lookup(encoding).name.startswith('utf-16')
+
+def read_csv(file_path, columns=None, dtypes=None, **options):
+    """Read a CSV with its sniffed encoding and delimiter.
+    
+    Whole-file reads use pyarrow's multithreaded parser when pyarrow is
+    installed. Partial reads (nrows and the like), a missing pyarrow, or a
+    file pyarrow rejects (say, a stray byte the sniffed encoding cannot
+    decode past the sample) go through pandas' C parser, which replaces
+    undecodable bytes instead of failing.
+    """
+    csv_format = sniff_csv(file_path)
+    if _has_pyarrow() and not options:
+        import pyarrow.csv as pa_csv
+        
+        try:
+            with open(file_path, encoding=csv_format.encoding, errors='replace', newline='') as f:
+                names = next(csv.reader(f, delimiter=csv_format.delimiter), [])
+            df = pa_csv.read_csv(file_path, **_arrow_csv_options(csv_format, names, columns)).to_pandas()
+            return df.astype(dtypes) if dtypes else df
+        except ValueError:
+            pass  # Arrow and decode errors are ValueErrors; retry leniently
+    return pd.read_csv(file_path, encoding_errors='replace', sep=csv_format.delimiter,
+                       encoding=csv_format.encoding, usecols=columns, dtype=dtypes or str, **options)
+
+def _arrow_csv_options(csv_format, names, columns=None):
+    """pyarrow.csv.read_csv options that keep every column as text.
+    
+    Type inference would read 007 back as 7 and 392 as 392.0, so each of
+    the header's columns is pinned to string.
+    """
+    import pyarrow as pa
+    import pyarrow.csv as pa_csv
+    
+    return {
+        "read_options": pa_csv.ReadOptions(encoding=csv_format.encoding, use_threads=True),
+        "parse_options": pa_csv.ParseOptions(delimiter=csv_format.delimiter, newlines_in_values=True),
+        "convert_options": pa_csv.ConvertOptions(
+            include_columns=list(columns) if columns is not None else None,
+            column_types={name: pa.string() for name in names},
+            strings_can_be_null=True
+        )
+    }
+
+def _csv_record_blocks(file_path, block_size):
+    """Split a CSV into its header line and blocks of whole records.
+    
+    Each block ends at a newline outside quotes, so every block parses on
+    its own. Only for ASCII-compatible encodings.
+    """
+    header = None
+    carry = b''
+    with open(file_path, 'rb') as f:
+        while True:
+            block = f.read(block_size)
+            data = carry + block
+            if not block:
+                if data.strip():
+                    yield (header, data) if header is not None else (data, b'')
+                return
+            
+            raw = np.frombuffer(data, dtype=np.uint8)
+            newlines = np.flatnonzero(raw == ord('\n'))
+            quotes = np.cumsum(raw == ord('"'))
+            newlines = newlines[quotes[newlines] % 2 == 0]
+            if not len(newlines):
+                carry = data
+                continue
+            if header is None:
+                header, data = data[:newlines[0] + 1], data
+                newlines = newlines[1:]
+                data_start = len(header)
+            else:
+                data_start = 0
+            cut = int(newlines[-1]) + 1 if len(newlines) else data_start
+            if cut > data_start:
+                yield header, data[data_start:cut]
+            carry = data[max(cut, data_start):]
+
+def iter_csv_chunks(file_path, chunksize=READ_CHUNK_SIZE, columns=None, dtypes=None):
+    """Stream a CSV as DataFrame chunks with file-relative indexes.
+    
+    With pyarrow, the file is cut into CSV_BLOCK_BYTES blocks of whole
+    records and each block is parsed on every core, so memory stays at a
+    block or two while parsing runs in parallel. Otherwise pandas' C
+    parser streams it chunk by chunk.
+    """
+    csv_format = sniff_csv(file_path)
+    if not (_has_pyarrow() and _ascii_compatible(csv_format.encoding)):
+        reader = pd.read_csv(file_path, usecols=columns, dtype=dtypes or str, chunksize=chunksize,
+                             sep=csv_format.delimiter, encoding=csv_format.encoding, encoding_errors='replace')
+        for chunk in reader:
+            yield chunk[list(columns)] if columns is not None else chunk
+        return
+    
+    import pyarrow.csv as pa_csv
+    
+    names = None
+    start = 0
+    for header, body in _csv_record_blocks(file_path, CSV_BLOCK_BYTES):
+        if names is None:
+            text = header.decode(csv_format.encoding, errors='replace')
+            names = next(csv.reader(io.StringIO(text), delimiter=csv_format.delimiter), [])
+        try:
+            df = pa_csv.read_csv(io.BytesIO(header + body),
+                                 **_arrow_csv_options(csv_format, names, columns)).to_pandas()
+        except ValueError:
+            # Only this block is bad; parse it leniently and carry on
+            df = pd.read_csv(io.BytesIO(header + body), usecols=columns, dtype=str,
+                             sep=csv_format.delimiter, encoding=csv_format.encoding,
+                             encoding_errors='replace')
+            if columns is not None:
+                df = df[list(columns)]
+        if dtypes:
+            df = df.astype(dtypes)
+        for offset in range(0, len(df), chunksize):
+            chunk = df.iloc[offset:offset + chunksize]
+            chunk.index = pd.RangeIndex(start, start + len(chunk))
+            start += len(chunk)
+            yield chunk
+
+def _first_sheet_path(zf):
+    """Path inside an xlsx archive of the first worksheet in tab order"""
+    workbook = ET.fromstring(zf.read('xl/workbook.xml'))
+    sheet = workbook.find('main:sheets/main:sheet', _XLSX_NS)
+    rel_id = sheet.get(f"{{{_XLSX_NS['rel']}}}id")
+    
+    rels = ET.fromstring(zf.read('xl/_rels/workbook.xml.rels'))
+    for rel in rels.findall('pkg:Relationship', _XLSX_NS):
+        if rel.get('Id') == rel_id:
+            target = rel.get('Target')
+            if target.startswith('/'):
+                return target.lstrip('/')
+            return posixpath.normpath(posixpath.join('xl', target))
+    raise ValueError("Workbook has no worksheet")
+
+def count_xlsx_records(file_path):
+    """Count the data rows of the first sheet of an xlsx without loading it.
+    
+    Reads the <dimension> element from the start of the sheet XML. Writers
+    that omit it fall back to counting <row> elements in the decompressed
+    stream, which still never builds any cells. The header row is not
+    counted.
+    """
+    with zipfile.ZipFile(file_path) as zf:
+        sheet_path = _first_sheet_path(zf)
+        with zf.open(sheet_path) as sheet:
+            head = sheet.read(64 * 1024)
+            match = _XLSX_DIMENSION.search(head)
+            # A range ending on its first row (A1:A1) is also what writers
+            # that never computed it leave behind, so it is not trusted
+            if match and match.group(2) and int(match.group(2)) > int(match.group(1)):
+                return int(match.group(2)) - int(match.group(1))
+            
+            # No usable dimension; count row tags, carrying a small tail
+            # across reads so a tag split between chunks is not missed
+            rows = 0
+            buffer = head
+            while True:
+                chunk = sheet.read(COUNT_CHUNK_SIZE)
+                if not chunk:
+                    rows += len(_XLSX_ROW.findall(buffer))
+                    break
+                buffer += chunk
+                cut = buffer.rfind(b'<')
+                if cut < 0:
+                    cut = len(buffer)
+                rows += len(_XLSX_ROW.findall(buffer, 0, cut))
+                buffer = buffer[cut:]
+    return max(rows - 1, 0)
+
+ValidationRule = namedtuple('ValidationRule', 'name field message check')
+
+def _present(values):
+    return values.notna() & (values != '')
+
+def _date_rule(field, spec):
+    date_format = spec.get('format', '%Y-%m-%d')
+    
+    def check(values):
+        parsed = pd.to_datetime(values, format=date_format, errors='coerce')
+        return _present(values) & parsed.isna()
+    
+    example = datetime(2015, 5, 15).strftime(date_format)
+    return ValidationRule('date', field, f"Invalid date for '{field}' (expected e.g. {example})", check)
+
+def _number_rule(field, spec):
+    low, high = spec.get('min'), spec.get('max')
+    low_exclusive = spec.get('min_exclusive', False)
+    
+    def check(values):
+        numbers = pd.to_numeric(values, errors='coerce')
+        bad = numbers.isna()
+        if low is not None:
+            bad |= (numbers <= low) if low_exclusive else (numbers < low)
+        if high is not None:
+            bad |= numbers > high
+        return _present(values) & bad
+    
+    if low is not None and high is not None:
+        message = f"'{field}' must be a number between {low} and {high}"
+    elif low is not None:
+        message = f"'{field}' must be a number {'greater than' if low_exclusive else 'of at least'} {low}"
+    else:
+        message = f"'{field}' must be a number"
+    return ValidationRule('range', field, message, check)
+
+def _enum_rule(field, spec):
+    choices = {choice.lower() for choice in spec['choices']}
+    
+    def check(values):
+        return _present(values) & ~values.str.lower().isin(choices)
+    
+    return ValidationRule('enum', field, f"'{field}' must be one of: {', '.join(spec['choices'])}", check)
+
+def _pattern_rule(field, spec):
+    pattern = spec['pattern']
+    
+    def check(values):
+        return _present(values) & ~values.str.fullmatch(pattern).fillna(False).astype(bool)
+    
+    return ValidationRule('pattern', field, f"Invalid {spec.get('description', field)} in '{field}'", check)
+
+_RULE_BUILDERS = {
+    "date": _date_rule,
+    "number": _number_rule,
+    "enum": _enum_rule,
+    "pattern": _pattern_rule,
+}
+
+class TemplateValidator:
+    """Column-wise validator compiled once from a migration template.
+    
+    Every rule checks a whole column with vectorized pandas operations, so
+    validation cost grows with the number of rules, not with Python work
+    per row. Values that are missing only fail the required rule.
+    """
+    
+    def __init__(self, template):
+        self.rules = []
+        for field in template['required_fields']:
+            self.rules.append(ValidationRule(
+                'required', field, f"Missing required field '{field}'", lambda values: ~_present(values)
+            ))
+        for field, spec in template.get('field_rules', {}).items():
+            builder = _RULE_BUILDERS.get(spec['type'])
+            if builder is None:
+                raise ValueError(f"Unknown rule type for '{field}': {spec['type']}")
+            self.rules.append(builder(field, spec))
+    
+    def validate(self, df):
+        """Apply every rule to df.
+        
+        Returns a list of (rule, mask) pairs, where mask is a boolean
+        Series that is True for failing rows, and a dict mapping each
+        failing rule's "field:name" key to the index labels of its rows.
+        """
+        results = []
+        failing = {}
+        for rule in self.rules:
+            if rule.field not in df.columns:
+                if rule.name != 'required':
+                    continue
+                mask = pd.Series(True, index=df.index)
+            else:
+                mask = rule.check(df[rule.field])
+            results.append((rule, mask))
+            if mask.any():
+                failing[f"{rule.field}:{rule.name}"] = df.index[mask.to_numpy()]
+        return results, failing
+
+def compile_validator(template):
+    """Build the column-wise validator for a migration template"""
+    return TemplateValidator(template)
+
+def _in_set(values, lookup):
+    """Boolean Series marking which values are members of a Python set.
+    
+    The hash lookups run in C through map() over the set's __contains__,
+    which stays linear in the column and avoids Series.isin rebuilding a
+    hash table from the whole set on every call.
+    """
+    flags = np.fromiter(map(lookup.__contains__, values.to_numpy(dtype=object)),
+                        dtype=bool, count=len(values))
+    return pd.Series(flags, index=values.index)
+
+def _cell_text(value):
+    """Text form of an openpyxl cell value, matching what a CSV export holds"""
+    if value is None:
+        return None
+    if isinstance(value, datetime):
+        if value.hour == value.minute == value.second == value.microsecond == 0:
+            return value.date().isoformat()
+        return value.isoformat(sep=' ')
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    text = str(value).strip()
+    return text or None
+
+def iter_xlsx_rows(file_path, columns=None, sheet_name=None):
+    """Yield the header and then each non-blank row of a sheet.
+    
+    Uses openpyxl in read-only mode, which streams the sheet XML instead of
+    building the whole workbook, so memory does not grow with the file.
+    With columns given only those columns are kept, in that order. Reads
+    the first sheet unless sheet_name is given.
+    """
+    from openpyxl import load_workbook
+    
+    workbook = load_workbook(file_path, read_only=True, data_only=True)
+    try:
+        sheet = workbook[sheet_name] if sheet_name is not None else workbook.worksheets[0]
+        rows = sheet.iter_rows(values_only=True)
+        header = None
+        positions = None
+        for row in rows:
+            if header is None:
+                values = [_cell_text(v) for v in row]
+                if not any(values):
+                    continue
+                while values and values[-1] is None:
+                    values.pop()
+                header = [v if v is not None else f"Unnamed: {i}" for i, v in enumerate(values)]
+                if columns is not None:
+                    missing = [col for col in columns if col not in header]
+                    if missing:
+                        raise ValueError(f"Columns not found in file: {', '.join(missing)}")
+                    positions = [header.index(col) for col in columns]
+                    header = list(columns)
+                yield header
+                continue
+            if positions is not None:
+                # Only convert the cells that were asked for
+                values = [_cell_text(row[i]) if i < len(row) else None for i in positions]
+            else:
+                values = [_cell_text(v) for v in row]
+                # Read-only rows can be shorter or longer than the header
+                values = values[:len(header)] + [None] * (len(header) - len(values))
+            if not any(values):
+                continue
+            yield values
+    finally:
+        workbook.close()
+
+def iter_xlsx_chunks(file_path, chunksize=READ_CHUNK_SIZE, nrows=None, columns=None, sheet_name=None):
+    """Yield DataFrames of at most chunksize rows from a sheet.
+    
+    Each chunk keeps a running index so row positions stay file-relative.
+    Reading stops after nrows data rows when nrows is given.
+    """
+    rows = iter_xlsx_rows(file_path, columns, sheet_name)
+    header = next(rows, None)
+    if header is None:
+        return
+    
+    offset = 0
+    chunk = []
+    for values in rows:
+        if nrows is not None and offset + len(chunk) >= nrows:
+            break
+        chunk.append(values)
+        if len(chunk) >= chunksize:
+            yield _text_frame(chunk, header, offset)
+            offset += len(chunk)
+            chunk = []
+    if chunk or offset == 0:
+        yield _text_frame(chunk, header, offset)
+    rows.close()
+
+def xlsx_sheet_headers(file_path):
+    """Header row of every non-empty sheet, keyed by sheet name in tab order"""
+    from openpyxl import load_workbook
+    
+    workbook = load_workbook(file_path, read_only=True)
+    try:
+        names = workbook.sheetnames
+    finally:
+        workbook.close()
+    
+    headers = {}
+    for name in names:
+        rows = iter_xlsx_rows(file_path, sheet_name=name)
+        header = next(rows, None)
+        rows.close()
+        if header:
+            headers[name] = header
+    return headers
+
+def _text_frame(rows, columns, offset=0):
+    df = pd.DataFrame(rows, columns=columns, dtype=object)
+    df.index = pd.RangeIndex(offset, offset + len(df))
+    return df
+
+class ParsedFileCache:
+    """Parsed uploads keyed on (path, size, mtime).
+    
+    A small LRU keeps recent DataFrames in memory. With spill enabled and
+    pyarrow installed each parsed file is also written to a Feather file,
+    which reloads without re-parsing CSV or Excel after eviction or in a
+    later session. Changing the file changes its key, so stale entries are
+    never returned. Frames parsed with only some columns are cached under
+    that column selection, and a full parse can serve any selection.
+    
+    The spill directory is trimmed to max_spill_bytes and max_spill_age
+    whenever a file is spilled or an entry leaves the in-memory LRU.
+    """
+    
+    def __init__(self, max_entries=2, spill_dir=DEFAULT_CACHE_DIR, max_spill_bytes=SPILL_MAX_BYTES,
+                 max_spill_age=SPILL_MAX_AGE_SECONDS):
+        self.max_entries = max_entries
+        self.spill_dir = spill_dir if spill_dir and _has_pyarrow() else None
+        self.max_spill_bytes = max_spill_bytes
+        self.max_spill_age = max_spill_age
+        self.lock = threading.Lock()
+        self._frames = OrderedDict()
+    
+    def key(self, file_path, columns=None):
+        stat = os.stat(file_path)
+        return (os.path.abspath(file_path), stat.st_size, stat.st_mtime_ns,
+                tuple(columns) if columns is not None else None)
+    
+    def _spill_path(self, key):
+        digest = hashlib.sha1(repr(key).encode('utf-8')).hexdigest()
+        return os.path.join(self.spill_dir, f"{digest}.feather")
+    
+    def get(self, file_path, columns=None):
+        """Return the cached DataFrame for a file, or None"""
+        if columns is not None:
+            df = self._get(self.key(file_path, columns))
+            if df is None:
+                df = self._get(self.key(file_path))
+                if df is not None and all(col in df.columns for col in columns):
+                    return df[list(columns)]
+                return None
+            return df
+        return self._get(self.key(file_path))
+    
+    def _get(self, key):
+        with self.lock:
+            if key in self._frames:
+                self._frames.move_to_end(key)
+                return self._frames[key]
+        
+        if self.spill_dir:
+            spill_path = self._spill_path(key)
+            if os.path.exists(spill_path):
+                try:
+                    df = pd.read_feather(spill_path)
+                    os.utime(spill_path)  # Recently used, for trimming
+                except FileNotFoundError:
+                    return None  # Trimmed by another thread meanwhile
+                except Exception:
+                    traceback.print_exc()
+                else:
+                    self._remember(key, df)
+                    return df
+        return None
+    
+    def put(self, file_path, df, columns=None):
+        """Cache a parsed DataFrame, spilling it to disk when enabled"""
+        key = self.key(file_path, columns)
+        self._remember(key, df)
+        
+        if self.spill_dir:
+            temp_path = None
+            try:
+                os.makedirs(self.spill_dir, exist_ok=True)
+                # Write then rename so a half-written file is never read;
+                # the temporary name is unique, as jobs may parse one file at once
+                fd, temp_path = tempfile.mkstemp(suffix='.tmp', dir=self.spill_dir)
+                os.close(fd)
+                df.to_feather(temp_path)
+                os.replace(temp_path, self._spill_path(key))
+            except Exception:
+                traceback.print_exc()
+                if temp_path and os.path.exists(temp_path):
+                    os.remove(temp_path)
+            self.trim_spill()
+    
+    def _remember(self, key, df):
+        with self.lock:
+            self._frames[key] = df
+            self._frames.move_to_end(key)
+            evicted = len(self._frames) > self.max_entries
+            while len(self._frames) > self.max_entries:
+                self._frames.popitem(last=False)
+        if evicted:
+            self.trim_spill()
+    
+    def trim_spill(self):
+        """Delete spill files past the age limit, then the least recently
+        used ones until the directory fits max_spill_bytes"""
+        if not self.spill_dir or not os.path.isdir(self.spill_dir):
+            return
+        now = time.time()
+        files = []
+        for entry in os.scandir(self.spill_dir):
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                continue
+            if entry.name.endswith('.tmp') and now - stat.st_mtime < self.max_spill_age:
+                continue  # Being written
+            files.append((stat.st_mtime, stat.st_size, entry.path))
+        
+        files.sort()
+        total = sum(size for _, size, _ in files)
+        for mtime, size, path in files:
+            if now - mtime <= self.max_spill_age and total <= self.max_spill_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+    
+    def clear(self):
+        with self.lock:
+            self._frames.clear()
+
+def _has_pyarrow():
+    """True if pyarrow is installed (for Feather spill files and the
+    multithreaded CSV parser).
+    
+    Only looks the package up, so checking does not pay for importing it.
+    """
+    return importlib.util.find_spec('pyarrow') is not None
+
+class MigrationStore:
+    """SQLite storage for migrated school data"""
+    
+    def __init__(self, db_path=DEFAULT_DB_PATH):
+        self.db_path = db_path
+        self.lock = threading.RLock()
+        self._savepoint_id = 0
+        # Tables whose natural key index could not be created, with
+        # examples of the keys stored more than once
+        self.key_conflicts = {}
+        
+        # Transactions are managed explicitly, and the connection is shared
+        # with import worker threads under self.lock
+        self.conn = sqlite3.connect(db_path, isolation_level=None, check_same_thread=False)
+        for pragma in STORE_PRAGMAS:
+            self.conn.execute(pragma)
+        self.create_schema()
+        
+        self.admission_index = AdmissionIndex(self)
+    
+    def create_schema(self):
+        """Create any missing tables and indexes"""
+        with self.transaction():
+            existing = {name for (name,) in self.conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+            for lookup, links_table, _ in TEACHER_LISTS.values():
+                columns = {row[1] for row in self.conn.execute(f"PRAGMA table_info({lookup})")}
+                if columns and 'name_key' not in columns:
+                    # Interned with NOCASE names; rebuilt from the teachers below
+                    self.conn.execute(f"DROP TABLE IF EXISTS {links_table}")
+                    self.conn.execute(f"DROP TABLE {lookup}")
+                    existing -= {lookup, links_table}
+            for ddl in STORE_SCHEMA.values():
+                self.conn.execute(ddl)
+            for ddl in STORE_INDEXES:
+                self.conn.execute(ddl)
+            for table, key in STORE_NATURAL_KEYS.items():
+                self._create_natural_key(table, key)
+            
+            # Derived tables new to an existing database start from its data
+            if 'fee_ledger' not in existing:
+                self._fill_fee_ledger()
+            for table in ASSESSMENT_STAT_TABLES:
+                if table not in existing:
+                    self._fill_assessment_stats(table)
+            for field, (_, links_table, _) in TEACHER_LISTS.items():
+                if links_table not in existing:
+                    self.set_teacher_lists(field, {
+                        tsc_number: split_names(value)
+                        for tsc_number, value in self.conn.execute(f"SELECT tsc_number, {field} FROM teachers")
+                    })
+    
+    def _create_natural_key(self, table, key):
+        """Unique index backing the upsert for a table.
+        
+        Databases created before natural keys existed may hold duplicate
+        keys. Their rows are never touched here: the index is left out,
+        the table goes into key_conflicts with examples of the keys, and
+        imports into it are refused until collapse_duplicate_keys is run.
+        """
+        if len(key) == 1:
+            return  # Declared UNIQUE in the table itself
+        name = f"ux_{table}_natural_key"
+        exists = self.conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'index' AND name = ?", (name,)
+        ).fetchone()
+        if exists:
+            return
+        columns = ', '.join(key)
+        # A unique index lets NULLs repeat, so only complete keys clash
+        duplicates = self.conn.execute(
+            f"SELECT {columns}, COUNT(*) FROM {table} WHERE {_all_present(key)} "
+            f"GROUP BY {columns} HAVING COUNT(*) > 1 LIMIT {KEY_CONFLICT_EXAMPLES}"
+        ).fetchall()
+        if duplicates:
+            self.key_conflicts[table] = duplicates
+            return
+        self.conn.execute(f"CREATE UNIQUE INDEX {name} ON {table}({columns})")
+    
+    def collapse_duplicate_keys(self, table, backup_path):
+        """Migrate a table in key_conflicts to its natural key.
+        
+        The whole database is first backed up to backup_path. Then only
+        the most recent row (the highest id) of each duplicated key is
+        kept, which is what an upsert would have left, the key's index is
+        created and the derived tables fed by the table are rebuilt.
+        Returns the number of rows deleted.
+        """
+        key = STORE_NATURAL_KEYS[table]
+        columns = ', '.join(key)
+        self.backup(backup_path)
+        with self.transaction():
+            deleted = self.conn.execute(
+                f"DELETE FROM {table} WHERE {_all_present(key)} AND id NOT IN "
+                f"(SELECT MAX(id) FROM {table} WHERE {_all_present(key)} GROUP BY {columns})"
+            ).rowcount
+            self.key_conflicts.pop(table, None)
+            self._create_natural_key(table, key)
+            if table == 'payments':
+                self.conn.execute("DELETE FROM fee_ledger")
+                self._fill_fee_ledger()
+            if table == 'assessments':
+                self._refill_assessment_stats()
+        return deleted
+    
+    @contextmanager
+    def transaction(self, rollback=False):
+        """Hold the store lock for one transaction.
+        
+        The transaction commits on success and rolls back on error, or
+        always when rollback is True (used for dry runs).
+        """
+        with self.lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield self.conn
+            except BaseException:
+                self.conn.execute("ROLLBACK")
+                raise
+            if rollback:
+                self.conn.execute("ROLLBACK")
+            else:
+                self.conn.execute("COMMIT")
+    
+    @contextmanager
+    def savepoint(self):
+        """Nested transaction inside transaction(); rolled back on error"""
+        self._savepoint_id += 1
+        name = f"sp_{self._savepoint_id}"
+        self.conn.execute(f"SAVEPOINT {name}")
+        try:
+            yield self.conn
+        except BaseException:
+            self.conn.execute(f"ROLLBACK TO {name}")
+            self.conn.execute(f"RELEASE {name}")
+            raise
+        self.conn.execute(f"RELEASE {name}")
+    
+    def insert_rows(self, table, columns, rows):
+        """Insert rows inside the current transaction.
+        
+        Tables with a natural key are upserted: a row whose key already
+        exists updates the given columns instead of being rejected, so
+        re-running an import is idempotent.
+        
+        The rows go through one executemany; if that hits a constraint
+        violation it is undone and the rows are retried one at a time so
+        that only the offending rows are rejected. Returns a list of
+        (position, message) for the rejected rows.
+        """
+        if table not in STORE_SCHEMA:
+            raise ValueError(f"Unknown table: {table}")
+        placeholders = ", ".join("?" for _ in columns)
+        sql = f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({placeholders})"
+        
+        key = STORE_NATURAL_KEYS.get(table)
+        if key and all(column in columns for column in key):
+            if table in self.key_conflicts:
+                examples = '; '.join(', '.join(map(str, row[:-1])) for row in self.key_conflicts[table])
+                raise ValueError(
+                    f"{table} already holds rows sharing a ({', '.join(key)}) key, e.g. {examples}. "
+                    f"Run 'newsystem.py dedupe --table {table}' to back the database up and keep "
+                    f"the latest of each before importing"
+                )
+            updates = [f"{column} = excluded.{column}" for column in columns if column not in key]
+            action = f"UPDATE SET {', '.join(updates)}" if updates else "NOTHING"
+            sql += f" ON CONFLICT({', '.join(key)}) DO {action}"
+        
+        try:
+            with self.savepoint():
+                self.conn.executemany(sql, rows)
+            return []
+        except sqlite3.IntegrityError:
+            pass
+        
+        # A failed single-row INSERT only undoes itself, so no savepoint
+        failures = []
+        for position, row in enumerate(rows):
+            try:
+                self.conn.execute(sql, row)
+            except sqlite3.IntegrityError as e:
+                failures.append((position, str(e)))
+        return failures
+    
+    def get_checkpoint(self, file_hash, data_type):
+        """Rows of a file already committed by an interrupted import"""
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT rows_done FROM import_checkpoints WHERE file_hash = ? AND data_type = ?",
+                (file_hash, data_type)
+            ).fetchone()
+        return row[0] if row else 0
+    
+    def save_checkpoint(self, file_hash, data_type, rows_done):
+        """Record progress; call inside the transaction that wrote the rows"""
+        self.conn.execute(
+            "INSERT INTO import_checkpoints (file_hash, data_type, rows_done, updated_at) "
+            "VALUES (?, ?, ?, ?) ON CONFLICT(file_hash, data_type) "
+            "DO UPDATE SET rows_done = excluded.rows_done, updated_at = excluded.updated_at",
+            (file_hash, data_type, rows_done, datetime.now().isoformat(timespec='seconds'))
+        )
+    
+    def clear_checkpoint(self, file_hash, data_type):
+        """Forget the checkpoint of a completed import"""
+        with self.transaction():
+            self.conn.execute(
+                "DELETE FROM import_checkpoints WHERE file_hash = ? AND data_type = ?",
+                (file_hash, data_type)
+            )
+    
+    def load_row_hashes(self, data_type):
+        """Stored (keys, hashes) int64 arrays of one data type's imported rows"""
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT row_key, row_hash FROM row_hashes WHERE data_type = ?", (data_type,)
+            ).fetchall()
+        pairs = np.array(rows, dtype=np.int64).reshape(-1, 2)
+        return pairs[:, 0], pairs[:, 1]
+    
+    def add_to_fee_ledger(self, rows):
+        """Fold per-(student, term) payment totals into the fee ledger.
+        
+        rows are (student_admission, term, paid, payments, last_payment_date)
+        tuples, one per group of a written batch; call inside the
+        transaction that wrote the payments.
+        """
+        self.conn.executemany(
+            "INSERT INTO fee_ledger (student_admission, term, paid, payments, last_payment_date) "
+            "VALUES (?, ?, ?, ?, ?) ON CONFLICT(student_admission, term) DO UPDATE SET "
+            "paid = paid + excluded.paid, "
+            "payments = payments + excluded.payments, "
+            "last_payment_date = CASE WHEN last_payment_date IS NULL "
+            "OR excluded.last_payment_date > last_payment_date "
+            "THEN excluded.last_payment_date ELSE last_payment_date END",
+            rows
+        )
+    
+    def lookup_payments(self, keys):
+        """Stored payments a batch is about to replace.
+        
+        keys are (student_admission, bank_slip_no) tuples; a key without a
+        slip never matches. Returns (position, term) per key, with term
+        None unless the key is already stored ('' for a payment stored
+        without one). Call inside the writing transaction.
+        """
+        self.conn.execute(
+            "CREATE TEMP TABLE IF NOT EXISTS batch_slips (position INTEGER PRIMARY KEY, "
+            "student_admission TEXT, bank_slip_no TEXT)"
+        )
+        self.conn.execute("DELETE FROM batch_slips")
+        self.conn.executemany(
+            "INSERT INTO batch_slips VALUES (?, ?, ?)",
+            ((position,) + tuple(key) for position, key in enumerate(keys))
+        )
+        return self.conn.execute(
+            """SELECT k.position, CASE WHEN p.id IS NULL THEN NULL ELSE COALESCE(p.term, '') END
+               FROM batch_slips k
+               LEFT JOIN payments p
+                   ON p.student_admission = k.student_admission AND p.bank_slip_no = k.bank_slip_no
+               ORDER BY k.position"""
+        ).fetchall()
+    
+    def refresh_fee_ledger(self, groups):
+        """Recount (student_admission, term) ledger rows from their payments.
+        
+        For groups where an upsert replaced a payment, whose old amount
+        the ledger cannot tell apart from the others.
+        """
+        for student_admission, term in groups:
+            self.conn.execute(
+                "DELETE FROM fee_ledger WHERE student_admission = ? AND term = ?", (student_admission, term)
+            )
+            self._fill_fee_ledger(
+                "WHERE student_admission = ? AND COALESCE(term, '') = ?", (student_admission, term)
+            )
+    
+    def rebuild_fee_ledger(self):
+        """Recompute the fee ledger from every payment; only for repairs"""
+        with self.transaction():
+            self.conn.execute("DELETE FROM fee_ledger")
+            self._fill_fee_ledger()
+    
+    def _fill_fee_ledger(self, condition='', params=()):
+        self.conn.execute(
+            "INSERT INTO fee_ledger (student_admission, term, paid, payments, last_payment_date) "
+            "SELECT student_admission, COALESCE(term, ''), SUM(amount), COUNT(*), MAX(payment_date) "
+            f"FROM payments {condition} GROUP BY student_admission, COALESCE(term, '')",
+            params
+        )
+    
+    def set_term_fee(self, term, amount, grade=''):
+        """Set the fee due for a term, for one grade or ('') every grade"""
+        with self.transaction():
+            self.conn.execute(
+                "INSERT INTO term_fees (term, grade, amount) VALUES (?, ?, ?) "
+                "ON CONFLICT(term, grade) DO UPDATE SET amount = excluded.amount",
+                (term, grade, amount)
+            )
+    
+    # Fee due from a student (s) for a term (t): the grade's own fee,
+    # else the fee for every grade, else nothing
+    _FEE_DUE = (
+        "COALESCE("
+        "(SELECT amount FROM term_fees WHERE term = t.term AND grade = s.current_grade), "
+        "(SELECT amount FROM term_fees WHERE term = t.term AND grade = ''), 0)"
+    )
+    
+    def fee_balances(self, student_admission):
+        """One student's fees due, paid and outstanding for every term"""
+        with self.lock:
+            rows = self.conn.execute(
+                f"""SELECT t.term, {self._FEE_DUE} AS due, COALESCE(l.paid, 0), COALESCE(l.payments, 0),
+                           l.last_payment_date
+                    FROM (SELECT term FROM term_fees
+                          UNION SELECT term FROM fee_ledger WHERE student_admission = :student) t
+                    LEFT JOIN students s ON s.admission_number = :student
+                    LEFT JOIN fee_ledger l ON l.student_admission = :student AND l.term = t.term
+                    ORDER BY t.term""",
+                {"student": student_admission}
+            ).fetchall()
+        return [
+            {"term": term, "due": due, "paid": paid, "balance": due - paid,
+             "payments": payments, "last_payment_date": last_payment_date}
+            for term, due, paid, payments, last_payment_date in rows
+        ]
+    
+    def fee_arrears(self, term):
+        """Students owing fees for a term, largest balance first.
+        
+        One ledger lookup per student, whatever the payment history.
+        """
+        with self.lock:
+            rows = self.conn.execute(
+                f"""SELECT admission_number, name, current_grade, due, paid, due - paid AS balance
+                    FROM (SELECT s.admission_number, s.name, s.current_grade,
+                                 {self._FEE_DUE} AS due, COALESCE(l.paid, 0) AS paid
+                          FROM students s
+                          CROSS JOIN (SELECT :term AS term) t
+                          LEFT JOIN fee_ledger l
+                              ON l.student_admission = s.admission_number AND l.term = t.term)
+                    WHERE due - paid > 0
+                    ORDER BY balance DESC, admission_number""",
+                {"term": term}
+            ).fetchall()
+        return [
+            {"admission_number": admission_number, "name": name, "grade": grade,
+             "due": due, "paid": paid, "balance": balance}
+            for admission_number, name, grade, due, paid, balance in rows
+        ]
+    
+    def lookup_assessments(self, keys):
+        """Student grades and any stored rows for a batch of assessments.
+        
+        keys are (student_admission, name, subject, date) tuples. Returns
+        (position, grade, term, competency_area, score) per key, where the
+        last three are None unless the key is already stored and about to
+        be replaced by an upsert. Call inside the writing transaction.
+        """
+        self.conn.execute(
+            "CREATE TEMP TABLE IF NOT EXISTS batch_keys (position INTEGER PRIMARY KEY, "
+            "student_admission TEXT, name TEXT, subject TEXT, date TEXT)"
+        )
+        self.conn.execute("DELETE FROM batch_keys")
+        self.conn.executemany(
+            "INSERT INTO batch_keys VALUES (?, ?, ?, ?, ?)",
+            ((position,) + tuple(key) for position, key in enumerate(keys))
+        )
+        return self.conn.execute(
+            """SELECT k.position, COALESCE(s.current_grade, ''), COALESCE(a.term, ''), a.competency_area, a.score
+               FROM batch_keys k
+               LEFT JOIN students s ON s.admission_number = k.student_admission
+               LEFT JOIN assessments a
+                   ON a.student_admission = k.student_admission AND a.name = k.name
+                  AND a.subject = k.subject AND a.date = k.date
+               ORDER BY k.position"""
+        ).fetchall()
+    
+    def add_assessment_stats(self, table, rows):
+        """Fold grouped (grade, term, key, count, total, squares, min, max)
+        rows into an aggregate table; call inside the writing transaction"""
+        dimension = ASSESSMENT_STAT_TABLES[table]
+        self.conn.executemany(
+            f"INSERT INTO {table} (grade, term, {dimension}, count, total, total_squares, min_score, max_score) "
+            f"VALUES (?, ?, ?, ?, ?, ?, ?, ?) ON CONFLICT(grade, term, {dimension}) DO UPDATE SET "
+            "count = count + excluded.count, "
+            "total = total + excluded.total, "
+            "total_squares = total_squares + excluded.total_squares, "
+            "min_score = MIN(min_score, excluded.min_score), "
+            "max_score = MAX(max_score, excluded.max_score)",
+            rows
+        )
+    
+    def refresh_assessment_stats(self, table, groups):
+        """Recount (grade, term, key) groups from their stored scores.
+        
+        For groups where an upsert replaced a score: totals could be
+        adjusted, but a replaced minimum or maximum cannot.
+        """
+        dimension = ASSESSMENT_STAT_TABLES[table]
+        for grade, term, value in groups:
+            self.conn.execute(
+                f"DELETE FROM {table} WHERE grade = ? AND term = ? AND {dimension} = ?", (grade, term, value)
+            )
+            self._fill_assessment_stats(
+                table,
+                f"AND a.{dimension} = ? AND COALESCE(a.term, '') = ? AND COALESCE(s.current_grade, '') = ?",
+                (value, term, grade)
+            )
+    
+    def rebuild_assessment_stats(self):
+        """Recompute every assessment aggregate and drop cached rankings"""
+        with self.transaction():
+            self._refill_assessment_stats()
+    
+    def _refill_assessment_stats(self):
+        for table in ASSESSMENT_STAT_TABLES:
+            self.conn.execute(f"DELETE FROM {table}")
+            self._fill_assessment_stats(table)
+        for table in ("ranked_classes", "class_rankings", "subject_rankings"):
+            self.conn.execute(f"DELETE FROM {table}")
+    
+    def _fill_assessment_stats(self, table, condition='', params=()):
+        dimension = ASSESSMENT_STAT_TABLES[table]
+        self.conn.execute(
+            f"""INSERT INTO {table} (grade, term, {dimension}, count, total, total_squares, min_score, max_score)
+                SELECT COALESCE(s.current_grade, ''), COALESCE(a.term, ''), a.{dimension},
+                       COUNT(*), SUM(a.score), SUM(a.score * a.score), MIN(a.score), MAX(a.score)
+                FROM assessments a
+                LEFT JOIN students s ON s.admission_number = a.student_admission
+                WHERE a.{dimension} IS NOT NULL AND a.score IS NOT NULL {condition}
+                GROUP BY 1, 2, 3""",
+            params
+        )
+    
+    def assessment_stats(self, grade, term, table="assessment_stats"):
+        """Aggregates of one class and term, with mean and standard deviation"""
+        dimension = ASSESSMENT_STAT_TABLES[table]
+        with self.lock:
+            rows = self.conn.execute(
+                f"SELECT {dimension}, count, total, total_squares, min_score, max_score FROM {table} "
+                f"WHERE grade = ? AND term = ? ORDER BY {dimension}",
+                (grade, term)
+            ).fetchall()
+        stats = []
+        for value, count, total, squares, low, high in rows:
+            mean = total / count
+            stats.append({
+                dimension: value, "count": count, "mean": mean, "min": low, "max": high,
+                "std": max(squares / count - mean * mean, 0.0) ** 0.5
+            })
+        return stats
+    
+    def lookup_grades(self, numbers):
+        """{admission_number: current_grade} of the stored students among
+        numbers, '' for no grade; call inside the writing transaction,
+        before the batch replaces them"""
+        self.conn.execute("CREATE TEMP TABLE IF NOT EXISTS batch_numbers (admission_number TEXT PRIMARY KEY)")
+        self.conn.execute("DELETE FROM batch_numbers")
+        self.conn.executemany("INSERT OR IGNORE INTO batch_numbers VALUES (?)", ((number,) for number in numbers))
+        return dict(self.conn.execute(
+            "SELECT s.admission_number, COALESCE(s.current_grade, '') FROM batch_numbers b "
+            "JOIN students s ON s.admission_number = b.admission_number"
+        ))
+    
+    def regrade_assessments(self, grades):
+        """Recount the aggregates and drop the cached rankings of whole
+        grades, after students moved into or out of them; call inside
+        the writing transaction"""
+        for grade in grades:
+            for table in ASSESSMENT_STAT_TABLES:
+                self.conn.execute(f"DELETE FROM {table} WHERE grade = ?", (grade,))
+                self._fill_assessment_stats(table, "AND COALESCE(s.current_grade, '') = ?", (grade,))
+            for table in ("ranked_classes", "class_rankings", "subject_rankings"):
+                self.conn.execute(f"DELETE FROM {table} WHERE grade = ?", (grade,))
+    
+    def invalidate_rankings(self, classes):
+        """Drop cached rankings of (grade, term) classes whose scores changed;
+        call inside the writing transaction"""
+        classes = list(classes)
+        for table in ("ranked_classes", "class_rankings", "subject_rankings"):
+            self.conn.executemany(f"DELETE FROM {table} WHERE grade = ? AND term = ?", classes)
+    
+    def unranked_classes(self, classes):
+        """The (grade, term) classes among these without cached rankings"""
+        with self.lock:
+            ranked = set(self.conn.execute("SELECT grade, term FROM ranked_classes").fetchall())
+        return [c for c in classes if tuple(c) not in ranked]
+    
+    def save_rankings(self, classes, rows, subject_rows):
+        """Cache rankings for (grade, term) classes.
+        
+        rows are (grade, term, student_admission, subjects, average,
+        position) tuples covering every student of those classes, and
+        subject_rows (grade, term, student_admission, subject, score,
+        position) tuples with each student's place per subject.
+        """
+        with self.transaction():
+            self.invalidate_rankings(classes)
+            self.conn.executemany("INSERT INTO class_rankings VALUES (?, ?, ?, ?, ?, ?)", rows)
+            self.conn.executemany("INSERT INTO subject_rankings VALUES (?, ?, ?, ?, ?, ?)", subject_rows)
+            ranked_at = datetime.now().isoformat(timespec='seconds')
+            self.conn.executemany(
+                "INSERT INTO ranked_classes (grade, term, ranked_at) VALUES (?, ?, ?)",
+                [(grade, term, ranked_at) for grade, term in classes]
+            )
+    
+    def class_scores(self, classes):
+        """(grade, term, student_admission, subject, score) rows of the
+        given (grade, term) classes, as one query"""
+        terms = sorted({term for _, term in classes})
+        wanted = {tuple(c) for c in classes}
+        with self.lock:
+            rows = self.conn.execute(
+                f"""SELECT COALESCE(s.current_grade, ''), COALESCE(a.term, ''), a.student_admission,
+                           a.subject, a.score
+                    FROM assessments a
+                    LEFT JOIN students s ON s.admission_number = a.student_admission
+                    WHERE COALESCE(a.term, '') IN ({', '.join('?' for _ in terms)})
+                      AND a.score IS NOT NULL""",
+                terms
+            ).fetchall()
+        return [row for row in rows if row[:2] in wanted]
+    
+    def get_rankings(self, grade, term):
+        """Cached rankings of a class, best first: (student_admission, name,
+        subjects, average, position, subject, score, subject position) per
+        student and subject"""
+        with self.lock:
+            return self.conn.execute(
+                """SELECT r.student_admission, s.name, r.subjects, r.average, r.position,
+                          sr.subject, sr.score, sr.position
+                   FROM class_rankings r
+                   JOIN subject_rankings sr
+                       ON sr.grade = r.grade AND sr.term = r.term AND sr.student_admission = r.student_admission
+                   LEFT JOIN students s ON s.admission_number = r.student_admission
+                   WHERE r.grade = ? AND r.term = ?
+                   ORDER BY r.position, r.student_admission, sr.subject""",
+                (grade, term)
+            ).fetchall()
+    
+    def set_teacher_lists(self, field, lists):
+        """Replace teachers' classes or subjects (field is the template
+        field) with {tsc_number: [names]}, interning new names; call
+        inside the writing transaction"""
+        lookup, links_table, id_column = TEACHER_LISTS[field]
+        # The first spelling seen of a name is the one kept
+        names = {}
+        for teacher_names in lists.values():
+            for name in teacher_names:
+                names.setdefault(name_key(name), name)
+        self.conn.executemany(
+            f"INSERT INTO {lookup} (name, name_key) VALUES (?, ?) ON CONFLICT(name_key) DO NOTHING",
+            ((name, key) for key, name in names.items())
+        )
+        ids = dict(self.conn.execute(f"SELECT name_key, id FROM {lookup}"))
+        self.conn.executemany(
+            f"DELETE FROM {links_table} WHERE tsc_number = ?", ((tsc_number,) for tsc_number in lists)
+        )
+        self.conn.executemany(
+            f"INSERT OR IGNORE INTO {links_table} ({id_column}, tsc_number) VALUES (?, ?)",
+            ((ids[name_key(name)], tsc_number) for tsc_number, teacher_names in lists.items() for name in teacher_names)
+        )
+    
+    def find_teachers(self, class_name=None, subject=None):
+        """Teachers listed for a class and/or subject, through the link
+        indexes rather than by splitting every teacher's lists.
+        
+        Classes and subjects are separate lists, so a teacher of Grade 5
+        and of Math counts as teaching Grade 5 Math.
+        """
+        conditions = []
+        params = []
+        for field, value in (("classes_teaching", class_name), ("subjects_teaching", subject)):
+            if value is None:
+                continue
+            lookup, links_table, id_column = TEACHER_LISTS[field]
+            conditions.append(
+                f"t.tsc_number IN (SELECT l.tsc_number FROM {links_table} l "
+                f"JOIN {lookup} n ON n.id = l.{id_column} WHERE n.name_key = ?)"
+            )
+            params.append(name_key(value))
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        with self.lock:
+            rows = self.conn.execute(
+                f"SELECT t.tsc_number, t.name, t.specialization, t.phone, t.email FROM teachers t {where} "
+                "ORDER BY t.name, t.tsc_number",
+                params
+            ).fetchall()
+        return [
+            {"tsc_number": tsc_number, "name": name, "specialization": specialization, "phone": phone, "email": email}
+            for tsc_number, name, specialization, phone, email in rows
+        ]
+    
+    def teacher_lists(self, tsc_number):
+        """A teacher's interned classes and subjects"""
+        result = {}
+        with self.lock:
+            for field, (lookup, links_table, id_column) in TEACHER_LISTS.items():
+                result[field] = [name for (name,) in self.conn.execute(
+                    f"SELECT n.name FROM {links_table} l JOIN {lookup} n ON n.id = l.{id_column} "
+                    "WHERE l.tsc_number = ? ORDER BY n.name_key",
+                    (tsc_number,)
+                )]
+        return result
+    
+    def get_mapping_profile(self, data_type, signature):
+        """Mapping confirmed earlier for a header signature, or None"""
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT mapping FROM mapping_profiles WHERE data_type = ? AND signature = ?",
+                (data_type, signature)
+            ).fetchone()
+        return json.loads(row[0]) if row else None
+    
+    def save_mapping_profile(self, data_type, signature, mapping):
+        """Remember a confirmed mapping for a header signature"""
+        with self.transaction():
+            self.conn.execute(
+                "INSERT INTO mapping_profiles (data_type, signature, mapping, updated_at) "
+                "VALUES (?, ?, ?, ?) ON CONFLICT(data_type, signature) "
+                "DO UPDATE SET mapping = excluded.mapping, updated_at = excluded.updated_at",
+                (data_type, signature, json.dumps(mapping, sort_keys=True),
+                 datetime.now().isoformat(timespec='seconds'))
+            )
+    
+    def claim_students(self, numbers, school):
+        """Record a school's admission numbers; call inside the transaction that wrote them"""
+        self.conn.executemany(
+            "INSERT INTO student_schools (admission_number, school) VALUES (?, ?) "
+            "ON CONFLICT(admission_number) DO NOTHING",
+            ((number, school) for number in numbers)
+        )
+    
+    def load_row_hash_version(self):
+        """ROW_HASH_VERSION the stored row hashes were made with (0 before versions)"""
+        with self.lock:
+            row = self.conn.execute("SELECT value FROM store_settings WHERE name = 'row_hash_version'").fetchone()
+        return int(row[0]) if row else 0
+    
+    def save_row_hash_version(self, version):
+        """Record the row hashing version; call inside the transaction that rehashed"""
+        self.conn.execute(
+            "INSERT INTO store_settings (name, value) VALUES ('row_hash_version', ?) "
+            "ON CONFLICT(name) DO UPDATE SET value = excluded.value",
+            (str(int(version)),)
+        )
+    
+    def clear_row_hashes(self, data_type):
+        """Forget a data type's row hashes; call inside a transaction"""
+        self.conn.execute("DELETE FROM row_hashes WHERE data_type = ?", (data_type,))
+    
+    def save_row_hashes(self, data_type, keys, hashes):
+        """Record written rows' hashes; call inside the transaction that wrote them"""
+        self.conn.executemany(
+            "INSERT INTO row_hashes (data_type, row_key, row_hash) VALUES (?, ?, ?) "
+            "ON CONFLICT(data_type, row_key) DO UPDATE SET row_hash = excluded.row_hash",
+            zip([data_type] * len(keys), keys.tolist(), hashes.tolist())
+        )
+    
+    def count(self, table):
+        """Number of rows stored in a table"""
+        if table not in STORE_SCHEMA:
+            raise ValueError(f"Unknown table: {table}")
+        with self.lock:
+            return self.conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+    
+    # Derived data sets exported next to the tables: columns and query
+    EXPORT_REPORTS = {
+        "fee_ledger": (
+            ["student_admission", "name", "current_grade", "term", "due", "paid", "balance",
+             "payments", "last_payment_date"],
+            f"""SELECT student_admission, name, current_grade, term, due, ROUND(paid, 2), ROUND(due - paid, 2),
+                       payments, last_payment_date
+                FROM (SELECT t.student_admission, s.name, s.current_grade, t.term, {_FEE_DUE} AS due,
+                             t.paid, t.payments, t.last_payment_date
+                      FROM fee_ledger t
+                      LEFT JOIN students s ON s.admission_number = t.student_admission)
+                ORDER BY student_admission, term"""
+        )
+    }
+    
+    @contextmanager
+    def snapshot(self):
+        """A read connection that sees the store as it was on entry.
+        
+        Exports read through it so they neither hold the store lock for
+        minutes nor see half of an import; WAL lets imports carry on.
+        """
+        conn = sqlite3.connect(self.db_path, isolation_level=None, check_same_thread=False)
+        try:
+            conn.execute("BEGIN")
+            conn.execute("SELECT COUNT(*) FROM sqlite_master").fetchone()  # Starts the read transaction
+            yield conn
+        finally:
+            conn.close()
+    
+    def backup(self, path):
+        """Copy the whole database to path with SQLite's online backup"""
+        source = sqlite3.connect(self.db_path)
+        target = sqlite3.connect(path)
+        try:
+            source.backup(target)
+        finally:
+            target.close()
+            source.close()
+    
+    @contextmanager
+    def scratch_copy(self):
+        """A MigrationStore on a private copy of this one, deleted on exit.
+        
+        A dry run rolls back one transaction that lasts the whole run; on
+        the copy it holds neither this store's lock nor SQLite's write lock
+        meanwhile. The copy is taken with the online backup API, which WAL
+        lets run alongside imports.
+        """
+        copy = self.open_copy()
+        try:
+            yield copy
+        finally:
+            copy.remove()
+    
+    def open_copy(self):
+        """A MigrationStore on a fresh backup of this one, in a private file
+        next to it; the caller deletes it with remove()"""
+        fd, path = tempfile.mkstemp(prefix='.dry-run-', suffix='.db',
+                                    dir=os.path.dirname(os.path.abspath(self.db_path)))
+        os.close(fd)
+        try:
+            self.backup(path)
+            return MigrationStore(path)
+        except BaseException:
+            for suffix in ('', '-wal', '-shm'):
+                _remove_file(path + suffix)
+            raise
+    
+    def remove(self):
+        """Close a copy from open_copy and delete its files"""
+        self.close()
+        for suffix in ('', '-wal', '-shm'):
+            _remove_file(self.db_path + suffix)
+    
+    def export_query(self, name, columns=None):
+        """(columns, SELECT) for a table's columns or an EXPORT_REPORTS entry.
+        
+        Whole REAL values come out as integers, 1500 rather than 1500.0,
+        the text an xlsx cell reads back as.
+        """
+        if name in self.EXPORT_REPORTS:
+            return self.EXPORT_REPORTS[name]
+        if name not in STORE_SCHEMA or not columns:
+            raise ValueError(f"Cannot export: {name}")
+        with self.lock:
+            types = {column: kind for _, column, kind, *_ in self.conn.execute(f"PRAGMA table_info({name})")}
+        selected = [
+            f"CASE WHEN {column} = CAST({column} AS INTEGER) THEN CAST({column} AS INTEGER) ELSE {column} END"
+            if types.get(column) == 'REAL' else column
+            for column in columns
+        ]
+        return columns, f"SELECT {', '.join(selected)} FROM {name} ORDER BY id"
+    
+    def iter_export(self, conn, query, chunksize=READ_CHUNK_SIZE):
+        """Rows of an export query on a snapshot, as lists of up to chunksize tuples"""
+        cursor = conn.execute(query)
+        while True:
+            rows = cursor.fetchmany(chunksize)
+            if not rows:
+                return
+            yield rows
+    
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+@contextmanager
+def _no_transaction():
+    """Stand-in for store.transaction() when each batch commits on its own"""
+    yield None
+
+def _error_recorder(df):
+    """Shared state for the validate_* methods.
+    
+    Returns the valid mask, the error list and record(mask, field, rule,
+    message), which clears failing rows from the mask and logs one error
+    per failing row.
+    """
+    valid = pd.Series(True, index=df.index)
+    errors = []
+    
+    def record(mask, field, rule, message):
+        if not mask.any():
+            return
+        valid[mask] = False
+        for idx in df.index[mask]:
+            errors.append({"row": int(idx) + 1, "field": field, "rule": rule, "error": message})
+    
+    return valid, errors, record
+
+class ErrorLog:
+    """Errors of one import, counted per rule and streamed to a rejects file.
+    
+    Only the first max_examples errors are kept in memory. With a
+    rejects_path every error is written there as it happens, with the
+    field and rule that failed and the row's original values.
+    """
+    
+    def __init__(self, rejects_path=None, max_examples=None):
+        self.rejects_path = rejects_path
+        self.max_examples = max_examples
+        self.examples = []
+        self.count = 0
+        self.rule_counts = Counter()
+        self._file = None
+        self._writer = None
+    
+    def add(self, errors, source):
+        """Log one chunk's errors; source is the chunk as read from the file"""
+        if not errors:
+            return
+        errors.sort(key=lambda e: e['row'])
+        self.count += len(errors)
+        self.rule_counts.update(
+            error['rule'] if error['field'] is None else f"{error['field']}: {error['rule']}" for error in errors
+        )
+        if self.max_examples is None:
+            self.examples.extend(errors)
+        else:
+            self.examples.extend(errors[:max(self.max_examples - len(self.examples), 0)])
+        
+        if self.rejects_path:
+            if self._writer is None:
+                os.makedirs(os.path.dirname(os.path.abspath(self.rejects_path)), exist_ok=True)
+                self._file = open(self.rejects_path, 'w', newline='', encoding='utf-8')
+                self._writer = csv.writer(self._file)
+                self._writer.writerow(['row', 'field', 'rule', 'error', *source.columns])
+            originals = source.loc[[error['row'] - 1 for error in errors]]
+            originals = originals.astype(object).where(originals.notna(), '')
+            self._writer.writerows(
+                [error['row'], error['field'] or '', error['rule'], error['error'], *values]
+                for error, values in zip(errors, originals.itertuples(index=False, name=None))
+            )
+    
+    def close(self):
+        """Finish the rejects file; returns its path, or None if nothing failed"""
+        if self._file is None:
+            return None
+        self._file.close()
+        self._file = None
+        return self.rejects_path
+
+def peak_rss_mb():
+    """Peak resident memory of this process in MB, or None where unavailable.
+    
+    On Linux the peak counts from the last reset_peak_rss().
+    """
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return round(int(line.split()[1]) / 1024, 1)
+    except OSError:
+        pass
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return round(peak / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+
+def reset_peak_rss():
+    """Restart the peak_rss_mb count from the current RSS, where the
+    system allows it (Linux 4.0 and later); returns whether it did"""
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+    except OSError:
+        return False
+    return True
+
+class ImportMetrics:
+    """Time and rows per import stage, summed over every chunk.
+    
+    Timing is two perf_counter calls per stage per chunk, so it is always
+    on. trace_memory adds each stage's tracemalloc peak and profile runs
+    the import under cProfile; both slow it down and are meant for
+    investigating a slow file.
+    """
+    
+    def __init__(self, trace_memory=False, profile=False):
+        self.stages = OrderedDict()
+        self.profiler = None
+        self._started = time.perf_counter()
+        self._tracemalloc = None
+        self._stop_tracing = False
+        if trace_memory:
+            import tracemalloc
+            self._tracemalloc = tracemalloc
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+                self._stop_tracing = True
+        if profile:
+            self.profiler = cProfile.Profile()
+            self.profiler.enable()
+    
+    def _stats(self, name):
+        stats = self.stages.get(name)
+        if stats is None:
+            stats = self.stages[name] = {"seconds": 0.0, "calls": 0, "rows": 0}
+        return stats
+    
+    @contextmanager
+    def stage(self, name, rows=0):
+        """Time the enclosed block as part of a stage; stages must not nest"""
+        stats = self._stats(name)
+        if self._tracemalloc is not None:
+            self._tracemalloc.reset_peak()
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            stats["seconds"] += time.perf_counter() - started
+            stats["calls"] += 1
+            stats["rows"] += rows
+            if self._tracemalloc is not None:
+                peak = round(self._tracemalloc.get_traced_memory()[1] / (1024 * 1024), 1)
+                stats["traced_peak_mb"] = max(stats.get("traced_peak_mb", 0.0), peak)
+    
+    def add(self, stages):
+        """Fold in stages measured elsewhere, such as in a worker process"""
+        for name, other in stages.items():
+            stats = self._stats(name)
+            stats["seconds"] += other["seconds"]
+            stats["calls"] += other["calls"]
+            stats["rows"] += other["rows"]
+            if "traced_peak_mb" in other:
+                stats["traced_peak_mb"] = max(stats.get("traced_peak_mb", 0.0), other["traced_peak_mb"])
+    
+    def finish(self):
+        """Stop any capture and return the metrics as a JSON-ready dict"""
+        result = {
+            "total_seconds": round(time.perf_counter() - self._started, 4),
+            "peak_rss_mb": peak_rss_mb(),
+            "stages": {
+                name: {
+                    **stats,
+                    "seconds": round(stats["seconds"], 4),
+                    "rows_per_sec": round(stats["rows"] / stats["seconds"])
+                    if stats["rows"] and stats["seconds"] > 0 else None
+                }
+                for name, stats in self.stages.items()
+            }
+        }
+        if self._stop_tracing:
+            self._tracemalloc.stop()
+            self._stop_tracing = False
+        self._tracemalloc = None
+        if self.profiler is not None:
+            self.profiler.disable()
+            functions = sorted(pstats.Stats(self.profiler).stats.items(), key=lambda item: -item[1][3])
+            result["profile"] = [
+                {
+                    "function": f"{os.path.basename(path)}:{line}({name})",
+                    "calls": calls,
+                    "own_seconds": round(own, 4),
+                    "cumulative_seconds": round(cumulative, 4)
+                }
+                for (path, line, name), (_, calls, own, cumulative, _) in functions[:PROFILE_TOP_FUNCTIONS]
+            ]
+        return result
+
+def format_stage_breakdown(metrics):
+    """One-line summary of where an import's time went"""
+    parts = [f"{name} {stats['seconds']:.2f}s" for name, stats in metrics['stages'].items()]
+    if metrics.get('peak_rss_mb') is not None:
+        parts.append(f"peak memory {metrics['peak_rss_mb']:.0f} MB")
+    return " | ".join(parts)
+
+def append_metrics_log(path, record):
+    """Append one JSON line describing a run to a metrics log"""
+    with open(path, 'a', encoding='utf-8') as f:
+        f.write(json.dumps({"time": datetime.now().isoformat(timespec='seconds'), **record}) + "\n")
+
+# A chunk of mapped rows compared with the hashes of earlier imports;
+# new and changed are boolean arrays aligned with the rows.
+RowDelta = namedtuple('RowDelta', 'keys hashes new changed')
+
+# Bumped whenever the values rows hash on change; stored hashes of an
+# older version are rebuilt from the store before they are compared.
+ROW_HASH_VERSION = 2
+
+def _row_hashes(data_type, df, occurrences=None):
+    """Vectorized (key, content) hashes of normalized rows, as int64 arrays.
+    
+    df comes from DataMigrationManager.normalize_rows, so rows that only
+    differ in how their values are written hash alike.
+    The key hashes the data type's natural key. Rows without a complete
+    one (types without a key, payments without a slip) are keyed on
+    content plus occurrence so that identical rows, such as two equal
+    payments, stay distinct; occurrences carries the counts from earlier
+    chunks of the same file.
+    """
+    content = pd.Series(
+        pd.util.hash_pandas_object(df[sorted(df.columns)], index=False).to_numpy().view(np.int64),
+        index=df.index
+    )
+    keys = np.empty(len(df), dtype=np.int64)
+    key_fields = STORE_NATURAL_KEYS.get(data_type)
+    if key_fields and all(field in df.columns for field in key_fields):
+        keyed = df[key_fields].notna().all(axis=1).to_numpy()
+        keys[keyed] = pd.util.hash_pandas_object(df[key_fields][keyed], index=False).to_numpy().view(np.int64)
+    else:
+        keyed = np.zeros(len(df), dtype=bool)
+    if not keyed.all():
+        loose = content[~keyed]
+        occurrence = loose.groupby(loose).cumcount()
+        if occurrences is not None:
+            occurrence += loose.map(occurrences).fillna(0).astype(np.int64)
+            for value, count in loose.value_counts().items():
+                occurrences[value] = occurrences.get(value, 0) + count
+        keys[~keyed] = pd.util.hash_pandas_object(
+            pd.DataFrame({"content": loose, "occurrence": occurrence}), index=False
+        ).to_numpy().view(np.int64)
+    return keys, content.to_numpy()
+
+# Fuzzy matches below this similarity are not suggested
+FUZZY_MATCH_CUTOFF = 0.8
+
+def normalize_header(name):
+    """Lower-case words of a column name, for matching ("Adm. No" -> "adm no")"""
+    return ' '.join(re.findall(r'[a-z0-9]+', str(name).lower()))
+
+def header_signature(columns):
+    """Stable hash of a file's column names, identifying its export format.
+    
+    Order is ignored so that a reordered export still matches.
+    """
+    names = sorted(str(column).strip() for column in columns)
+    return hashlib.sha1(json.dumps(names).encode('utf-8')).hexdigest()
+
+def match_fields(columns, template):
+    """Suggest a system field for each file column.
+    
+    A column matches a field by its name, by one of the template's
+    aliases, or failing both by similarity to either. Each field goes to
+    its best column, exact matches first. Returns {column: (field, score)}
+    with score 1.0 for name and alias matches.
+    """
+    fields = template['required_fields'] + template['optional_fields']
+    names = {}
+    for field in fields:
+        for name in [field] + template.get('field_aliases', {}).get(field, []):
+            names.setdefault(normalize_header(name), field)
+    
+    candidates = []
+    for column in columns:
+        key = normalize_header(column)
+        if not key:
+            continue
+        if key in names:
+            candidates.append((1.0, column, names[key]))
+            continue
+        matcher = difflib.SequenceMatcher(b=key)
+        best = None
+        for name, field in names.items():
+            matcher.set_seq1(name)
+            if matcher.real_quick_ratio() < FUZZY_MATCH_CUTOFF or matcher.quick_ratio() < FUZZY_MATCH_CUTOFF:
+                continue
+            score = matcher.ratio()
+            if score >= FUZZY_MATCH_CUTOFF and (best is None or score > best[0]):
+                best = (score, column, field)
+        if best:
+            candidates.append(best)
+    
+    matches = {}
+    taken = set()
+    for score, column, field in sorted(candidates, key=lambda c: -c[0]):
+        if field not in taken and column not in matches:
+            matches[column] = (field, score)
+            taken.add(field)
+    return matches
+
+def name_key(name):
+    """What class and subject names are matched on: spacing collapsed and
+    casefolded, so "ÉCOLE  Club" and "école club" are the same name"""
+    return ' '.join(str(name).split()).casefold()
+
+def split_names(value):
+    """Names in a comma-separated list cell, trimmed and without blanks or
+    repeats ("Grade 4, grade 4,Math " -> ["Grade 4", "Math"])"""
+    names = {}
+    for part in str(value or '').split(','):
+        name = ' '.join(part.split())
+        if name:
+            names.setdefault(name_key(name), name)
+    return list(names.values())
+
+def fee_ledger_rows(payments):
+    """Per-(student, term) totals of a batch of payments for the fee ledger.
+    
+    Payments without a term are booked under ''. Returns tuples for
+    MigrationStore.add_to_fee_ledger.
+    """
+    term = payments['term'].astype(object) if 'term' in payments else pd.Series(None, index=payments.index)
+    groups = pd.DataFrame({
+        "student_admission": payments['student_admission'].astype(object),
+        "term": term.where(term.notna() & (term != ''), ''),
+        "amount": pd.to_numeric(payments['amount'].astype(object), errors='coerce'),
+        # Parsed, so that max runs in cython rather than over Python strings
+        "payment_date": pd.to_datetime(payments['payment_date'].astype(object), format='%Y-%m-%d', errors='coerce')
+    }).groupby(['student_admission', 'term'], sort=False).agg(
+        paid=('amount', 'sum'), payments=('amount', 'size'), last_payment_date=('payment_date', 'max')
+    )
+    last_dates = groups['last_payment_date'].dt.strftime('%Y-%m-%d').astype(object)
+    return list(zip(
+        groups.index.get_level_values(0).tolist(), groups.index.get_level_values(1).tolist(),
+        groups['paid'].astype(float).tolist(), groups['payments'].astype(int).tolist(),
+        last_dates.where(last_dates.notna(), None).tolist()
+    ))
+
+def assessment_stat_rows(scores, dimension):
+    """Per-(grade, term, dimension) count, total, sum of squares, min and
+    max of scored rows, as tuples for MigrationStore.add_assessment_stats"""
+    scored = scores[scores[dimension].notna() & scores['score'].notna()]
+    groups = scored.assign(squares=scored['score'] ** 2).groupby(['grade', 'term', dimension], sort=False).agg(
+        count=('score', 'size'), total=('score', 'sum'), squares=('squares', 'sum'),
+        low=('score', 'min'), high=('score', 'max')
+    )
+    return list(zip(
+        groups.index.get_level_values(0).tolist(), groups.index.get_level_values(1).tolist(),
+        groups.index.get_level_values(2).tolist(), groups['count'].astype(int).tolist(),
+        groups['total'].tolist(), groups['squares'].tolist(), groups['low'].tolist(), groups['high'].tolist()
+    ))
 
 class DataMigrationManager:
-    def __init__(self, school):
+    def __init__(self, school, store=None, file_cache=None):
         self.school = school
+        self._store = store
+        self.file_cache = file_cache or ParsedFileCache()
+        self._validators = {}
         self.migration_templates = {
             "students": {
                 "required_fields": ["name", "birth_date", "gender", "admission_number"],
                 "optional_fields": ["current_grade"],
+                "unique_fields": ["admission_number"],
+                "categorical_fields": ["gender", "current_grade"],
+                "field_aliases": {
+                    "name": ["student name", "full name", "learner name", "names"],
+                    "birth_date": ["dob", "date of birth", "birth date", "birthday"],
+                    "gender": ["sex"],
+                    "admission_number": ["adm no", "adm", "admission no", "adm number", "reg no",
+                                         "registration number", "student number"],
+                    "current_grade": ["grade", "class", "current class", "form", "stream"]
+                },
+                "field_rules": {
+                    "birth_date": {"type": "date"},
+                    "gender": {"type": "enum", "choices": ["Male", "Female"]}
+                },
                 "sample_data": {
                     "name": "John Doe",
                     "birth_date": "2015-05-15",
@@ -26,6 +2317,21 @@ class DataMigrationManager:
             "parents": {
                 "required_fields": ["student_admission", "name", "phone", "relationship"],
                 "optional_fields": ["email"],
+                "foreign_keys": ["student_admission"],
+                "categorical_fields": ["relationship"],
+                "field_aliases": {
+                    "student_admission": ["adm no", "adm", "admission no", "admission number",
+                                          "student adm no", "student admission number"],
+                    "name": ["parent name", "guardian name", "parent guardian name", "full name"],
+                    "phone": ["phone number", "mobile", "mobile no", "tel", "telephone", "contact"],
+                    "relationship": ["relation", "relationship to student"],
+                    "email": ["email address", "e mail"]
+                },
+                "field_rules": {
+                    "phone": {"type": "pattern", "pattern": PHONE_PATTERN, "description": "phone number"},
+                    "relationship": {"type": "enum", "choices": ["Mother", "Father", "Guardian", "Sibling", "Grandparent", "Other"]},
+                    "email": {"type": "pattern", "pattern": EMAIL_PATTERN, "description": "email address"}
+                },
                 "sample_data": {
                     "student_admission": "SCH2023001",
                     "name": "Mary Doe",
@@ -37,6 +2343,21 @@ class DataMigrationManager:
             "teachers": {
                 "required_fields": ["name", "tsc_number", "specialization"],
                 "optional_fields": ["phone", "email", "classes_teaching", "subjects_teaching"],
+                "unique_fields": ["tsc_number"],
+                "categorical_fields": ["specialization"],
+                "field_aliases": {
+                    "name": ["teacher name", "full name", "names"],
+                    "tsc_number": ["tsc no", "tsc", "tsc number", "staff number"],
+                    "specialization": ["specialisation", "department", "area"],
+                    "phone": ["phone number", "mobile", "mobile no", "tel", "telephone"],
+                    "email": ["email address", "e mail"],
+                    "classes_teaching": ["classes", "classes taught"],
+                    "subjects_teaching": ["subjects", "subjects taught"]
+                },
+                "field_rules": {
+                    "phone": {"type": "pattern", "pattern": PHONE_PATTERN, "description": "phone number"},
+                    "email": {"type": "pattern", "pattern": EMAIL_PATTERN, "description": "email address"}
+                },
                 "sample_data": {
                     "name": "Jane Smith",
                     "tsc_number": "TSC12345",
@@ -50,6 +2371,20 @@ class DataMigrationManager:
             "assessments": {
                 "required_fields": ["student_admission", "name", "subject", "score", "date"],
                 "optional_fields": ["term", "competency_area"],
+                "foreign_keys": ["student_admission"],
+                "categorical_fields": ["subject", "term", "competency_area"],
+                "field_aliases": {
+                    "student_admission": ["adm no", "adm", "admission no", "admission number"],
+                    "name": ["assessment", "assessment name", "exam", "exam name", "test"],
+                    "subject": ["learning area", "subject name"],
+                    "score": ["marks", "mark", "percentage", "points"],
+                    "date": ["assessment date", "exam date", "date done"],
+                    "competency_area": ["competency", "strand"]
+                },
+                "field_rules": {
+                    "score": {"type": "number", "min": 0, "max": 100},
+                    "date": {"type": "date"}
+                },
                 "sample_data": {
                     "student_admission": "SCH2023001",
                     "name": "Term 1 Math Exam",
@@ -63,6 +2398,22 @@ class DataMigrationManager:
             "payments": {
                 "required_fields": ["student_admission", "amount", "payment_date"],
                 "optional_fields": ["payment_method", "bank_slip_no", "term", "description"],
+                "foreign_keys": ["student_admission"],
+                "categorical_fields": ["payment_method", "term"],
+                "field_aliases": {
+                    "student_admission": ["adm no", "adm", "admission no", "admission number"],
+                    "amount": ["amount paid", "paid", "kes", "amount kes"],
+                    "payment_date": ["date", "date paid", "transaction date", "receipt date"],
+                    "payment_method": ["method", "mode", "payment mode", "channel"],
+                    "bank_slip_no": ["slip no", "receipt no", "reference", "ref", "transaction code",
+                                     "mpesa code", "transaction id"],
+                    "description": ["narration", "details", "particulars", "vote head"]
+                },
+                "field_rules": {
+                    "amount": {"type": "number", "min": 0, "min_exclusive": True},
+                    "payment_date": {"type": "date"},
+                    "payment_method": {"type": "enum", "choices": ["MPesa", "Cash", "Bank", "Cheque", "Card"]}
+                },
                 "sample_data": {
                     "student_admission": "SCH2023001",
                     "amount": "1500",
@@ -74,6 +2425,2312 @@ class DataMigrationManager:
                 }
             }
         }
+    
+    @property
+    def store(self):
+        """The school's store, opened on first use so that bulk-import
+        workers, which only parse and validate, never open the database"""
+        if self._store is None:
+            self._store = getattr(self.school, 'store', None) or MigrationStore()
+        return self._store
+    
+    def get_migration_template(self, data_type):
+        """Return the migration template for a data type, or None"""
+        return self.migration_templates.get(data_type)
+    
+    def suggest_mapping(self, data_type, columns):
+        """Mapping for a file's columns, and how each column was matched.
+        
+        A mapping confirmed earlier for the same header signature is reused,
+        minus columns and fields that no longer exist; otherwise columns are
+        matched by name, alias and similarity. Returns (mapping, matches),
+        where matches labels each mapped column "saved", "exact", "alias"
+        or with its similarity as a percentage.
+        """
+        template = self.get_migration_template(data_type)
+        fields = set(template['required_fields']) | set(template['optional_fields'])
+        present = set(columns)
+        saved = self.store.get_mapping_profile(data_type, header_signature(columns))
+        if saved is not None:
+            mapping = {column: field for column, field in saved.items() if column in present and field in fields}
+            return mapping, {column: "saved" for column in mapping}
+        
+        mapping = {}
+        matches = {}
+        for column, (field, score) in match_fields(columns, template).items():
+            mapping[column] = field
+            if score < 1.0:
+                matches[column] = f"{score:.0%}"
+            elif normalize_header(column) == normalize_header(field):
+                matches[column] = "exact"
+            else:
+                matches[column] = "alias"
+        return mapping, matches
+    
+    def save_mapping_profile(self, data_type, columns, mapping):
+        """Remember a confirmed mapping for files with the same header"""
+        self.store.save_mapping_profile(data_type, header_signature(columns), mapping)
+    
+    def get_validator(self, data_type):
+        """Return the compiled validator for a data type, compiling it once"""
+        validator = self._validators.get(data_type)
+        if validator is None:
+            template = self.get_migration_template(data_type)
+            if not template:
+                raise ValueError(f"Invalid data type: {data_type}")
+            validator = self._validators[data_type] = compile_validator(template)
+        return validator
+    
+    def read_dtypes(self, data_type, mapping):
+        """Dtype map for the mapped file columns, derived from the template.
+        
+        Low-cardinality fields listed under categorical_fields load as
+        categoricals; everything else loads as text.
+        """
+        template = self.get_migration_template(data_type)
+        if not template:
+            raise ValueError(f"Invalid data type: {data_type}")
+        categorical = set(template.get('categorical_fields', []))
+        return {
+            file_field: 'category' if system_field in categorical else str
+            for file_field, system_field in mapping.items()
+        }
+    
+    def read_file(self, file_path, columns=None, dtypes=None):
+        """Read a CSV or Excel file into a DataFrame of stripped strings.
+        
+        columns limits the read to those file columns and dtypes maps
+        column names to dtypes (text by default).
+        """
+        if file_path.endswith('.csv'):
+            df = read_csv(file_path, columns, dtypes)
+        elif file_path.endswith('.xlsx'):
+            df = pd.concat(list(iter_xlsx_chunks(file_path, columns=columns)))
+            if dtypes:
+                df = df.astype(dtypes)
+        elif file_path.endswith('.xls'):
+            df = pd.read_excel(file_path, usecols=columns, dtype=dtypes or str)
+        else:
+            raise ValueError("Unsupported file format")
+        
+        if columns is not None:
+            df = df[list(columns)]
+        return self._clean(df.reset_index(drop=True))
+    
+    def _clean(self, df):
+        """Strip whitespace from every text column, in place"""
+        for col in df.columns:
+            values = df[col]
+            if isinstance(values.dtype, pd.CategoricalDtype):
+                # Strip the categories rather than every value
+                stripped = values.cat.categories.astype(str).str.strip()
+                if stripped.is_unique:
+                    df[col] = values.cat.rename_categories(stripped)
+                else:
+                    df[col] = values.astype(object).str.strip().astype('category')
+            else:
+                df[col] = values.str.strip()
+        return df
+    
+    def read_head(self, file_path, nrows=PREVIEW_ROWS):
+        """Read only the header and the first nrows rows of a file.
+        
+        Enough for header validation and the preview; a cached parse is
+        used when there is one, and xlsx files are streamed so the rest of
+        the workbook is never loaded.
+        """
+        df = self.file_cache.get(file_path)
+        if df is not None:
+            return df.head(nrows)
+        if file_path.endswith('.csv'):
+            return self._clean(read_csv(file_path, nrows=nrows))
+        if file_path.endswith('.xlsx'):
+            return self._clean(next(iter_xlsx_chunks(file_path, nrows=nrows)))
+        if file_path.endswith('.xls'):
+            return self._clean(pd.read_excel(file_path, dtype=str, nrows=nrows))
+        raise ValueError("Unsupported file format")
+    
+    def iter_chunks(self, file_path, chunksize=READ_CHUNK_SIZE, columns=None, dtypes=None):
+        """Yield the file as DataFrame chunks with file-relative indexes.
+        
+        Cached files are sliced. Files below STREAM_THRESHOLD_BYTES are
+        parsed once and cached; larger CSV and xlsx files are streamed so
+        memory stays flat however big the file is. columns and dtypes are
+        passed through to the reader as in read_file.
+        """
+        df = self.file_cache.get(file_path, columns)
+        if df is None and (os.path.getsize(file_path) < STREAM_THRESHOLD_BYTES
+                           or not file_path.endswith(('.csv', '.xlsx'))):
+            df = self.load_file(file_path, columns, dtypes)
+        
+        if df is not None:
+            for start in range(0, max(len(df), 1), chunksize):
+                yield df.iloc[start:start + chunksize]
+        elif file_path.endswith('.csv'):
+            for chunk in iter_csv_chunks(file_path, chunksize, columns, dtypes):
+                yield self._clean(chunk)
+        else:
+            for chunk in iter_xlsx_chunks(file_path, chunksize, columns=columns):
+                yield self._clean(chunk.astype(dtypes) if dtypes else chunk)
+    
+    def load_file(self, file_path, columns=None, dtypes=None):
+        """Return the parsed file, parsing it only if it is not cached"""
+        df = self.file_cache.get(file_path, columns)
+        if df is None:
+            df = self.read_file(file_path, columns, dtypes)
+            self.file_cache.put(file_path, df, columns)
+        return df
+    
+    def count_records(self, file_path):
+        """Number of data records in a file, without parsing it if possible"""
+        df = self.file_cache.get(file_path)
+        if df is not None:
+            return len(df)
+        if file_path.endswith('.csv') and _ascii_compatible(sniff_csv(file_path).encoding):
+            return count_csv_records(file_path)
+        if file_path.endswith('.xlsx'):
+            return count_xlsx_records(file_path)
+        return len(self.load_file(file_path))
+    
+    def apply_mapping(self, df, mapping):
+        """Select the mapped file columns and rename them to system fields"""
+        system_fields = list(mapping.values())
+        duplicates = sorted({f for f in system_fields if system_fields.count(f) > 1})
+        if duplicates:
+            raise ValueError(f"System fields mapped more than once: {', '.join(duplicates)}")
+        
+        missing_columns = [col for col in mapping if col not in df.columns]
+        if missing_columns:
+            raise ValueError(f"Mapped columns not found in file: {', '.join(missing_columns)}")
+        
+        return df[list(mapping.keys())].rename(columns=mapping)
+    
+    def validate_data(self, data_type, df, seen=None, school=None):
+        """Validate mapped data column by column.
+        
+        Returns a boolean Series marking the valid rows and a list of
+        error dicts (row, field, rule, error) for the rows that failed. When the
+        file is validated in chunks, pass the same seen dict for every
+        chunk so duplicates are caught across chunk boundaries.
+        """
+        valid, errors = self.validate_intrinsic(data_type, df, seen)
+        ref_valid, ref_errors = self.validate_references(data_type, df, school)
+        errors.extend(ref_errors)
+        errors.sort(key=lambda e: e['row'])
+        return valid & ref_valid, errors
+    
+    def validate_intrinsic(self, data_type, df, seen=None):
+        """Checks that need only the file itself: field rules and in-file
+        duplicates. Safe to run in a worker process without the store."""
+        template = self.get_migration_template(data_type)
+        if not template:
+            raise ValueError(f"Invalid data type: {data_type}")
+        
+        valid, errors, record = _error_recorder(df)
+        
+        results, _ = self.get_validator(data_type).validate(df)
+        for rule, mask in results:
+            record(mask, rule.field, rule.name, rule.message)
+        
+        for field in template.get('unique_fields', []):
+            if field not in df.columns:
+                continue
+            present = df[field].notna() & (df[field] != '')
+            duplicated = present & df[field].duplicated(keep='first')
+            if seen is not None:
+                earlier = seen.setdefault(field, set())
+                duplicated |= present & _in_set(df[field], earlier)
+                earlier.update(df.loc[present, field])
+            record(duplicated, field, 'unique', f"Duplicate {field.replace('_', ' ')}")
+        
+        return valid, errors
+    
+    def validate_references(self, data_type, df, school=None):
+        """Checks against data already in the store, via the admission index.
+        
+        With a school, admission numbers another school has claimed are
+        rejected, as students or as references: the store has one
+        students table, so they would overwrite or attach to that
+        school's child.
+        """
+        template = self.get_migration_template(data_type)
+        if not template:
+            raise ValueError(f"Invalid data type: {data_type}")
+        
+        valid, errors, record = _error_recorder(df)
+        
+        # One hash lookup per row over the whole column, never a query per row.
+        # Students already in the store are not errors: writes upsert on
+        # admission_number.
+        index = self.store.admission_index
+        for field in template.get('foreign_keys', []):
+            if field not in df.columns:
+                continue
+            present = df[field].notna() & (df[field] != '')
+            record(present & ~index.contains(df[field]), field, 'foreign_key', "Unknown student admission number")
+            if school:
+                record(present & index.claimed_elsewhere(df[field], school), field, 'school',
+                       "Student belongs to another school")
+        if school and data_type == 'students' and 'admission_number' in df.columns:
+            record(index.claimed_elsewhere(df['admission_number'], school), 'admission_number', 'school',
+                   "Admission number belongs to another school")
+        
+        return valid, errors
+    
+    def import_data(self, data_type, file_path, mapping, dry_run=False, batch_size=IMPORT_BATCH_SIZE,
+                    progress=None, cancel_event=None, rejects_path=None, max_errors=None, metrics=None,
+                    school=None):
+        """Import a file: map and validate each chunk, then commit in batches.
+        
+        Each batch is written in its own transaction. A dry run writes
+        every batch inside one transaction that is rolled back at the end,
+        so it measures the real write cost and reports real constraint
+        violations without saving anything.
+        progress(done, total) is called after every batch, and setting
+        cancel_event stops the import cleanly before the next batch.
+        
+        Errors are counted per rule; the result keeps the first max_errors
+        of them (all by default), and with rejects_path every rejected row
+        is streamed to that CSV as the import runs.
+        
+        Time spent in each stage is recorded in metrics (a fresh
+        ImportMetrics by default) and returned under "metrics".
+        
+        Valid rows are compared with the hashes stored by earlier imports
+        and only new or changed rows are written, so re-sending a full
+        export writes just its changes.
+        
+        Committed imports record a checkpoint with each batch, keyed by
+        the file content and mapping. Running an interrupted import again
+        skips the rows it already committed; a completed import clears its
+        checkpoint.
+        
+        With a school, the students written are claimed for it, and rows
+        using admission numbers claimed by another school are rejected
+        (see validate_references).
+        """
+        template = self.get_migration_template(data_type)
+        if not template:
+            raise ValueError(f"Invalid data type: {data_type}")
+        metrics = metrics or ImportMetrics()
+        
+        checkpoint = None
+        resume_from = 0
+        if not dry_run:
+            with metrics.stage('checkpoint'):
+                checkpoint = (self.checkpoint_key(file_path, mapping), data_type)
+                resume_from = self.store.get_checkpoint(*checkpoint)
+        
+        with metrics.stage('count'):
+            total = self.count_records(file_path)
+        if progress:
+            progress(0, total)
+        
+        # Read only the mapped columns, with template-driven dtypes
+        columns = list(mapping.keys())
+        dtypes = self.read_dtypes(data_type, mapping)
+        
+        processed = 0
+        imported = 0
+        failed = 0
+        error_log = ErrorLog(rejects_path, max_errors)
+        seen = {}
+        cancelled = False
+        with metrics.stage('index'):
+            stored = self.stored_row_hashes(data_type)
+        occurrences = {}
+        delta_counts = {"new": 0, "changed": 0, "unchanged": 0}
+        
+        try:
+            with self.store.transaction(rollback=True) if dry_run else _no_transaction():
+                chunks = self.iter_chunks(file_path, columns=columns, dtypes=dtypes)
+                while True:
+                    with metrics.stage('read'):
+                        chunk = next(chunks, None)
+                    if chunk is None:
+                        break
+                    with metrics.stage('map', len(chunk)):
+                        df = self.apply_mapping(chunk, mapping)
+                    if len(df) and df.index[0] < resume_from:
+                        # Committed by an interrupted run; only remember
+                        # its keys for the in-file duplicate check
+                        done = df.loc[:resume_from - 1]
+                        self.validate_intrinsic(data_type, done, seen=seen)
+                        self.row_hashes(data_type, done, occurrences)
+                        processed += len(done)
+                        df = df.loc[resume_from:]
+                        if not len(df):
+                            continue
+                    
+                    with metrics.stage('validate', len(df)):
+                        valid, chunk_errors = self.validate_intrinsic(data_type, df, seen)
+                    with metrics.stage('references', len(df)):
+                        ref_valid, ref_errors = self.validate_references(data_type, df, school)
+                    valid &= ref_valid
+                    chunk_errors.extend(ref_errors)
+                    failed += int((~valid).sum())
+                    
+                    def on_batch(batch):
+                        if progress:
+                            progress(processed + int(batch.index[-1] - df.index[0]) + 1, total)
+                    
+                    rows = df[valid]
+                    with metrics.stage('delta', len(rows)):
+                        delta = self.classify_rows(data_type, rows, stored, occurrences)
+                        changes = delta.new | delta.changed
+                        row_hashes = pd.DataFrame({"key": delta.keys, "hash": delta.hashes}, index=rows.index)
+                    delta_counts["new"] += int(delta.new.sum())
+                    delta_counts["changed"] += int(delta.changed.sum())
+                    delta_counts["unchanged"] += int((~changes).sum())
+                    
+                    with metrics.stage('write', int(changes.sum())):
+                        written, rejected, cancelled = self._write_rows(
+                            data_type, rows[changes], dry_run, batch_size, cancel_event, on_batch,
+                            checkpoint, row_hashes[changes], school
+                        )
+                    imported += written
+                    failed += len(rejected)
+                    if school and data_type == 'students':
+                        self._claim_unchanged(rows[~changes], school, dry_run)
+                    with metrics.stage('errors', len(chunk_errors) + len(rejected)):
+                        error_log.add(chunk_errors + rejected, chunk)
+                    
+                    processed += len(df)
+                    if cancelled:
+                        break
+                    if checkpoint:
+                        # Also covers trailing rows that failed validation
+                        with metrics.stage('checkpoint'), self.store.transaction():
+                            self.store.save_checkpoint(*checkpoint, int(df.index[-1]) + 1)
+                    if progress:
+                        progress(processed, total)
+        finally:
+            if dry_run:
+                self.store.admission_index.discard_staged()
+            rejects_file = error_log.close()
+        
+        if checkpoint and not cancelled:
+            self.store.clear_checkpoint(*checkpoint)
+        
+        return {
+            "data_type": data_type,
+            "dry_run": dry_run,
+            "cancelled": cancelled,
+            "resumed_from": resume_from,
+            "total": processed,
+            "imported": imported,
+            "failed": failed,
+            **delta_counts,
+            "error_count": error_log.count,
+            "rule_counts": dict(error_log.rule_counts.most_common()),
+            "rejects_file": rejects_file,
+            "metrics": metrics.finish(),
+            "errors": error_log.examples,
+        }
+    
+    def stored_row_hashes(self, data_type):
+        """Hashes of a data type's imported rows, indexed for classify_rows"""
+        self.upgrade_row_hashes()
+        keys, hashes = self.store.load_row_hashes(data_type)
+        return pd.Index(keys), hashes
+    
+    def upgrade_row_hashes(self):
+        """Rehash every stored row if its hashes predate ROW_HASH_VERSION.
+        
+        Old hashes would not match re-imported rows: keyed types would be
+        rewritten in full and payments, keyed on their content, written a
+        second time. Rows are read back in id order, so identical payments
+        get the occurrences an import of all of them would give.
+        Call outside any transaction.
+        """
+        if self.store.load_row_hash_version() == ROW_HASH_VERSION:
+            return
+        with self.store.transaction():
+            if self.store.load_row_hash_version() == ROW_HASH_VERSION:
+                return  # Another import upgraded them while we waited
+            for data_type, template in self.migration_templates.items():
+                if data_type not in STORE_SCHEMA:
+                    continue
+                fields = template['required_fields'] + template['optional_fields']
+                columns, query = self.store.export_query(data_type, fields)
+                self.store.clear_row_hashes(data_type)
+                occurrences = {}
+                for rows in self.store.iter_export(self.store.conn, query):
+                    df = pd.DataFrame(rows, columns=columns, dtype=object)
+                    self.store.save_row_hashes(data_type, *self.row_hashes(data_type, df, occurrences))
+            self.store.save_row_hash_version(ROW_HASH_VERSION)
+    
+    def normalize_rows(self, data_type, df):
+        """Mapped rows as the values they stand for, which is what rows hash on.
+        
+        Every template field is present and text is stripped, numbers are
+        parsed and dates are rewritten as ISO dates, so "1401" and
+        "1401.0", or a date re-typed as 2024-1-5, match what was stored.
+        Numbers that do not parse keep their text in a companion column.
+        """
+        template = self.get_migration_template(data_type)
+        rules = template.get('field_rules', {})
+        columns = {}
+        for field in sorted(template['required_fields'] + template['optional_fields']):
+            if field in df.columns:
+                text = df[field].astype('string').str.strip()
+                text = text.where(text != '')
+            else:
+                text = pd.Series(pd.NA, index=df.index, dtype='string')
+            kind = rules.get(field, {}).get('type')
+            if kind == 'number':
+                numbers = pd.to_numeric(text, errors='coerce').astype('float64')
+                columns[field] = numbers
+                text = text.where(numbers.isna())
+                field = f"{field} (text)"
+            elif kind == 'date':
+                dates = pd.to_datetime(text, format=rules[field].get('format', '%Y-%m-%d'), errors='coerce')
+                text = dates.dt.strftime('%Y-%m-%d').astype('string').fillna(text)
+            columns[field] = text.astype(object).where(text.notna(), None)
+        return pd.DataFrame(columns, index=df.index)
+    
+    def row_hashes(self, data_type, df, occurrences=None):
+        """(keys, hashes) of mapped rows; see _row_hashes"""
+        return _row_hashes(data_type, self.normalize_rows(data_type, df), occurrences)
+    
+    def classify_rows(self, data_type, df, stored, occurrences=None):
+        """Compare mapped rows with stored hashes: one vectorized pass, no queries"""
+        keys, hashes = self.row_hashes(data_type, df, occurrences)
+        index, stored_hashes = stored
+        position = index.get_indexer(keys)
+        new = position < 0
+        previous = stored_hashes[position] if len(stored_hashes) else hashes
+        changed = ~new & (previous != hashes)
+        return RowDelta(keys, hashes, new, changed)
+    
+    def diff_file(self, data_type, file_path, mapping):
+        """Count a file's rows that are new, changed or unchanged in the store.
+        
+        Rows are compared before validation, so rows that will fail it
+        are counted too.
+        """
+        stored = self.stored_row_hashes(data_type)
+        dtypes = self.read_dtypes(data_type, mapping)
+        occurrences = {}
+        counts = {"new": 0, "changed": 0, "unchanged": 0}
+        for chunk in self.iter_chunks(file_path, columns=list(mapping.keys()), dtypes=dtypes):
+            delta = self.classify_rows(data_type, self.apply_mapping(chunk, mapping), stored, occurrences)
+            counts["new"] += int(delta.new.sum())
+            counts["changed"] += int(delta.changed.sum())
+            counts["unchanged"] += int((~(delta.new | delta.changed)).sum())
+        return counts
+    
+    def failed_rows(self, data_type, file_path, cancel_event=None, mapping=None):
+        """File rows that fail validation, with their error messages.
+        
+        Rows are mapped as import_data maps them: with mapping when given,
+        else with what suggest_mapping proposes for the header, so alias
+        columns such as "Adm No" are validated as their fields. Returns
+        {row position: [messages]} in file order, or None if cancelled.
+        """
+        if mapping is None:
+            mapping, _ = self.suggest_mapping(data_type, list(self.read_head(file_path).columns))
+        dtypes = self.read_dtypes(data_type, mapping)
+        
+        failures = {}
+        seen = {}
+        for chunk in self.iter_chunks(file_path, columns=list(mapping), dtypes=dtypes):
+            if cancel_event is not None and cancel_event.is_set():
+                return None
+            _, errors = self.validate_data(data_type, self.apply_mapping(chunk, mapping), seen=seen)
+            for error in errors:
+                failures.setdefault(error['row'] - 1, []).append(error['error'])
+        return dict(sorted(failures.items()))
+    
+    def checkpoint_key(self, file_path, mapping):
+        """Hash of a file's content and mapping, identifying its checkpoint"""
+        digest = hashlib.sha1()
+        with open(file_path, 'rb') as f:
+            for block in iter(lambda: f.read(COUNT_CHUNK_SIZE), b''):
+                digest.update(block)
+        digest.update(json.dumps(mapping, sort_keys=True).encode('utf-8'))
+        return digest.hexdigest()
+    
+    def rank_classes(self, classes):
+        """Rank students within (grade, term) classes, overall and per subject.
+        
+        A student's subject score is the mean of their assessments in it,
+        and their average the mean over subjects; equal scores share a
+        position. Every class asked for is ranked from one query in one
+        grouped pass, and the result is cached until an assessments
+        import changes the class.
+        """
+        classes = self.store.unranked_classes(classes)
+        if not classes:
+            return
+        scores = pd.DataFrame(
+            self.store.class_scores(classes), columns=['grade', 'term', 'student_admission', 'subject', 'score']
+        )
+        subjects = scores.groupby(['grade', 'term', 'student_admission', 'subject'], sort=False)['score'].mean()
+        subject_positions = subjects.groupby(level=['grade', 'term', 'subject'], sort=False).rank(
+            method='min', ascending=False
+        )
+        averages = subjects.groupby(level=['grade', 'term', 'student_admission'], sort=False).agg(['size', 'mean'])
+        positions = averages['mean'].groupby(level=['grade', 'term'], sort=False).rank(method='min', ascending=False)
+        
+        rows = list(zip(
+            *(averages.index.get_level_values(level).tolist() for level in range(3)),
+            averages['size'].astype(int).tolist(), averages['mean'].tolist(), positions.astype(int).tolist()
+        ))
+        subject_rows = list(zip(
+            *(subjects.index.get_level_values(level).tolist() for level in range(4)),
+            subjects.tolist(), subject_positions.astype(int).tolist()
+        ))
+        self.store.save_rankings(classes, rows, subject_rows)
+    
+    def report_cards(self, grade, term):
+        """End-of-term report cards of a class, best first.
+        
+        Built from the cached rankings and the subject aggregates, so no
+        assessment rows are re-read unless the class has changed since it
+        was last ranked.
+        """
+        self.rank_classes([(grade, term)])
+        stats = {row['subject']: row for row in self.store.assessment_stats(grade, term)}
+        cards = []
+        for student, name, subjects, average, position, subject, score, subject_position in self.store.get_rankings(grade, term):
+            if not cards or cards[-1]['admission_number'] != student:
+                cards.append({
+                    "admission_number": student, "name": name, "grade": grade, "term": term,
+                    "average": round(average, 2), "position": position, "subjects": []
+                })
+            subject_stats = stats.get(subject, {})
+            cards[-1]['subjects'].append({
+                "subject": subject,
+                "score": round(score, 2),
+                "position": subject_position,
+                "class_mean": round(subject_stats['mean'], 2) if subject_stats else None,
+                "class_std": round(subject_stats['std'], 2) if subject_stats else None,
+                "class_min": subject_stats.get('min'),
+                "class_max": subject_stats.get('max')
+            })
+        for card in cards:
+            card['out_of'] = len(cards)
+        return cards
+    
+    def _update_assessment_stats(self, batch, found, rejected):
+        """Fold a written batch of assessments into the aggregates.
+        
+        found is what lookup_assessments returned before the batch was
+        written. Groups where an upsert replaced a stored score, or a
+        later row of the batch replaced an earlier one, are recounted;
+        every other group gets the batch's totals added. The cached
+        rankings of every class touched are dropped.
+        """
+        found = pd.DataFrame(found, columns=['position', 'grade', 'old_term', 'old_competency', 'old_score'])
+        written = np.ones(len(batch), dtype=bool)
+        written[[position for position, _ in rejected]] = False
+        replaced = found['old_score'].notna().to_numpy() & written
+        
+        def text(column):
+            if column not in batch:
+                return pd.Series(None, index=batch.index, dtype=object)
+            values = batch[column].astype(object)
+            return values.where(values.notna() & (values != ''), None)
+        
+        scores = pd.DataFrame({
+            "grade": found['grade'].to_numpy(),
+            "term": text('term').fillna('').to_numpy(),
+            "subject": text('subject').to_numpy(),
+            "competency_area": text('competency_area').to_numpy(),
+            "score": pd.to_numeric(batch['score'].astype(object), errors='coerce').to_numpy()
+        })
+        repeated = batch[STORE_NATURAL_KEYS['assessments']].duplicated(keep=False).to_numpy() & written
+        old = found[replaced]
+        new = scores[replaced | repeated]
+        
+        classes = set(zip(scores['grade'][written], scores['term'][written])) | set(zip(old['grade'], old['old_term']))
+        self.store.invalidate_rankings(classes)
+        
+        dirty = {
+            "assessment_stats": set(zip(new['grade'], new['term'], new['subject']))
+                                | set(zip(old['grade'], old['old_term'], scores['subject'][replaced])),
+            "competency_stats": {key for key in zip(new['grade'], new['term'], new['competency_area']) if key[2]}
+                                | {key for key in zip(old['grade'], old['old_term'], old['old_competency']) if key[2]},
+        }
+        for table, dimension in ASSESSMENT_STAT_TABLES.items():
+            groups = pd.MultiIndex.from_arrays([scores['grade'], scores['term'], scores[dimension]])
+            additive = written & ~groups.isin(list(dirty[table])) if dirty[table] else written
+            self.store.add_assessment_stats(table, assessment_stat_rows(scores[additive], dimension))
+            self.store.refresh_assessment_stats(table, dirty[table])
+    
+    def _update_fee_ledger(self, batch, found, rejected):
+        """Fold a written batch of payments into the fee ledger.
+        
+        found is what lookup_payments returned before the batch was
+        written. A re-uploaded slip replaces its stored payment, so the
+        groups of replaced payments (old and new term), and of slips
+        repeated within the batch, are recounted from the payments table;
+        every other written payment adds to its group's totals.
+        """
+        written = np.ones(len(batch), dtype=bool)
+        written[[position for position, _ in rejected]] = False
+        old_terms = pd.Series([term for _, term in found], index=batch.index, dtype=object)
+        replaced = old_terms.notna().to_numpy() & written
+        
+        terms = batch['term'] if 'term' in batch else pd.Series(None, index=batch.index, dtype=object)
+        terms = terms.fillna('')
+        if 'bank_slip_no' in batch:
+            key = batch[STORE_NATURAL_KEYS['payments']]
+            repeated = (key.notna().all(axis=1) & key.duplicated(keep=False)).to_numpy() & written
+        else:
+            repeated = np.zeros(len(batch), dtype=bool)
+        students = batch['student_admission']
+        dirty = set(zip(students[replaced], old_terms[replaced])) | set(zip(students[replaced | repeated], terms[replaced | repeated]))
+        
+        if dirty:
+            groups = pd.MultiIndex.from_arrays([students, terms])
+            written &= ~groups.isin(list(dirty))
+        self.store.add_to_fee_ledger(fee_ledger_rows(batch[written]))
+        self.store.refresh_fee_ledger(dirty)
+    
+    def _write_rows(self, data_type, rows, dry_run, batch_size=IMPORT_BATCH_SIZE,
+                    cancel_event=None, on_batch=None, checkpoint=None, row_hashes=None, school=None):
+        """Write validated rows in batches.
+        
+        Returns (written, rejection errors, cancelled). In a dry run the
+        caller holds the enclosing transaction that will be rolled back.
+        With checkpoint as (file_hash, data_type), each batch's transaction
+        also records the file position it reached, and with row_hashes
+        (key and hash columns aligned with rows) the hashes of its rows.
+        Students written with a school are claimed for it.
+        """
+        written = 0
+        errors = []
+        for start in range(0, len(rows), batch_size):
+            if cancel_event is not None and cancel_event.is_set():
+                return written, errors, True
+            batch = rows.iloc[start:start + batch_size]
+            hashes = row_hashes.iloc[start:start + batch_size] if row_hashes is not None else None
+            rejected = self._write_batch(data_type, batch, dry_run, checkpoint, hashes, school)
+            for position, message in rejected:
+                errors.append({
+                    "row": int(batch.index[position]) + 1,
+                    "field": None,
+                    "rule": 'store',
+                    "error": f"Rejected by store: {message}"
+                })
+            written += len(batch) - len(rejected)
+            if data_type == 'students':
+                self._index_committed(batch, rejected, staged=dry_run, school=school)
+            if on_batch:
+                on_batch(batch)
+        cancelled = cancel_event is not None and cancel_event.is_set()
+        return written, errors, cancelled
+    
+    def export_sets(self):
+        """Names export_data accepts: every template, then the derived ledgers"""
+        return list(self.migration_templates) + list(MigrationStore.EXPORT_REPORTS)
+    
+    def export_data(self, path, data_sets=None, templates=False, chunksize=READ_CHUNK_SIZE,
+                    progress=None, cancel_event=None):
+        """Write stored data, or blank templates, to one export target.
+        
+        path is a .xlsx (one sheet per data set), .zip (one CSV per data
+        set), .csv (a single data set) or a directory of CSV files; see
+        ExportWriter. data_sets defaults to every template. A workbook or
+        zip imports back with import_package, which skips any report sets
+        such as fee_ledger; those are rebuilt from the imported rows. With
+        templates, each template is written as its header and sample row
+        instead. Stored rows are read from one snapshot chunksize at a
+        time and streamed straight to the writer, so memory stays flat
+        whatever the row count. progress(rows_done, rows_total) is called
+        after each chunk.
+        """
+        data_sets = list(data_sets or self.migration_templates)
+        unknown = [name for name in data_sets if name not in self.export_sets()]
+        if unknown:
+            raise ValueError(f"Unknown data sets: {', '.join(unknown)}")
+        if templates and any(name not in self.migration_templates for name in data_sets):
+            raise ValueError("Only migration templates have a template to export")
+        
+        started = time.monotonic()
+        result = {"path": path, "templates": templates, "sets": {}, "rows": 0, "cancelled": False}
+        writer = ExportWriter(path)
+        result['format'] = writer.format
+        try:
+            if templates:
+                for name in data_sets:
+                    template = self.migration_templates[name]
+                    fields = template['required_fields'] + template['optional_fields']
+                    writer.begin(name, fields, 1)
+                    writer.write([[template['sample_data'].get(field, '') for field in fields]])
+                    result['sets'][name] = 1
+            else:
+                with self.store.snapshot() as conn:
+                    queries = {}
+                    for name in data_sets:
+                        template = self.migration_templates.get(name)
+                        fields = template['required_fields'] + template['optional_fields'] if template else None
+                        columns, query = self.store.export_query(name, fields)
+                        rows = conn.execute(f"SELECT COUNT(*) FROM {name}").fetchone()[0]
+                        queries[name] = (columns, query, rows)
+                    total = sum(rows for _, _, rows in queries.values())
+                    
+                    done = 0
+                    for name, (columns, query, rows) in queries.items():
+                        writer.begin(name, columns, rows)
+                        result['sets'][name] = 0
+                        for chunk in self.store.iter_export(conn, query, chunksize):
+                            if cancel_event is not None and cancel_event.is_set():
+                                result['cancelled'] = True
+                                break
+                            writer.write(chunk)
+                            result['sets'][name] += len(chunk)
+                            done += len(chunk)
+                            if progress:
+                                progress(done, total)
+                        if result['cancelled']:
+                            break
+        except BaseException:
+            writer.close(discard=True)
+            raise
+        writer.close(discard=result['cancelled'])
+        
+        result['rows'] = sum(result['sets'].values())
+        result['elapsed_seconds'] = round(time.monotonic() - started, 3)
+        return result
+    
+    def detect_data_type(self, columns, file_name=None):
+        """Guess which template a file holds from its header.
+        
+        A template matches when all of its required fields match a column
+        by name, alias or similarity. Ties are broken by a type name in the
+        file name, then by the number of matching fields. Returns None when
+        nothing matches.
+        """
+        columns = list(columns)
+        stem = os.path.splitext(os.path.basename(file_name or ''))[0].lower()
+        
+        candidates = []
+        for data_type, template in self.migration_templates.items():
+            matched = {field for field, _ in match_fields(columns, template).values()}
+            if not all(field in matched for field in template['required_fields']):
+                continue
+            named = data_type in stem or data_type.rstrip('s') in stem
+            candidates.append((named, len(matched), data_type))
+        
+        if not candidates:
+            return None
+        candidates.sort(reverse=True)
+        if len(candidates) > 1 and candidates[0][:2] == candidates[1][:2]:
+            return None  # Ambiguous
+        return candidates[0][2]
+    
+    def discover_bulk_jobs(self, source):
+        """Build the file list for bulk_import from a directory or manifest.
+        
+        A directory is searched recursively for CSV and Excel files; each
+        file's type is detected from its header and its school is the
+        sub-directory it sits in. Files named after an EXPORT_REPORTS
+        entry are derived data written by export_data and are skipped;
+        fee_ledger.csv would otherwise be detected as payments. A manifest is a JSON list (or an object
+        with a "files" list) of {"file", "type", "mapping", "school"}
+        entries, where only "file" is required and mapping may be inline
+        or the path of a saved mapping file.
+        """
+        jobs = []
+        if os.path.isdir(source):
+            for dirpath, dirnames, filenames in os.walk(source):
+                dirnames.sort()
+                for name in sorted(filenames):
+                    if name.lower().endswith(SUPPORTED_EXTENSIONS) and not _is_export_report(name):
+                        school = os.path.relpath(dirpath, source)
+                        jobs.append({
+                            "file": os.path.join(dirpath, name),
+                            "school": os.path.basename(os.path.abspath(source)) if school == '.' else school
+                        })
+        else:
+            with open(source) as f:
+                manifest = json.load(f)
+            entries = manifest['files'] if isinstance(manifest, dict) else manifest
+            base_dir = os.path.dirname(os.path.abspath(source))
+            for entry in entries:
+                job = dict(entry) if isinstance(entry, dict) else {"file": entry}
+                job['file'] = os.path.join(base_dir, job['file'])
+                if isinstance(job.get('mapping'), str):
+                    with open(os.path.join(base_dir, job['mapping'])) as f:
+                        job['mapping'] = json.load(f)
+                if 'type' in job:
+                    job['data_type'] = job.pop('type')
+                jobs.append(job)
+        
+        for job in jobs:
+            job.setdefault('school', None)
+            if job.get('data_type') and job.get('mapping'):
+                continue
+            try:
+                columns = list(self.read_head(job['file'], 0).columns)
+            except Exception as e:
+                job['error'] = f"Could not read header: {e}"
+                continue
+            if not job.get('data_type'):
+                job['data_type'] = self.detect_data_type(columns, job['file'])
+            if not job['data_type']:
+                job['error'] = "Could not detect the data type from the header"
+                continue
+            if not job.get('mapping'):
+                job['mapping'], _ = self.suggest_mapping(job['data_type'], columns)
+        return jobs
+    
+    def discover_package_jobs(self, file_path, extract_dir):
+        """Build bulk_import jobs for every data set in one upload.
+        
+        A multi-sheet xlsx gives one job per sheet and a zip gives one job
+        per CSV or Excel member, extracted into extract_dir. Each part's
+        type is detected from its header, with the sheet or file name used
+        to break ties. Report parts of an export (see EXPORT_REPORTS) are
+        skipped, so an export_data workbook or zip imports back as it was.
+        
+        An upload holds one school's data, but its file name is no reliable
+        name for that school, so the jobs claim no admission numbers.
+        """
+        school = None
+        if file_path.endswith('.zip'):
+            with zipfile.ZipFile(file_path) as zf:
+                for member in zf.namelist():
+                    if member.lower().endswith(SUPPORTED_EXTENSIONS) and not member.startswith('__MACOSX/') \
+                            and not _is_export_report(member):
+                        zf.extract(member, extract_dir)
+            jobs = self.discover_bulk_jobs(extract_dir)
+            for job in jobs:
+                job['school'] = school
+            return jobs
+        
+        if not file_path.endswith('.xlsx'):
+            raise ValueError("Upload a multi-sheet .xlsx workbook or a .zip of CSV/Excel files")
+        
+        jobs = []
+        for sheet, columns in xlsx_sheet_headers(file_path).items():
+            if _is_export_report(sheet):
+                continue
+            job = {"file": file_path, "sheet": sheet, "school": school}
+            job['data_type'] = self.detect_data_type(columns, sheet)
+            if not job['data_type']:
+                job['error'] = "Could not detect the data type from the header"
+            else:
+                job['mapping'], _ = self.suggest_mapping(job['data_type'], columns)
+            jobs.append(job)
+        return jobs
+    
+    def import_package(self, file_path, dry_run=False, workers=None, batch_size=IMPORT_BATCH_SIZE,
+                       progress=None, cancel_event=None):
+        """Import every data type from one multi-sheet workbook or zip.
+        
+        The parts run as a dependency graph through the bulk pipeline:
+        all parts are parsed and validated concurrently, students and
+        teachers are written as soon as they are ready, and the parts that
+        reference students are written once every students part is in the
+        admission index. Returns the same shape as bulk_import.
+        """
+        with tempfile.TemporaryDirectory(prefix='migration_') as extract_dir:
+            jobs = self.discover_package_jobs(file_path, extract_dir)
+            return self._run_bulk_jobs(jobs, dry_run, workers, batch_size, progress, cancel_event)
+    
+    def bulk_import(self, source, dry_run=False, workers=None, batch_size=IMPORT_BATCH_SIZE,
+                    progress=None, cancel_event=None):
+        """Import many files, parsing and validating them in parallel.
+        
+        Files come from a directory or manifest (see discover_bulk_jobs).
+        A process pool parses each file and runs the checks that need only
+        the file; the calling process is the single writer, so the store
+        never sees concurrent writes. Files whose template has foreign keys
+        are held back until every students file has been written, so the
+        admission index is complete when they are checked.
+        
+        All schools share the store, so each file's students are claimed
+        for its school and another school's rows with the same admission
+        number are rejected rather than merged.
+        
+        A dry run wraps all writes in one transaction that is rolled back.
+        progress(files_done, files_total) is called as files finish.
+        Returns {"files": [per-file summaries], "totals": {...}}.
+        """
+        jobs = self.discover_bulk_jobs(source)
+        return self._run_bulk_jobs(jobs, dry_run, workers, batch_size, progress, cancel_event)
+    
+    def _run_bulk_jobs(self, jobs, dry_run, workers, batch_size, progress, cancel_event):
+        """Parse jobs in a process pool and write them from this process"""
+        summaries = []
+        runnable = []
+        for job in jobs:
+            if job.get('error'):
+                summaries.append(_bulk_summary(job, error=job['error']))
+            else:
+                runnable.append(job)
+        
+        students_left = sum(1 for job in runnable if job['data_type'] == 'students')
+        waiting = []
+        cancelled = False
+        if progress:
+            progress(len(summaries), len(jobs))
+        
+        def write(prepared):
+            summaries.append(self._write_prepared(prepared, dry_run, batch_size))
+            if progress:
+                progress(len(summaries), len(jobs))
+        
+        workers = workers or os.cpu_count() or 1
+        self.upgrade_row_hashes()  # Not inside the dry run's transaction
+        # spawn keeps workers independent of the parent's threads and
+        # database connection
+        context = multiprocessing.get_context('spawn')
+        try:
+            with self.store.transaction(rollback=True) if dry_run else _no_transaction(), \
+                    ProcessPoolExecutor(max_workers=workers, mp_context=context) as pool:
+                futures = [pool.submit(_prepare_bulk_file, job) for job in runnable]
+                for future in as_completed(futures):
+                    if cancel_event is not None and cancel_event.is_set():
+                        cancelled = True
+                        for pending in futures:
+                            pending.cancel()
+                        break
+                    
+                    prepared = future.result()
+                    template = self.get_migration_template(prepared['job']['data_type'])
+                    if template.get('foreign_keys') and students_left:
+                        waiting.append(prepared)
+                        continue
+                    
+                    write(prepared)
+                    if prepared['job']['data_type'] == 'students':
+                        students_left -= 1
+                        if not students_left:
+                            for held in waiting:
+                                write(held)
+                            waiting = []
+                
+                # Only reached with students outstanding if one failed to parse
+                for held in waiting:
+                    if not cancelled:
+                        write(held)
+        finally:
+            if dry_run:
+                self.store.admission_index.discard_staged()
+        
+        totals = {
+            "files": len(summaries),
+            "total": sum(summary['total'] for summary in summaries),
+            "imported": sum(summary['imported'] for summary in summaries),
+            "failed": sum(summary['failed'] for summary in summaries),
+            "unchanged": sum(summary['unchanged'] for summary in summaries),
+            "files_with_errors": sum(1 for summary in summaries if summary['error']),
+        }
+        return {"dry_run": dry_run, "cancelled": cancelled, "files": summaries, "totals": totals}
+    
+    def _write_prepared(self, prepared, dry_run, batch_size=IMPORT_BATCH_SIZE):
+        """Writer side of bulk_import: referential checks, then batched writes"""
+        job = prepared['job']
+        if prepared['error']:
+            return _bulk_summary(job, error=prepared['error'])
+        
+        started = time.monotonic()
+        metrics = ImportMetrics()
+        metrics.add(prepared['stages'])
+        data_type = job['data_type']
+        rows = prepared['rows']
+        errors = prepared['errors']
+        with metrics.stage('references', len(rows)):
+            valid, ref_errors = self.validate_references(data_type, rows, job.get('school'))
+        rows = rows[valid]
+        with metrics.stage('delta', len(rows)):
+            delta = self.classify_rows(data_type, rows, self.stored_row_hashes(data_type))
+            changes = delta.new | delta.changed
+            row_hashes = pd.DataFrame({"key": delta.keys, "hash": delta.hashes}, index=rows.index)
+        with metrics.stage('write', int(changes.sum())):
+            written, rejected, _ = self._write_rows(
+                data_type, rows[changes], dry_run, batch_size, row_hashes=row_hashes[changes],
+                school=job.get('school')
+            )
+        unchanged = int((~changes).sum())
+        if job.get('school') and data_type == 'students':
+            self._claim_unchanged(rows[~changes], job['school'], dry_run)
+        errors.extend(ref_errors)
+        errors.extend(rejected)
+        errors.sort(key=lambda e: e['row'])
+        
+        return _bulk_summary(
+            job,
+            total=prepared['total'],
+            imported=written,
+            failed=prepared['total'] - written - unchanged,
+            unchanged=unchanged,
+            errors=errors,
+            elapsed=prepared['elapsed'] + time.monotonic() - started,
+            metrics=metrics.finish()
+        )
+    
+    def _claim_unchanged(self, rows, school, dry_run):
+        """Claim students a school sent again unchanged, which are not rewritten"""
+        numbers = rows['admission_number'].tolist()
+        if not numbers:
+            return
+        with self.store.transaction() if not dry_run else _no_transaction():
+            self.store.claim_students(numbers, school)
+        self.store.admission_index.claim(numbers, school, staged=dry_run)
+    
+    def _index_committed(self, batch, rejected, staged=False, school=None):
+        """Add a written student batch to the admission index"""
+        numbers = batch['admission_number']
+        if rejected:
+            keep = pd.Series(True, index=batch.index)
+            keep.iloc[[position for position, _ in rejected]] = False
+            numbers = numbers[keep]
+        self.store.admission_index.add(numbers.tolist(), staged=staged)
+        if school:
+            self.store.admission_index.claim(numbers.tolist(), school, staged=staged)
+    
+    def _write_batch(self, data_type, batch, in_transaction=False, checkpoint=None, row_hashes=None,
+                     school=None):
+        """Write one batch to the store, returning the rejected positions.
+        
+        Unless in_transaction is set the batch commits in its own
+        transaction together with its checkpoint and row hashes; otherwise
+        it joins the caller's (a dry run's) transaction. The per-batch
+        savepoint lives in store.insert_rows, which only uses it to fall
+        back to row-by-row inserts after a constraint violation.
+        """
+        columns = list(batch.columns)
+        values = batch.astype(object).where(batch.notna() & (batch != ''), None)
+        rows = list(values.itertuples(index=False, name=None))
+        
+        with self.store.transaction() if not in_transaction else _no_transaction():
+            if data_type == 'assessments':
+                # Stored rows this batch will replace, read before they are
+                found = self.store.lookup_assessments(
+                    values[STORE_NATURAL_KEYS['assessments']].itertuples(index=False, name=None)
+                )
+            if data_type == 'students' and 'current_grade' in values:
+                # Grades the batch may move students out of
+                old_grades = self.store.lookup_grades(values['admission_number'])
+            if data_type == 'payments':
+                slips = values['bank_slip_no'] if 'bank_slip_no' in values else pd.Series(None, index=values.index)
+                found = self.store.lookup_payments(zip(values['student_admission'], slips))
+            rejected = self.store.insert_rows(data_type, columns, rows)
+            if data_type == 'assessments':
+                self._update_assessment_stats(batch, found, rejected)
+            if data_type == 'teachers':
+                written = values.drop(values.index[[position for position, _ in rejected]]) if rejected else values
+                for field in TEACHER_LISTS:
+                    if field in written:
+                        # Only lists the file maps are replaced, as the upsert does
+                        self.store.set_teacher_lists(field, {
+                            tsc_number: split_names(value)
+                            for tsc_number, value in zip(written['tsc_number'], written[field])
+                        })
+            if data_type == 'payments':
+                self._update_fee_ledger(values, found, rejected)
+            if data_type == 'students':
+                written = values.drop(values.index[[position for position, _ in rejected]]) if rejected else values
+                if 'current_grade' in values and old_grades:
+                    # Moved students' scores count in their new grade
+                    moved = {
+                        (old_grades[number], grade or '')
+                        for number, grade in zip(written['admission_number'], written['current_grade'])
+                        if number in old_grades and old_grades[number] != (grade or '')
+                    }
+                    self.store.regrade_assessments({grade for pair in moved for grade in pair})
+                if school:
+                    self.store.claim_students(written['admission_number'].tolist(), school)
+            if row_hashes is not None:
+                if rejected:
+                    row_hashes = row_hashes.drop(row_hashes.index[[position for position, _ in rejected]])
+                self.store.save_row_hashes(
+                    data_type, row_hashes['key'].to_numpy(), row_hashes['hash'].to_numpy()
+                )
+            if checkpoint:
+                self.store.save_checkpoint(*checkpoint, int(batch.index[-1]) + 1)
+            return rejected
+
+class FilePager:
+    """Random access to a file's rows in fixed-size pages, for the preview.
+    
+    Parsed files are sliced. Uncached CSVs are indexed with one scan of
+    record offsets and each page is a seek plus a short parse. Workbooks
+    and UTF-16 CSVs cannot be seeked into, so their rows are copied to a
+    temporary UTF-8 CSV that is paged the same way; xlsx rows are streamed
+    into it only as far as the pages asked for. The file is never held in
+    memory. A few recent pages are kept, so scrolling back and forth does
+    not re-read the file.
+    """
+    
+    def __init__(self, manager, file_path, page_size=PREVIEW_PAGE_ROWS, max_pages=PREVIEW_CACHED_PAGES):
+        self.manager = manager
+        self.file_path = file_path
+        self.page_size = page_size
+        self.max_pages = max_pages
+        self.columns = []
+        self.total = 0
+        self._frame = None
+        self._offsets = None
+        self._source = file_path
+        self._format = None
+        self._rows = None
+        self._spooled = 0
+        self._pages = OrderedDict()
+        self._lock = threading.Lock()
+        self._spool_lock = threading.Lock()
+    
+    def open(self):
+        """Read the header and index the file; slow, so call off the UI thread"""
+        self.columns = list(self.manager.read_head(self.file_path).columns)
+        self._frame = self.manager.file_cache.get(self.file_path)
+        if self._frame is not None:
+            self.total = len(self._frame)
+            return self
+        
+        if self.file_path.endswith('.csv') and _ascii_compatible(sniff_csv(self.file_path).encoding):
+            self._format = sniff_csv(self.file_path)
+        elif self.file_path.endswith('.xlsx'):
+            # Filled page by page in _read; the header is not copied
+            self._source = self._spool_file()
+            self._format = CsvFormat('utf-8', ',')
+            self._offsets = []
+            self._rows = iter_xlsx_rows(self.file_path)
+            next(self._rows, None)
+            self.total = count_xlsx_records(self.file_path)
+            return self
+        else:
+            self._source = self._spool_file()
+            self._format = self._copy_to_spool()
+        self.total = count_csv_records(self._source)
+        self._offsets = csv_record_offsets(self._source, self.page_size)
+        return self
+    
+    def _spool_file(self):
+        """Path of an empty temporary CSV, deleted with the pager"""
+        fd, path = tempfile.mkstemp(prefix='preview-', suffix='.csv')
+        os.close(fd)
+        weakref.finalize(self, _remove_file, path)
+        return path
+    
+    def _copy_to_spool(self):
+        """Copy a UTF-16 CSV or an .xls sheet to the spool as UTF-8; returns its CsvFormat"""
+        with open(self._source, 'w', encoding='utf-8', newline='') as out:
+            if self.file_path.endswith('.csv'):
+                csv_format = sniff_csv(self.file_path)
+                with open(self.file_path, encoding=csv_format.encoding, errors='replace', newline='') as f:
+                    shutil.copyfileobj(f, out, COUNT_CHUNK_SIZE)
+                return CsvFormat('utf-8', csv_format.delimiter)
+            
+            # xlrd has no streaming reader; .xls sheets stop at 65,536
+            # rows, so one read of the sheet stays small
+            df = pd.read_excel(self.file_path, dtype=str)
+            writer = csv.writer(out)
+            writer.writerow(df.columns)
+            writer.writerows(df.itertuples(index=False, name=None))
+        return CsvFormat('utf-8', ',')
+    
+    def _spool_through(self, number):
+        """Stream workbook rows into the spool until it holds page number"""
+        with self._spool_lock:
+            with open(self._source, 'ab') as out:
+                while self._rows is not None and len(self._offsets) <= number:
+                    rows = list(itertools.islice(self._rows, self.page_size))
+                    if not rows:
+                        # Blank rows are skipped, so the dimension can overcount
+                        self._rows.close()
+                        self._rows = None
+                        self.total = self._spooled
+                        break
+                    buffer = io.StringIO()
+                    csv.writer(buffer).writerows(rows)
+                    self._offsets.append(out.tell())
+                    out.write(buffer.getvalue().encode('utf-8'))
+                    self._spooled += len(rows)
+    
+    def page(self, number):
+        """One page of rows, indexed by file row position"""
+        with self._lock:
+            if number in self._pages:
+                self._pages.move_to_end(number)
+                return self._pages[number]
+        df = self._read(number)
+        with self._lock:
+            self._pages[number] = df
+            while len(self._pages) > self.max_pages:
+                self._pages.popitem(last=False)
+        return df
+    
+    def rows(self, positions):
+        """Rows at the given file positions, reading pages as needed"""
+        pages = sorted({position // self.page_size for position in positions})
+        if not pages:
+            return pd.DataFrame(columns=self.columns)
+        return pd.concat([self.page(number) for number in pages]).loc[positions]
+    
+    def cached_rows(self, positions):
+        """Like rows, but None instead of reading the file"""
+        with self._lock:
+            if not all(position // self.page_size in self._pages for position in positions):
+                return None
+        return self.rows(positions)
+    
+    def _read(self, number):
+        start = number * self.page_size
+        if self._frame is not None:
+            return self._frame.iloc[start:start + self.page_size]
+        if number >= len(self._offsets) and self._rows is not None:
+            self._spool_through(number)
+        if number >= len(self._offsets):
+            return pd.DataFrame(columns=self.columns)
+        with open(self._source, 'rb') as f:
+            f.seek(self._offsets[number])
+            df = pd.read_csv(f, header=None, names=self.columns, dtype=str, nrows=self.page_size,
+                             sep=self._format.delimiter, encoding=self._format.encoding,
+                             encoding_errors='replace')
+        df.index = pd.RangeIndex(start, start + len(df))
+        return self.manager._clean(df)
+
+def _is_export_report(name):
+    """Whether a sheet or file is named after an EXPORT_REPORTS data set"""
+    return os.path.splitext(os.path.basename(name))[0].lower() in MigrationStore.EXPORT_REPORTS
+
+def _remove_file(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+def _prepare_bulk_file(job):
+    """Process-pool worker for bulk_import: parse and validate one file.
+    
+    Runs only the checks that need the file alone and returns the rows
+    that passed them, so the writer process can finish the job. Stage
+    timings travel back with the rows.
+    """
+    started = time.monotonic()
+    metrics = ImportMetrics()
+    manager = DataMigrationManager(None, file_cache=ParsedFileCache(max_entries=0, spill_dir=None))
+    data_type = job['data_type']
+    mapping = job['mapping']
+    try:
+        template = manager.get_migration_template(data_type)
+        missing = [f for f in template['required_fields'] if f not in mapping.values()]
+        if missing:
+            raise ValueError(f"Required fields not mapped: {', '.join(missing)}")
+        
+        columns = list(mapping.keys())
+        dtypes = manager.read_dtypes(data_type, mapping)
+        if job.get('sheet'):
+            chunks = (manager._clean(chunk.astype(dtypes)) for chunk in
+                      iter_xlsx_chunks(job['file'], columns=columns, sheet_name=job['sheet']))
+        else:
+            chunks = manager.iter_chunks(job['file'], columns=columns, dtypes=dtypes)
+        
+        seen = {}
+        valid_parts = []
+        errors = []
+        total = 0
+        while True:
+            with metrics.stage('read'):
+                chunk = next(chunks, None)
+            if chunk is None:
+                break
+            with metrics.stage('map', len(chunk)):
+                df = manager.apply_mapping(chunk, mapping)
+            with metrics.stage('validate', len(df)):
+                valid, chunk_errors = manager.validate_intrinsic(data_type, df, seen)
+            valid_parts.append(df[valid])
+            errors.extend(chunk_errors)
+            total += len(df)
+        rows = pd.concat(valid_parts) if valid_parts else pd.DataFrame(columns=list(mapping.values()))
+    except Exception as e:
+        return {"job": job, "error": str(e), "elapsed": time.monotonic() - started}
+    
+    return {
+        "job": job,
+        "error": None,
+        "rows": rows,
+        "errors": errors,
+        "total": total,
+        "stages": metrics.stages,
+        "elapsed": time.monotonic() - started
+    }
+
+def _bulk_summary(job, total=0, imported=0, failed=0, errors=None, elapsed=0.0, error=None, unchanged=0,
+                  metrics=None):
+    """Per-file result of a bulk import, in the shape run_import reports"""
+    return {
+        "file": job['file'],
+        "sheet": job.get('sheet'),
+        "school": job.get('school'),
+        "data_type": job.get('data_type'),
+        "total": total,
+        "imported": imported,
+        "failed": failed,
+        "unchanged": unchanged,
+        "errors": errors or [],
+        "error": error,
+        "elapsed_seconds": round(elapsed, 3),
+        "metrics": metrics
+    }
+
+def open_in_default_app(path):
+    """Open a file with the application the desktop associates with it"""
+    if sys.platform.startswith('win'):
+        os.startfile(path)
+    elif sys.platform == 'darwin':
+        subprocess.Popen(['open', path])
+    else:
+        subprocess.Popen(['xdg-open', path])
+
+def format_import_summary(result):
+    """Plain-text summary of one file's import, as run_import displays it"""
+    name = os.path.basename(result['file'])
+    if result.get('sheet'):
+        name += f" [{result['sheet']}]"
+    lines = [
+        f"{result.get('school') or ''} {name} ({result['data_type'] or 'unknown type'})".strip(),
+    ]
+    if result['error']:
+        lines.append(f"  Failed: {result['error']}")
+        return "\n".join(lines)
+    lines.append(f"  Total records processed: {result['total']}")
+    lines.append(f"  Successfully imported: {result['imported']}")
+    if result.get('unchanged'):
+        lines.append(f"  Unchanged (skipped): {result['unchanged']}")
+    lines.append(f"  Failed: {result['failed']}")
+    if result.get('metrics'):
+        lines.append(f"  Time by stage: {format_stage_breakdown(result['metrics'])}")
+    for error in result['errors'][:3]:
+        lines.append(f"  Row {error['row']}: {error['error']}")
+    return "\n".join(lines)
+
+# Rows an xlsx worksheet can hold below its header
+XLSX_MAX_ROWS = 1048575
+
+def _synthetic_keys(sample, numbers):
+    """Key-like values shaped after a sample such as SCH2023001"""
+    prefix = re.match(r'\D*', sample).group()
+    return prefix + pd.Series(numbers).astype(str).str.zfill(8)
+
+def _synthetic_column(template, field, start, count, rng, students):
+    """One generated column, shaped after the template's sample value"""
+    sample = str(template['sample_data'].get(field, field))
+    rule = template.get('field_rules', {}).get(field, {})
+    kind = rule.get('type')
+    
+    if field in template.get('unique_fields', []):
+        return _synthetic_keys(sample, np.arange(start, start + count))
+    if field in template.get('foreign_keys', []):
+        return _synthetic_keys(sample, rng.integers(0, max(students, 1), count))
+    if kind == 'enum':
+        return pd.Series(rng.choice(rule['choices'], count))
+    if kind == 'date':
+        days = pd.to_timedelta(rng.integers(-365, 365, count), unit='D')
+        return pd.Series(pd.Timestamp(sample) + days).dt.strftime('%Y-%m-%d')
+    if kind == 'number':
+        low = rule.get('min', 0)
+        high = rule.get('max', float(sample) * 2)
+        return pd.Series(rng.uniform(low, high, count).round(2) + (1 if rule.get('min_exclusive') else 0))
+    if kind == 'pattern' and '@' in sample:
+        local, domain = sample.split('@', 1)
+        return local + pd.Series(np.arange(start, start + count)).astype(str) + '@' + domain
+    if kind == 'pattern':
+        digits = pd.Series(rng.integers(0, 10 ** 8, count)).astype(str).str.zfill(8)
+        return sample[:len(sample) - 8] + digits
+    if field in template.get('categorical_fields', []):
+        # A handful of distinct values, as real categorical columns have
+        if re.search(r'\d', sample):
+            choices = [re.sub(r'\d+', str(n), sample, count=1) for n in range(1, 9)]
+        else:
+            choices = [sample] + [f"{sample} {n}" for n in range(2, 9)]
+        return pd.Series(rng.choice(choices, count))
+    if ',' in sample:
+        return pd.Series([sample] * count)
+    if re.search(r'\d$', sample):
+        return _synthetic_keys(sample, rng.integers(0, 10 ** 8, count))
+    return sample + ' ' + pd.Series(np.arange(start + 1, start + count + 1)).astype(str)
+
+def _corrupt_value(template, field):
+    """A value that fails the field's first validation rule"""
+    kind = template.get('field_rules', {}).get(field, {}).get('type')
+    return {'date': 'not-a-date', 'number': '-1', 'enum': 'Unknown', 'pattern': 'invalid'}.get(kind, '')
+
+def generate_dataset(manager, data_type, rows, file_path, error_rate=0.0, duplicate_rate=0.0,
+                     broken_ref_rate=0.0, students=None, seed=0, chunk_size=READ_CHUNK_SIZE):
+    """Write a synthetic file of a data type, expanded from its sample_data.
+    
+    Every template field gets realistic values shaped after the sample.
+    error_rate of the rows get one field that breaks a rule,
+    duplicate_rate repeat an earlier row of the file, and broken_ref_rate
+    point at admission numbers that do not exist. Foreign keys reference
+    the first `students` generated admission numbers (default: rows), so
+    a students file generated first makes them valid. Written in chunks,
+    so memory stays flat at any size; returns the number of rows written.
+    """
+    template = manager.get_migration_template(data_type)
+    if not template:
+        raise ValueError(f"Invalid data type: {data_type}")
+    if file_path.endswith('.xlsx') and rows > XLSX_MAX_ROWS:
+        raise ValueError(f"An xlsx sheet holds at most {XLSX_MAX_ROWS:,} rows")
+    if not file_path.endswith(('.csv', '.xlsx')):
+        raise ValueError("Generated files must be .csv or .xlsx")
+    
+    fields = template['required_fields'] + template['optional_fields']
+    breakable = [f for f in fields if f in template.get('field_rules', {}) or f in template['required_fields']]
+    students = rows if students is None else students
+    rng = np.random.default_rng(seed)
+    
+    sheet = None
+    if file_path.endswith('.xlsx'):
+        from openpyxl import Workbook
+        workbook = Workbook(write_only=True)
+        sheet = workbook.create_sheet(data_type)
+        sheet.append(fields)
+    
+    for start in range(0, rows, chunk_size):
+        count = min(chunk_size, rows - start)
+        df = pd.DataFrame({
+            field: _synthetic_column(template, field, start, count, rng, students).to_numpy(dtype=object)
+            for field in fields
+        })
+        
+        positions = np.arange(count)
+        duplicates = positions[(rng.random(count) < duplicate_rate) & (positions > 0)]
+        if len(duplicates):
+            sources = (rng.random(len(duplicates)) * duplicates).astype(int)
+            df.iloc[duplicates] = df.iloc[sources].to_numpy()
+        
+        for field in template.get('foreign_keys', []):
+            broken = rng.random(count) < broken_ref_rate
+            df.loc[broken, field] = 'MISSING' + pd.Series(positions[broken] + start).astype(str).to_numpy()
+        
+        corrupt = np.flatnonzero(rng.random(count) < error_rate)
+        targets = rng.choice(breakable, len(corrupt))
+        for field in breakable:
+            df.loc[corrupt[targets == field], field] = _corrupt_value(template, field)
+        
+        if sheet is not None:
+            for row in df.itertuples(index=False, name=None):
+                sheet.append(list(row))
+        else:
+            df.to_csv(file_path, mode='w' if start == 0 else 'a', header=start == 0, index=False)
+    
+    if sheet is not None:
+        workbook.save(file_path)
+    elif rows == 0:
+        pd.DataFrame(columns=fields).to_csv(file_path, index=False)
+    return rows
+
+# Buffer of each CSV file an export writes
+EXPORT_BUFFER_BYTES = 1 << 20
+
+# Deflate level of exported workbooks and zips; sheet XML compresses
+# well even at the fastest level, and the higher ones cost seconds
+EXPORT_COMPRESS_LEVEL = 1
+
+# Characters XML 1.0 cannot hold, dropped from exported cell text
+_XML_ILLEGAL = re.compile('[\x00-\x08\x0b\x0c\x0e-\x1f\ufffe\uffff]')
+
+# Package parts of an exported workbook besides its sheets
+_XLSX_CONTENT_TYPES = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+    '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+    '<Default Extension="xml" ContentType="application/xml"/>'
+    '<Override PartName="/xl/workbook.xml" '
+    'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+    '{sheets}</Types>'
+)
+_XLSX_SHEET_TYPE = (
+    '<Override PartName="/xl/worksheets/sheet{n}.xml" '
+    'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+)
+_XLSX_ROOT_RELS = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    f'<Relationships xmlns="{_XLSX_NS["pkg"]}">'
+    '<Relationship Id="rId1" Target="xl/workbook.xml" '
+    'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument"/>'
+    '</Relationships>'
+)
+
+def _xlsx_column(number):
+    """Column letters of a 1-based column number"""
+    letters = ''
+    while number:
+        number, remainder = divmod(number - 1, 26)
+        letters = chr(ord('A') + remainder) + letters
+    return letters
+
+def _xlsx_row(values):
+    """One <row> of a streamed sheet: numbers as values, text inline"""
+    cells = []
+    for value in values:
+        if value is None or value == '':
+            cells.append('<c/>')
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            cells.append(f'<c><v>{value!r}</v></c>')
+        else:
+            text = xml_escape(_XML_ILLEGAL.sub('', str(value)))
+            cells.append(f'<c t="inlineStr"><is><t xml:space="preserve">{text}</t></is></c>')
+    return '<row>' + ''.join(cells) + '</row>'
+
+class ExportWriter:
+    """Streams named data sets into one export target.
+    
+    A .xlsx path gets one sheet per data set, a .zip one CSV member per
+    data set, a .csv path a single data set, and any other path is a
+    directory of CSV files. Workbooks and zips are the layouts
+    import_package reads back.
+    
+    Sheets are written as worksheet XML straight into the archive, with
+    inline strings and the row count in <dimension>, rather than through
+    openpyxl, whose per-cell objects make a million-row export take
+    minutes.
+    """
+    
+    def __init__(self, path):
+        self.path = path
+        self.format = 'dir' if os.path.isdir(path) else os.path.splitext(path)[1].lower().lstrip('.') or 'dir'
+        self.archive = self.file = self.writer = None
+        self.sheets = []
+        if self.format in ('xlsx', 'zip'):
+            self.archive = zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED, compresslevel=EXPORT_COMPRESS_LEVEL)
+        elif self.format == 'dir':
+            os.makedirs(path, exist_ok=True)
+        elif self.format != 'csv':
+            raise ValueError("Export to a .xlsx, .zip or .csv file, or to a directory")
+    
+    def begin(self, name, columns, rows=0):
+        """Start a data set of `rows` rows with its header"""
+        self._end_set()
+        if self.format == 'xlsx':
+            if rows > XLSX_MAX_ROWS:
+                raise ValueError(f"{name} has {rows:,} rows; an xlsx sheet holds at most {XLSX_MAX_ROWS:,}")
+            self.sheets.append(name)
+            self.file = io.BufferedWriter(
+                self.archive.open(f"xl/worksheets/sheet{len(self.sheets)}.xml", 'w'), EXPORT_BUFFER_BYTES
+            )
+            self.file.write(
+                '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+                f'<worksheet xmlns="{_XLSX_NS["main"]}">'
+                f'<dimension ref="A1:{_xlsx_column(max(len(columns), 1))}{rows + 1}"/>'
+                f'<sheetData>{_xlsx_row(columns)}'.encode('utf-8')
+            )
+            return
+        
+        if self.archive is not None:
+            self.file = io.TextIOWrapper(io.BufferedWriter(self.archive.open(f"{name}.csv", 'w'),
+                                                           EXPORT_BUFFER_BYTES),
+                                         encoding='utf-8', newline='')
+        elif self.format == 'csv':
+            if self.sheets:
+                raise ValueError("A .csv export holds one data set; export to .xlsx, .zip or a directory")
+            self.file = open(self.path, 'w', encoding='utf-8', newline='', buffering=EXPORT_BUFFER_BYTES)
+        else:
+            self.file = open(os.path.join(self.path, f"{name}.csv"), 'w', encoding='utf-8', newline='',
+                             buffering=EXPORT_BUFFER_BYTES)
+        self.sheets.append(name)
+        self.writer = csv.writer(self.file)
+        self.writer.writerow(columns)
+    
+    def write(self, rows):
+        """Append a chunk of row tuples to the current data set"""
+        if self.writer is None:
+            self.file.write(''.join(map(_xlsx_row, rows)).encode('utf-8'))
+        else:
+            self.writer.writerows(rows)
+    
+    def _end_set(self):
+        if self.file is not None:
+            if self.format == 'xlsx':
+                self.file.write(b'</sheetData></worksheet>')
+            self.file.close()
+        self.file = self.writer = None
+    
+    def _write_workbook(self):
+        sheets = ''.join(
+            f'<sheet name="{xml_escape(name)}" sheetId="{n}" r:id="rId{n}"/>'
+            for n, name in enumerate(self.sheets, 1)
+        )
+        self.archive.writestr('[Content_Types].xml', _XLSX_CONTENT_TYPES.format(
+            sheets=''.join(_XLSX_SHEET_TYPE.format(n=n) for n in range(1, len(self.sheets) + 1))
+        ))
+        self.archive.writestr('_rels/.rels', _XLSX_ROOT_RELS)
+        self.archive.writestr(
+            'xl/workbook.xml',
+            '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+            f'<workbook xmlns="{_XLSX_NS["main"]}" xmlns:r="{_XLSX_NS["rel"]}">'
+            f'<sheets>{sheets}</sheets></workbook>'
+        )
+        self.archive.writestr(
+            'xl/_rels/workbook.xml.rels',
+            '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+            f'<Relationships xmlns="{_XLSX_NS["pkg"]}">' + ''.join(
+                f'<Relationship Id="rId{n}" Target="worksheets/sheet{n}.xml" '
+                'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet"/>'
+                for n in range(1, len(self.sheets) + 1)
+            ) + '</Relationships>'
+        )
+    
+    def close(self, discard=False):
+        """Finish the target; discard removes a partly written file"""
+        self._end_set()
+        if self.archive is not None:
+            if self.format == 'xlsx' and not discard:
+                self._write_workbook()
+            self.archive.close()
+        if discard and self.format != 'dir' and os.path.exists(self.path):
+            os.remove(self.path)
+
+def run_benchmark(rows, work_dir, data_types=None, file_format='csv', error_rate=0.01,
+                  duplicate_rate=0.01, broken_ref_rate=0.01, seed=0, batch_size=IMPORT_BATCH_SIZE):
+    """Generate one file per data type and time each import stage on it.
+    
+    Stages run as the import runs them: header validation, record
+    counting, index build, then parsing, validation and commit chunk by
+    chunk. Each is reported in seconds and rows/sec, with the most memory
+    any one run of it took: its peak RSS where the peak can be reset
+    before each stage (Linux), else its tracemalloc peak, which slows
+    every stage down. Students go first so the other types have records
+    to reference.
+    
+    The database and parse cache always start empty, also in a reused
+    work_dir, so that every run measures the same inserts.
+    """
+    db_path = os.path.join(work_dir, 'benchmark.db')
+    for suffix in ('', '-wal', '-shm'):
+        _remove_file(db_path + suffix)
+    shutil.rmtree(os.path.join(work_dir, 'cache'), ignore_errors=True)
+    manager = DataMigrationManager(
+        None,
+        store=MigrationStore(db_path),
+        file_cache=ParsedFileCache(spill_dir=os.path.join(work_dir, 'cache'))
+    )
+    tracemalloc = None
+    if not reset_peak_rss():
+        import tracemalloc
+        tracemalloc.start()
+    memory_key = "peak_rss_mb" if tracemalloc is None else "traced_peak_mb"
+    data_types = data_types or list(manager.migration_templates)
+    data_types = sorted(data_types, key=lambda t: bool(manager.get_migration_template(t).get('foreign_keys')))
+    results = {}
+    
+    for data_type in data_types:
+        template = manager.get_migration_template(data_type)
+        file_path = os.path.join(work_dir, f"{data_type}.{file_format}")
+        started = time.perf_counter()
+        generate_dataset(manager, data_type, rows, file_path, error_rate, duplicate_rate,
+                         broken_ref_rate, students=rows, seed=seed)
+        generated = time.perf_counter() - started
+        
+        mapping = {field: field for field in template['required_fields'] + template['optional_fields']}
+        columns = list(mapping)
+        dtypes = manager.read_dtypes(data_type, mapping)
+        seconds = {}
+        memory = {}
+        
+        def timed(stage, work):
+            if tracemalloc is None:
+                reset_peak_rss()
+            else:
+                tracemalloc.reset_peak()
+            started = time.perf_counter()
+            value = work()
+            seconds[stage] = seconds.get(stage, 0.0) + time.perf_counter() - started
+            if tracemalloc is None:
+                peak = peak_rss_mb()
+            else:
+                peak = round(tracemalloc.get_traced_memory()[1] / (1024 * 1024), 1)
+            memory[stage] = max(memory.get(stage, 0.0), peak or 0.0)
+            return value
+        
+        timed('header', lambda: manager.read_head(file_path))
+        timed('count', lambda: manager.count_records(file_path))
+        
+        def build_indexes():
+            manager.store.admission_index.reset()
+            len(manager.store.admission_index)
+            return manager.stored_row_hashes(data_type)
+        timed('index', build_indexes)
+        
+        seen = {}
+        chunks = manager.iter_chunks(file_path, columns=columns, dtypes=dtypes)
+        while True:
+            chunk = timed('parse', lambda: next(chunks, None))
+            if chunk is None:
+                break
+            df = manager.apply_mapping(chunk, mapping)
+            valid, _ = timed('validate', lambda: manager.validate_data(data_type, df, seen=seen))
+            timed('commit', lambda: manager._write_rows(data_type, df[valid], False, batch_size))
+        
+        results[data_type] = {
+            "generate_seconds": round(generated, 3),
+            "stages": {
+                stage: {
+                    "seconds": round(elapsed, 4),
+                    "rows_per_sec": round(rows / elapsed) if elapsed > 0 else None,
+                    memory_key: memory.get(stage)
+                }
+                for stage, elapsed in seconds.items()
+            }
+        }
+    manager.store.close()
+    if tracemalloc is not None:
+        tracemalloc.stop()
+    
+    return {
+        "created": datetime.now().isoformat(timespec='seconds'),
+        "python": sys.version.split()[0],
+        "pandas": pd.__version__,
+        "platform": sys.platform,
+        "rows": rows,
+        "format": file_format,
+        "error_rate": error_rate,
+        "duplicate_rate": duplicate_rate,
+        "broken_ref_rate": broken_ref_rate,
+        "results": results,
+    }
+
+def compare_benchmarks(baseline, current, tolerance=0.2):
+    """Stages whose throughput dropped more than tolerance below the baseline"""
+    for setting in ('rows', 'format'):
+        if baseline.get(setting) != current.get(setting):
+            raise ValueError(f"Baseline was run with {setting} {baseline.get(setting)}, "
+                             f"not {current.get(setting)}")
+    regressions = []
+    for data_type, result in current['results'].items():
+        before_stages = baseline.get('results', {}).get(data_type, {}).get('stages', {})
+        for stage, now in result['stages'].items():
+            before = before_stages.get(stage)
+            if not before or not before['rows_per_sec'] or not now['rows_per_sec']:
+                continue
+            ratio = now['rows_per_sec'] / before['rows_per_sec']
+            if ratio < 1 - tolerance:
+                regressions.append({
+                    "data_type": data_type,
+                    "stage": stage,
+                    "baseline_rows_per_sec": before['rows_per_sec'],
+                    "rows_per_sec": now['rows_per_sec'],
+                    "ratio": round(ratio, 3)
+                })
+    return regressions
+
+class ServiceError(Exception):
+    """A job service request that failed, with its HTTP status"""
+    
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+def _positive_int(spec, name, default):
+    """spec[name] as a whole number of at least 1, or default when absent"""
+    value = spec.get(name)
+    if value is None:
+        return default
+    if isinstance(value, bool) or not isinstance(value, (int, str)) or not str(value).strip().isdigit() \
+            or int(value) < 1:
+        raise ServiceError(400, f"{name} must be a whole number of at least 1, not {value!r}")
+    return int(value)
+
+class ServiceJob:
+    """One import job held by the service, and the streams following it"""
+    
+    def __init__(self, spec):
+        self.id = uuid.uuid4().hex[:12]
+        self.spec = spec
+        self.status = 'queued'
+        self.done = 0
+        self.total = 0
+        self.result = None
+        self.error = None
+        self.created = datetime.now().isoformat(timespec='seconds')
+        self.started = None
+        self.finished = None
+        self.cancel_event = threading.Event()
+        self.subscribers = set()
+    
+    @property
+    def finished_state(self):
+        return self.status in ('done', 'failed', 'cancelled')
+    
+    @property
+    def queue(self):
+        """Queue the job waits in: its school's, or a shared one when unnamed"""
+        return self.spec['school'] or 'default'
+    
+    def to_dict(self, result=True):
+        job = {
+            "id": self.id, "status": self.status, "school": self.spec['school'],
+            "data_type": self.spec['data_type'], "file": self.spec['file'], "dry_run": self.spec['dry_run'],
+            "done": self.done, "total": self.total, "error": self.error,
+            "created": self.created, "started": self.started, "finished": self.finished
+        }
+        if result:
+            job['result'] = self.result
+        return job
+    
+    def publish(self, event):
+        """Send an event to every stream; None ends them"""
+        for subscriber in self.subscribers:
+            subscriber.put_nowait(event)
+
+# Scratch copies of the store the job service keeps for dry runs; further
+# dry runs wait for one to come free
+SERVICE_DRY_RUN_COPIES = 2
+
+class ScratchCopies:
+    """Scratch copies of a store shared by dry runs, at most size at once.
+    
+    Every copy is a backup of the whole database, so rather than one per
+    dry run a few are kept and handed out in turn. A dry run rolls back
+    what it wrote, leaving its copy as it was taken: a copy is reused
+    while the store has not committed since, and replaced by a new backup
+    once it has. Commits are noticed through PRAGMA data_version on a
+    connection of our own, which changes whenever any other connection,
+    the store's included, commits.
+    """
+    
+    def __init__(self, store, size=SERVICE_DRY_RUN_COPIES):
+        self.store = store
+        self.lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(size)
+        self._idle = []  # (copy, data_version the backup was taken at)
+        self._watch = sqlite3.connect(store.db_path, check_same_thread=False)
+    
+    @contextmanager
+    def copy(self):
+        """A current scratch copy for one dry run"""
+        with self._slots:
+            with self.lock:
+                version = self._watch.execute("PRAGMA data_version").fetchone()[0]
+                copy, taken = self._idle.pop() if self._idle else (None, None)
+            if copy is not None and taken != version:
+                copy.remove()
+                copy = None
+            if copy is None:
+                copy = self.store.open_copy()
+            try:
+                yield copy
+            except BaseException:
+                copy.remove()  # Its state after a failure is not known
+                raise
+            with self.lock:
+                self._idle.append((copy, version))
+    
+    def close(self):
+        """Delete the idle copies; call once no dry run is running"""
+        with self.lock:
+            for copy, _ in self._idle:
+                copy.remove()
+            self._idle.clear()
+            self._watch.close()
+
+class JobService:
+    """Local asyncio service running imports for several operators.
+    
+    Jobs ({"file", "type", "mapping", "dry_run", "school"}) arrive over a
+    small HTTP API on TCP or a Unix socket and wait in one queue per
+    school. Workers take the schools in turn, so one school's backlog
+    cannot starve another, and at most max_queued jobs wait in total.
+    Each job is an ordinary import_data run on a worker thread against
+    the local store, or for dry runs one of a few reused scratch copies
+    of it; its progress is streamed to clients as JSON lines. Threads
+    rather than processes: a job streams its file chunk by chunk into the
+    one SQLite writer, the pyarrow and pandas parsers release the GIL,
+    and a process would have to pickle every parsed chunk back.
+    A named school also claims its students' admission numbers, so jobs
+    of different schools cannot overwrite each other's students.
+        
+        GET  /health                 service and queue state
+        GET  /jobs                   every job
+        POST /jobs                   submit a job (202, or 503 when full)
+        GET  /jobs/<id>              one job with its result
+        GET  /jobs/<id>/events       progress stream until the job ends
+        POST /jobs/<id>/cancel       cancel a queued or running job
+    """
+    
+    def __init__(self, db_path=DEFAULT_DB_PATH, workers=None, max_queued=SERVICE_MAX_QUEUED,
+                 rejects_dir=DEFAULT_REJECTS_DIR):
+        self.school = type('School', (), {})()
+        self.school.store = MigrationStore(db_path)
+        self.workers = workers or min(4, os.cpu_count() or 1)
+        self.max_queued = max_queued
+        self.rejects_dir = rejects_dir
+        self.jobs = OrderedDict()
+        self.queues = OrderedDict()
+        self.running = 0
+        self._executor = ThreadPoolExecutor(self.workers, thread_name_prefix='import-job')
+        self._dry_runs = ScratchCopies(self.school.store)
+        self._loop = None
+        self._wakeup = None
+    
+    async def serve(self, host='127.0.0.1', port=DEFAULT_SERVICE_PORT, path=None, ready=None):
+        """Serve until cancelled; ready(), if given, runs once listening"""
+        self._loop = asyncio.get_running_loop()
+        self._wakeup = asyncio.Event()
+        workers = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        if path:
+            server = await asyncio.start_unix_server(self._handle, path=path)
+        else:
+            server = await asyncio.start_server(self._handle, host, port)
+        try:
+            async with server:
+                if ready:
+                    ready()
+                await server.serve_forever()
+        finally:
+            for worker in workers:
+                worker.cancel()
+            for job in self.jobs.values():
+                job.cancel_event.set()
+            self.close()
+    
+    def close(self):
+        """Wait for running jobs, then release the store and its copies"""
+        self._executor.shutdown(wait=True)
+        self._dry_runs.close()
+        self.school.store.close()
+    
+    def submit(self, spec):
+        """Queue a job from a request body; raises ServiceError if invalid or full"""
+        if not isinstance(spec, dict) or not spec.get('file') or not spec.get('type'):
+            raise ServiceError(400, "A job needs at least \"file\" and \"type\"")
+        if spec['type'] not in DataMigrationManager(None).migration_templates:
+            raise ServiceError(400, f"Unknown data type: {spec['type']}")
+        if not os.path.isfile(spec['file']):
+            raise ServiceError(400, f"File not found: {spec['file']}")
+        if spec.get('mapping') is not None and not isinstance(spec['mapping'], dict):
+            raise ServiceError(400, "mapping must be a JSON object")
+        batch_size = _positive_int(spec, 'batch_size', IMPORT_BATCH_SIZE)
+        max_errors = _positive_int(spec, 'max_errors', ERROR_EXAMPLES)
+        if sum(len(pending) for pending in self.queues.values()) >= self.max_queued:
+            raise ServiceError(503, f"The queue is full ({self.max_queued} jobs waiting); try again later")
+        
+        job = ServiceJob({
+            "file": os.path.abspath(spec['file']),
+            "data_type": spec['type'],
+            "mapping": spec.get('mapping'),
+            "dry_run": bool(spec.get('dry_run')),
+            "school": str(spec['school']) if spec.get('school') else None,
+            "batch_size": batch_size,
+            "max_errors": max_errors
+        })
+        self.jobs[job.id] = job
+        self.queues.setdefault(job.queue, deque()).append(job)
+        self._forget_old_jobs()
+        self._wakeup.set()
+        return job
+    
+    def cancel(self, job):
+        """Drop a queued job or ask a running one to stop after its batch"""
+        job.cancel_event.set()
+        pending = self.queues.get(job.queue)
+        if job.status == 'queued' and pending is not None:
+            pending.remove(job)
+            if not pending:
+                del self.queues[job.queue]
+            self._finish(job, 'cancelled')
+    
+    def _forget_old_jobs(self):
+        finished = [job_id for job_id, job in self.jobs.items() if job.finished_state]
+        for job_id in finished[:max(len(finished) - SERVICE_JOB_HISTORY, 0)]:
+            del self.jobs[job_id]
+    
+    def _next_job(self):
+        """The next job, taking schools round-robin"""
+        if not self.queues:
+            return None
+        school, pending = next(iter(self.queues.items()))
+        job = pending.popleft()
+        del self.queues[school]
+        if pending:
+            self.queues[school] = pending  # To the back of the line
+        return job
+    
+    async def _worker(self):
+        while True:
+            job = self._next_job()
+            if job is None:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+            
+            job.status = 'running'
+            job.started = datetime.now().isoformat(timespec='seconds')
+            job.publish({"event": "running", "job": job.to_dict(result=False)})
+            self.running += 1
+            try:
+                result = await self._loop.run_in_executor(self._executor, self._run, job)
+            except Exception as e:
+                job.error = str(e)
+                self._finish(job, 'failed')
+            else:
+                job.result = result
+                self._finish(job, 'cancelled' if result['cancelled'] else 'done')
+            finally:
+                self.running -= 1
+    
+    def _run(self, job):
+        """Run one import on a worker thread.
+        
+        Dry runs go against a scratch copy of the store, so that other
+        jobs keep writing while they run.
+        """
+        if not job.spec['dry_run']:
+            return self._import(job, DataMigrationManager(self.school))
+        with self._dry_runs.copy() as store:
+            return self._import(job, DataMigrationManager(self.school, store=store))
+    
+    def _import(self, job, manager):
+        spec = job.spec
+        mapping = spec['mapping']
+        if not mapping:
+            mapping, _ = manager.suggest_mapping(spec['data_type'], list(manager.read_head(spec['file'], 0).columns))
+        template = manager.get_migration_template(spec['data_type'])
+        missing_required = [f for f in template['required_fields'] if f not in mapping.values()]
+        if missing_required:
+            raise ValueError(f"The following required fields are not mapped: {', '.join(missing_required)}")
+        
+        def progress(done, total):
+            self._loop.call_soon_threadsafe(self._progress, job, done, total)
+        
+        started = time.monotonic()
+        result = manager.import_data(
+            spec['data_type'],
+            spec['file'],
+            mapping,
+            dry_run=spec['dry_run'],
+            batch_size=spec['batch_size'],
+            progress=progress,
+            cancel_event=job.cancel_event,
+            rejects_path=os.path.join(
+                self.rejects_dir,
+                f"{os.path.splitext(os.path.basename(spec['file']))[0]}-{spec['data_type']}-{job.id}-rejects.csv"
+            ),
+            max_errors=spec['max_errors'],
+            metrics=ImportMetrics(),
+            school=spec['school']
+        )
+        result['file'] = spec['file']
+        result['mapping'] = mapping
+        result['elapsed_seconds'] = round(time.monotonic() - started, 3)
+        return result
+    
+    def _progress(self, job, done, total):
+        job.done = done
+        job.total = total
+        job.publish({"event": "progress", "id": job.id, "done": done, "total": total})
+    
+    def _finish(self, job, status):
+        job.status = status
+        job.finished = datetime.now().isoformat(timespec='seconds')
+        job.publish({"event": "finished", "job": job.to_dict()})
+        job.publish(None)
+    
+    async def _handle(self, reader, writer):
+        """Serve one HTTP request per connection"""
+        try:
+            request_line = await reader.readline()
+            if not request_line:
+                return
+            method, target = request_line.decode('latin-1').split()[:2]
+            headers = {}
+            while True:
+                line = await reader.readline()
+                if line in (b'\r\n', b'\n', b''):
+                    break
+                name, _, value = line.decode('latin-1').partition(':')
+                headers[name.strip().lower()] = value.strip()
+            length = int(headers.get('content-length') or 0)
+            body = await reader.readexactly(length) if length else b''
+            await self._route(method, urlsplit(target).path.rstrip('/'), body, writer)
+        except ServiceError as e:
+            await self._respond(writer, e.status, {"error": str(e)})
+        except (ValueError, json.JSONDecodeError) as e:
+            await self._respond(writer, 400, {"error": f"Bad request: {e}"})
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+    
+    async def _route(self, method, path, body, writer):
+        parts = path.strip('/').split('/')
+        if method == 'GET' and parts == ['health']:
+            return await self._respond(writer, 200, {
+                "status": "ok", "workers": self.workers, "running": self.running,
+                "queued": {school: len(pending) for school, pending in self.queues.items()}
+            })
+        if parts[0] != 'jobs' or len(parts) > 3:
+            raise ServiceError(404, f"Not found: {path}")
+        if len(parts) == 1:
+            if method == 'GET':
+                return await self._respond(writer, 200, [job.to_dict(result=False) for job in self.jobs.values()])
+            if method == 'POST':
+                job = self.submit(json.loads(body or b'{}'))
+                return await self._respond(writer, 202, job.to_dict())
+            raise ServiceError(405, f"{method} not allowed on {path}")
+        
+        job = self.jobs.get(parts[1])
+        if job is None:
+            raise ServiceError(404, f"No such job: {parts[1]}")
+        action = parts[2] if len(parts) == 3 else None
+        if method == 'GET' and action is None:
+            return await self._respond(writer, 200, job.to_dict())
+        if method == 'POST' and action == 'cancel':
+            self.cancel(job)
+            return await self._respond(writer, 202, job.to_dict(result=False))
+        if method == 'GET' and action == 'events':
+            return await self._stream(job, writer)
+        raise ServiceError(404, f"Not found: {method} {path}")
+    
+    async def _respond(self, writer, status, payload):
+        body = json.dumps(payload).encode('utf-8')
+        writer.write(
+            f"HTTP/1.1 {status} {http.client.responses.get(status, '')}\r\n"
+            f"Content-Type: application/json\r\nContent-Length: {len(body)}\r\n"
+            f"Connection: close\r\n\r\n".encode('latin-1') + body
+        )
+        await writer.drain()
+    
+    async def _stream(self, job, writer):
+        """Write a job's events as JSON lines until it finishes"""
+        writer.write(
+            b"HTTP/1.1 200 OK\r\nContent-Type: application/x-ndjson\r\nConnection: close\r\n\r\n"
+        )
+        if job.finished_state:
+            writer.write(json.dumps({"event": "finished", "job": job.to_dict()}).encode('utf-8') + b"\n")
+            await writer.drain()
+            return
+        events = asyncio.Queue()
+        job.subscribers.add(events)
+        try:
+            writer.write(json.dumps({"event": job.status, "job": job.to_dict(result=False)}).encode('utf-8') + b"\n")
+            await writer.drain()
+            while True:
+                event = await events.get()
+                if event is None:
+                    return
+                writer.write(json.dumps(event).encode('utf-8') + b"\n")
+                await writer.drain()
+        finally:
+            job.subscribers.discard(events)
+
+class _UnixHTTPConnection(http.client.HTTPConnection):
+    def __init__(self, path, timeout=None):
+        super().__init__('localhost', timeout=timeout)
+        self.socket_path = path
+    
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(self.socket_path)
+
+class JobClient:
+    """Client of a JobService at "unix:/path" or "http://host:port" """
+    
+    def __init__(self, address, timeout=30):
+        self.address = address
+        self.timeout = timeout
+    
+    def _connection(self, timeout):
+        """A new connection per request; the service closes each one"""
+        if self.address.startswith('unix:'):
+            return _UnixHTTPConnection(self.address[len('unix:'):], timeout=timeout)
+        url = urlsplit(self.address if '://' in self.address else f"http://{self.address}")
+        return http.client.HTTPConnection(url.hostname, url.port or DEFAULT_SERVICE_PORT, timeout=timeout)
+    
+    def _request(self, method, path, payload=None, stream=False):
+        connection = self._connection(self.timeout)
+        body = json.dumps(payload).encode('utf-8') if payload is not None else None
+        try:
+            connection.connect()
+            if stream:
+                connection.sock.settimeout(None)  # Waits in the queue can be long
+            connection.request(method, path, body=body, headers={"Content-Type": "application/json"})
+        except OSError as e:
+            connection.close()
+            raise ServiceError(503, f"Import service unavailable at {self.address}: {e}") from e
+        response = connection.getresponse()
+        if response.status >= 400:
+            try:
+                message = json.loads(response.read()).get('error')
+            except ValueError:
+                message = None
+            connection.close()
+            raise ServiceError(response.status, message or f"Service returned {response.status}")
+        return connection, response
+    
+    def _json(self, method, path, payload=None):
+        connection, response = self._request(method, path, payload)
+        try:
+            return json.loads(response.read())
+        finally:
+            connection.close()
+    
+    def health(self):
+        return self._json('GET', '/health')
+    
+    def jobs(self):
+        return self._json('GET', '/jobs')
+    
+    def job(self, job_id):
+        return self._json('GET', f'/jobs/{job_id}')
+    
+    def cancel(self, job_id):
+        return self._json('POST', f'/jobs/{job_id}/cancel')
+    
+    def submit(self, file_path, data_type, mapping=None, dry_run=False, school=None, batch_size=None,
+               max_errors=None):
+        """Queue an import; returns the job"""
+        return self._json('POST', '/jobs', {
+            "file": os.path.abspath(file_path), "type": data_type, "mapping": mapping,
+            "dry_run": dry_run, "school": school, "batch_size": batch_size, "max_errors": max_errors
+        })
+    
+    def events(self, job_id):
+        """Yield a job's events as they happen, ending with "finished" """
+        connection, response = self._request('GET', f'/jobs/{job_id}/events', stream=True)
+        try:
+            for line in response:
+                if line.strip():
+                    yield json.loads(line)
+        finally:
+            connection.close()
+    
+    def run(self, file_path, data_type, mapping=None, dry_run=False, school=None, progress=None,
+            cancel_event=None, **options):
+        """Submit an import and follow it to the end, like import_data.
+        
+        progress(done, total) is called as the service reports batches, and
+        setting cancel_event cancels the job. Returns the import result.
+        """
+        job = self.submit(file_path, data_type, mapping, dry_run, school, **options)
+        finished = threading.Event()
+        
+        def cancel_when_asked():
+            while not finished.is_set():
+                if cancel_event.wait(0.2):
+                    self.cancel(job['id'])
+                    return
+        
+        if cancel_event is not None:
+            threading.Thread(target=cancel_when_asked, name=f"cancel-{job['id']}", daemon=True).start()
+        try:
+            for event in self.events(job['id']):
+                if event['event'] == 'progress' and progress:
+                    progress(event['done'], event['total'])
+                elif event['event'] == 'finished':
+                    job = event['job']
+        finally:
+            finished.set()
+        
+        if job['status'] == 'failed':
+            raise ServiceError(500, job['error'])
+        if job.get('result') is None:
+            # Cancelled before it left the queue
+            return {"data_type": data_type, "dry_run": dry_run, "cancelled": True, "resumed_from": 0,
+                    "total": 0, "imported": 0, "failed": 0, "new": 0, "changed": 0, "unchanged": 0,
+                    "error_count": 0, "rule_counts": {}, "rejects_file": None, "metrics": ImportMetrics().finish(),
+                    "errors": []}
+        return job['result']
 
 class MigrationDialog:
     def __init__(self, parent, school):
@@ -90,10 +4747,92 @@ class MigrationDialog:
         
         self.current_file = None
         self.current_data_type = None
+        self.current_mapping = {}
         self.file_preview_data = []
+        
+        # Windowed preview over the uploaded file; preview_filter holds the
+        # failed row positions when only those are shown
+        self.pager = None
+        self.preview_top = 0
+        self.preview_filter = None
+        self.preview_errors = None
         self.field_mapping = {}
         
-        self.create_widgets()
+        # Background tasks by name; each has its own queue and cancel event
+        self.tasks = {}
+        self.dialog.protocol("WM_DELETE_WINDOW", self.close)
+        
+        self.create_widgets()
+    
+    def run_in_background(self, name, work, on_done, on_progress=None):
+        """Run work(progress, cancel_event) on a worker thread.
+        
+        The worker reports back through a queue that is polled from the Tk
+        loop, so on_done(result, error) and on_progress(*args) always run
+        on the UI thread. Starting a task with the same name cancels and
+        supersedes the previous one.
+        """
+        previous = self.tasks.get(name)
+        if previous:
+            previous['cancel'].set()
+        
+        task = {
+            'queue': queue.Queue(),
+            'cancel': threading.Event(),
+            'on_done': on_done,
+            'on_progress': on_progress
+        }
+        
+        def progress(*args):
+            task['queue'].put(('progress', args))
+        
+        def target():
+            try:
+                result = work(progress, task['cancel'])
+            except Exception as e:
+                traceback.print_exc()
+                task['queue'].put(('error', e))
+            else:
+                task['queue'].put(('done', result))
+        
+        self.tasks[name] = task
+        threading.Thread(target=target, name=f"migration-{name}", daemon=True).start()
+        self.dialog.after(WORKER_POLL_MS, self._poll_task, name, task)
+    
+    def _poll_task(self, name, task):
+        """Drain a worker queue and reschedule until the task finishes"""
+        if self.tasks.get(name) is not task:
+            return  # Superseded or dialog closed
+        
+        latest_progress = None
+        try:
+            while True:
+                kind, payload = task['queue'].get_nowait()
+                if kind == 'progress':
+                    latest_progress = payload
+                    continue
+                del self.tasks[name]
+                if latest_progress and task['on_progress']:
+                    task['on_progress'](*latest_progress)
+                if kind == 'error':
+                    task['on_done'](None, payload)
+                else:
+                    task['on_done'](payload, None)
+                return
+        except queue.Empty:
+            pass
+        
+        # Only the most recent progress update is worth redrawing
+        if latest_progress and task['on_progress']:
+            task['on_progress'](*latest_progress)
+        self.dialog.after(WORKER_POLL_MS, self._poll_task, name, task)
+    
+    def close(self):
+        """Cancel any running work and close the dialog"""
+        for task in self.tasks.values():
+            task['cancel'].set()
+        self.tasks.clear()
+        self.dialog.destroy()
     
     def create_widgets(self):
         # Main notebook for different migration steps
@@ -133,15 +4872,33 @@ class MigrationDialog:
             )
             rb.pack(anchor='w', padx=50, pady=5)
         
+        ttk.Radiobutton(
+            frame,
+            text="All types (one multi-sheet workbook or zip)",
+            variable=self.data_type_var,
+            value=PACKAGE_DATA_TYPE,
+            command=self.enable_step2
+        ).pack(anchor='w', padx=50, pady=5)
+        
         # Template download
         ttk.Label(frame, text="Need a template file?").pack(pady=10)
         self.download_btn = ttk.Button(
             frame,
-            text="Download CSV Template",
+            text="Download Template",
             command=self.download_template
         )
         self.download_btn.pack(pady=5)
         
+        # Data already migrated, for audits or moving to another system
+        self.export_btn = ttk.Button(
+            frame,
+            text="Export Stored Data...",
+            command=self.export_data
+        )
+        self.export_btn.pack(pady=5)
+        self.export_label = ttk.Label(frame, text="")
+        self.export_label.pack()
+        
         # Navigation
         nav_frame = ttk.Frame(frame)
         nav_frame.pack(side='bottom', fill='x', pady=10)
@@ -176,16 +4933,36 @@ class MigrationDialog:
         self.preview_label = ttk.Label(frame, text="File preview will appear here")
         self.preview_label.pack(pady=10)
         
-        # Treeview with scrollbars
+        preview_tools = ttk.Frame(frame)
+        preview_tools.pack(fill='x', padx=20)
+        
+        ttk.Label(preview_tools, text="Go to row:").pack(side='left')
+        self.goto_var = tk.StringVar()
+        goto_entry = ttk.Entry(preview_tools, textvariable=self.goto_var, width=10)
+        goto_entry.pack(side='left', padx=5)
+        goto_entry.bind('<Return>', lambda event: self.goto_preview_row())
+        ttk.Button(preview_tools, text="Go", command=self.goto_preview_row).pack(side='left')
+        
+        self.failed_only_var = tk.IntVar(value=0)
+        ttk.Checkbutton(
+            preview_tools,
+            text="Only rows that fail validation",
+            variable=self.failed_only_var,
+            command=self.toggle_failed_filter
+        ).pack(side='right')
+        
+        # Treeview with scrollbars. The vertical scrollbar spans the whole
+        # file and moves the window instead of scrolling the Treeview.
         tree_frame = ttk.Frame(frame)
         tree_frame.pack(fill='both', expand=True, padx=20, pady=5)
         
-        self.preview_tree = ttk.Treeview(tree_frame)
+        self.preview_tree = ttk.Treeview(tree_frame, height=PREVIEW_WINDOW_ROWS)
         self.preview_tree.pack(side='left', fill='both', expand=True)
+        for sequence in ('<MouseWheel>', '<Button-4>', '<Button-5>'):
+            self.preview_tree.bind(sequence, self.on_preview_wheel)
         
-        vsb = ttk.Scrollbar(tree_frame, orient="vertical", command=self.preview_tree.yview)
-        vsb.pack(side='right', fill='y')
-        self.preview_tree.configure(yscrollcommand=vsb.set)
+        self.preview_vsb = ttk.Scrollbar(tree_frame, orient="vertical", command=self.scroll_preview)
+        self.preview_vsb.pack(side='right', fill='y')
         
         hsb = ttk.Scrollbar(frame, orient="horizontal", command=self.preview_tree.xview)
         hsb.pack(fill='x', padx=20)
@@ -209,7 +4986,7 @@ class MigrationDialog:
             nav_frame,
             text="Next →",
             state='disabled',
-            command=lambda: self.notebook.select(2)
+            command=self.leave_step2
         )
         self.next_btn2.pack(side='right', padx=10)
     
@@ -224,30 +5001,41 @@ class MigrationDialog:
         # Mapping instructions
         ttk.Label(frame, text="For each field in your file, select the corresponding system field").pack(pady=5)
         
-        # Container for mapping widgets
+        self.mapping_status = ttk.Label(frame, text="")
+        self.mapping_status.pack(pady=2)
+        
+        # One row per file field in a single tree, so wide files do not
+        # create a combobox per column; the editor below changes the
+        # selected rows.
         self.mapping_container = ttk.Frame(frame)
         self.mapping_container.pack(fill='both', expand=True, padx=20, pady=10)
         
-        # Add canvas and scrollbar
-        canvas = tk.Canvas(self.mapping_container)
-        scrollbar = ttk.Scrollbar(self.mapping_container, orient="vertical", command=canvas.yview)
-        scrollable_frame = ttk.Frame(canvas)
-        
-        scrollable_frame.bind(
-            "<Configure>",
-            lambda e: canvas.configure(
-                scrollregion=canvas.bbox("all")
-            )
+        self.mapping_tree = ttk.Treeview(
+            self.mapping_container,
+            columns=('file', 'system', 'match'),
+            show='headings',
+            selectmode='extended'
         )
+        self.mapping_tree.heading('file', text="File Field")
+        self.mapping_tree.heading('system', text="System Field")
+        self.mapping_tree.heading('match', text="Matched By")
+        self.mapping_tree.column('file', width=250, anchor='w')
+        self.mapping_tree.column('system', width=200, anchor='w')
+        self.mapping_tree.column('match', width=100, anchor='w')
+        self.mapping_tree.bind('<<TreeviewSelect>>', self.on_mapping_select)
         
-        canvas.create_window((0, 0), window=scrollable_frame, anchor="nw")
-        canvas.configure(yscrollcommand=scrollbar.set)
-        
-        canvas.pack(side="left", fill="both", expand=True)
+        scrollbar = ttk.Scrollbar(self.mapping_container, orient="vertical", command=self.mapping_tree.yview)
+        self.mapping_tree.configure(yscrollcommand=scrollbar.set)
+        self.mapping_tree.pack(side="left", fill="both", expand=True)
         scrollbar.pack(side="right", fill="y")
         
-        # This will hold our mapping widgets
-        self.mapping_content = scrollable_frame
+        editor = ttk.Frame(frame)
+        editor.pack(fill='x', padx=20)
+        ttk.Label(editor, text="System field for selected:").pack(side='left')
+        self.mapping_var = tk.StringVar()
+        self.mapping_editor = ttk.Combobox(editor, textvariable=self.mapping_var, state='readonly')
+        self.mapping_editor.pack(side='left', padx=5)
+        self.mapping_editor.bind('<<ComboboxSelected>>', self.on_mapping_change)
         
         # Navigation
         nav_frame = ttk.Frame(frame)
@@ -290,6 +5078,10 @@ class MigrationDialog:
         self.summary_records = ttk.Label(summary_frame, text="", font=('Helvetica', 10))
         self.summary_records.grid(row=2, column=1, sticky='w')
         
+        ttk.Label(summary_frame, text="Changes:").grid(row=3, column=0, sticky='e')
+        self.summary_changes = ttk.Label(summary_frame, text="", font=('Helvetica', 10))
+        self.summary_changes.grid(row=3, column=1, sticky='w')
+        
         # Dry run option
         self.dry_run_var = tk.IntVar(value=1)
         ttk.Checkbutton(
@@ -298,14 +5090,32 @@ class MigrationDialog:
             variable=self.dry_run_var
         ).pack(pady=10)
         
-        # Import button
+        # Import and cancel buttons
+        button_frame = ttk.Frame(frame)
+        button_frame.pack(pady=10)
+        
         self.import_btn = ttk.Button(
-            frame,
+            button_frame,
             text="Start Import",
             style='Accent.TButton',
             command=self.run_import
         )
-        self.import_btn.pack(pady=20)
+        self.import_btn.pack(side='left', padx=5)
+        
+        self.cancel_btn = ttk.Button(
+            button_frame,
+            text="Cancel",
+            state='disabled',
+            command=self.cancel_import
+        )
+        self.cancel_btn.pack(side='left', padx=5)
+        
+        # Progress
+        self.progress_bar = ttk.Progressbar(frame, orient='horizontal', mode='determinate')
+        self.progress_bar.pack(fill='x', padx=20, pady=5)
+        
+        self.progress_label = ttk.Label(frame, text="")
+        self.progress_label.pack()
         
         # Results area
         results_frame = ttk.Frame(frame)
@@ -318,6 +5128,15 @@ class MigrationDialog:
         scrollbar.pack(side='right', fill='y')
         self.results_text['yscrollcommand'] = scrollbar.set
         
+        self.rejects_file = None
+        self.rejects_btn = ttk.Button(
+            frame,
+            text="Open Rejected Rows",
+            state='disabled',
+            command=self.open_rejects
+        )
+        self.rejects_btn.pack()
+        
         # Navigation
         nav_frame = ttk.Frame(frame)
         nav_frame.pack(side='bottom', fill='x', pady=10)
@@ -332,7 +5151,7 @@ class MigrationDialog:
             nav_frame,
             text="Finish",
             state='disabled',
-            command=self.dialog.destroy
+            command=self.close
         )
         self.finish_btn.pack(side='right', padx=10)
     
@@ -342,13 +5161,28 @@ class MigrationDialog:
         self.notebook.tab(1, state='normal')
         self.next_btn1.config(state='normal')
     
+    def leave_step2(self):
+        """Go on to field mapping, or straight to import for a package"""
+        if self.current_data_type == PACKAGE_DATA_TYPE:
+            self.notebook.tab(3, state='normal')
+            self.notebook.select(3)
+            self.update_summary()
+        else:
+            self.notebook.select(2)
+    
     def browse_file(self):
         """Handle file browsing"""
-        file_types = [
-            ('CSV files', '*.csv'),
-            ('Excel files', '*.xls *.xlsx'),
-            ('All files', '*.*')
-        ]
+        if self.current_data_type == PACKAGE_DATA_TYPE:
+            file_types = [
+                ('Workbooks and zip files', '*.xlsx *.zip'),
+                ('All files', '*.*')
+            ]
+        else:
+            file_types = [
+                ('CSV files', '*.csv'),
+                ('Excel files', '*.xls *.xlsx'),
+                ('All files', '*.*')
+            ]
         file_path = filedialog.askopenfilename(filetypes=file_types)
         if file_path:
             self.current_file = file_path
@@ -360,73 +5194,297 @@ class MigrationDialog:
         if not self.current_file or not self.current_data_type:
             return
         
-        try:
-            if self.current_file.endswith('.csv'):
-                df = pd.read_csv(self.current_file)
-            elif self.current_file.endswith(('.xls', '.xlsx')):
-                df = pd.read_excel(self.current_file)
-            else:
-                self.validation_msg.config(text="Unsupported file format", foreground='red')
+        self.pager = None
+        if self.current_data_type == PACKAGE_DATA_TYPE:
+            self.validate_package()
+            return
+        
+        if not self.current_file.endswith(('.csv', '.xls', '.xlsx')):
+            self.validation_msg.config(text="Unsupported file format", foreground='red')
+            return
+        
+        # Get template for this data type
+        template = self.migration_manager.get_migration_template(self.current_data_type)
+        if not template:
+            self.validation_msg.config(text="Invalid data type", foreground='red')
+            return
+        
+        self.next_btn2.config(state='disabled')
+        self.validation_msg.config(text="Reading file...", foreground='black')
+        file_path = self.current_file
+        data_type = self.current_data_type
+        
+        def work(progress, cancel_event):
+            df = self.migration_manager.read_head(file_path, PREVIEW_ROWS)
+            return df, self.migration_manager.suggest_mapping(data_type, list(df.columns))
+        
+        def on_done(result, error):
+            if error is not None:
+                self.validation_msg.config(text=f"Error reading file: {str(error)}", foreground='red')
                 return
+            df, suggestion = result
             
-            # Get template for this data type
-            template = self.migration_manager.get_migration_template(self.current_data_type)
-            if not template:
-                self.validation_msg.config(text="Invalid data type", foreground='red')
-                return
+            # Show preview
+            self.file_preview_data = df.to_dict('records')
+            self.open_preview(file_path)
             
-            # Check required fields
-            missing_fields = [field for field in template['required_fields'] 
-                            if field not in df.columns]
+            # Required fields no column matched can still be mapped by hand
+            missing_fields = [field for field in template['required_fields']
+                              if field not in suggestion[0].values()]
             if missing_fields:
                 self.validation_msg.config(
-                    text=f"Missing required fields: {', '.join(missing_fields)}",
-                    foreground='red'
+                    text=f"Map these required fields in the next step: {', '.join(missing_fields)}",
+                    foreground='orange'
                 )
+            else:
+                self.validation_msg.config(text="File is valid", foreground='green')
+            self.next_btn2.config(state='normal')
+            self.setup_field_mapping(suggestion)
+        
+        self.run_in_background('validate', work, on_done)
+    
+    def validate_package(self):
+        """Detect the data type of every part of a workbook or zip upload"""
+        if not self.current_file.endswith(('.xlsx', '.zip')):
+            self.validation_msg.config(text="Upload a multi-sheet .xlsx workbook or a .zip file", foreground='red')
+            return
+        
+        self.next_btn2.config(state='disabled')
+        self.validation_msg.config(text="Reading file...", foreground='black')
+        file_path = self.current_file
+        
+        def work(progress, cancel_event):
+            with tempfile.TemporaryDirectory(prefix='migration_') as extract_dir:
+                jobs = self.migration_manager.discover_package_jobs(file_path, extract_dir)
+                for job in jobs:
+                    job['part'] = job.get('sheet') or os.path.relpath(job['file'], extract_dir)
+                return jobs
+        
+        def on_done(jobs, error):
+            if error is not None:
+                self.validation_msg.config(text=f"Error reading file: {str(error)}", foreground='red')
                 return
             
-            # Show preview
-            self.file_preview_data = df.head(5).to_dict('records')
+            self.file_preview_data = [
+                {
+                    "Part": job['part'],
+                    "Type": (job.get('data_type') or '').capitalize(),
+                    "Status": job.get('error') or "Ready"
+                }
+                for job in jobs
+            ]
             self.show_file_preview()
             
-            self.validation_msg.config(text="File is valid", foreground='green')
+            ready = [job for job in jobs if not job.get('error')]
+            if not ready:
+                self.validation_msg.config(text="No importable data found in the file", foreground='red')
+                return
+            self.validation_msg.config(
+                text=f"Found {len(ready)} importable part(s): "
+                     f"{', '.join(sorted({job['data_type'] for job in ready}))}",
+                foreground='green'
+            )
             self.next_btn2.config(state='normal')
-            self.setup_field_mapping()
-            
-        except Exception as e:
-            self.validation_msg.config(text=f"Error reading file: {str(e)}", foreground='red')
-            traceback.print_exc()
+        
+        self.run_in_background('validate', work, on_done)
+    
+    def open_preview(self, file_path):
+        """Index the file for the windowed preview on a worker thread"""
+        self.preview_filter = None
+        self.preview_errors = None
+        self.failed_only_var.set(0)
+        self.preview_label.config(text="Loading preview...")
+        pager = FilePager(self.migration_manager, file_path)
+        
+        def work(progress, cancel_event):
+            pager.open()
+            pager.page(0)
+            return pager
+        
+        def on_done(pager, error):
+            if error is not None:
+                self.preview_label.config(text=f"Preview unavailable: {str(error)}")
+                return
+            self.pager = pager
+            self.show_file_preview()
+        
+        self.run_in_background('preview', work, on_done)
     
     def show_file_preview(self):
-        """Display a preview of the file data"""
-        if not self.file_preview_data:
-            return
+        """Display a preview of the file data.
         
+        Files are shown through the pager, a window of rows at a time;
+        package parts are a short list and are shown whole.
+        """
         # Clear previous preview
         for item in self.preview_tree.get_children():
             self.preview_tree.delete(item)
         self.preview_tree['columns'] = []
         
-        # Set up columns from first row
-        columns = list(self.file_preview_data[0].keys())
+        if self.pager is not None:
+            columns = list(self.pager.columns)
+            if self.preview_filter is not None:
+                columns.append('Errors')
+        elif self.file_preview_data:
+            columns = list(self.file_preview_data[0].keys())
+        else:
+            return
         self.preview_tree['columns'] = columns
         
         # Create headings
         self.preview_tree.heading('#0', text='Row')
         for col in columns:
             self.preview_tree.heading(col, text=col)
-            self.preview_tree.column(col, width=100, anchor='w')
+            self.preview_tree.column(col, width=300 if col == 'Errors' else 100, anchor='w')
+        
+        if self.pager is not None:
+            self.render_preview(0)
+            return
         
         # Add data rows
         for i, row in enumerate(self.file_preview_data, 1):
             values = [str(row[col])[:50] for col in columns]  # Limit preview length
             self.preview_tree.insert('', 'end', text=str(i), values=values)
+        self.preview_vsb.set(0, 1)
+    
+    def preview_length(self):
+        """Number of rows the preview window moves over"""
+        if self.preview_filter is not None:
+            return len(self.preview_filter)
+        return self.pager.total if self.pager else 0
+    
+    def render_preview(self, top):
+        """Show the window of rows starting at top, reading pages if needed"""
+        if self.pager is None:
+            return
+        length = self.preview_length()
+        top = max(0, min(top, length - PREVIEW_WINDOW_ROWS))
+        self.preview_top = top
+        end = min(top + PREVIEW_WINDOW_ROWS, length)
+        if self.preview_filter is not None:
+            positions = self.preview_filter[top:end]
+        else:
+            positions = list(range(top, end))
+        if length:
+            self.preview_vsb.set(top / length, end / length)
+        else:
+            self.preview_vsb.set(0, 1)
+        
+        rows = self.pager.cached_rows(positions)
+        if rows is not None:
+            self.fill_preview(positions, rows)
+            return
+        
+        pager = self.pager
+        
+        def work(progress, cancel_event):
+            return pager.rows(positions)
+        
+        def on_done(rows, error):
+            if self.pager is not pager or self.preview_top != top:
+                return  # The window moved on while the page was read
+            if error is not None:
+                self.preview_label.config(text=f"Error reading rows: {str(error)}")
+                return
+            self.fill_preview(positions, rows)
+        
+        self.preview_label.config(text="Reading rows...")
+        self.run_in_background('preview', work, on_done)
+    
+    def fill_preview(self, positions, rows):
+        """Replace the Treeview contents with the rows of the window"""
+        for item in self.preview_tree.get_children():
+            self.preview_tree.delete(item)
+        for position, row in zip(positions, rows.itertuples(index=False, name=None)):
+            values = ['' if pd.isna(value) else str(value)[:50] for value in row]  # Limit preview length
+            if self.preview_filter is not None:
+                values.append('; '.join(self.preview_errors[position]))
+            self.preview_tree.insert('', 'end', text=str(position + 1), values=values)
+        
+        if not positions:
+            text = "No rows fail validation" if self.preview_filter is not None else "The file has no rows"
+        elif self.preview_filter is not None:
+            text = (f"Failed rows {self.preview_top + 1:,}-{self.preview_top + len(positions):,} "
+                    f"of {len(self.preview_filter):,} (file has {self.pager.total:,} rows)")
+        else:
+            text = f"Rows {positions[0] + 1:,}-{positions[-1] + 1:,} of {self.pager.total:,}"
+        self.preview_label.config(text=text)
+    
+    def scroll_preview(self, *args):
+        """Scrollbar command: move the preview window over the whole file"""
+        if args[0] == 'moveto':
+            top = int(float(args[1]) * self.preview_length())
+        else:
+            step = PREVIEW_WINDOW_ROWS if args[2] == 'pages' else 1
+            top = self.preview_top + int(args[1]) * step
+        self.render_preview(top)
+    
+    def on_preview_wheel(self, event):
+        """Scroll the preview window a few rows per wheel notch"""
+        up = event.num == 4 or getattr(event, 'delta', 0) > 0
+        self.render_preview(self.preview_top + (-3 if up else 3))
+        return 'break'
+    
+    def goto_preview_row(self):
+        """Jump to a file row number, or the first failed row from it"""
+        if self.pager is None:
+            return
+        try:
+            row = int(self.goto_var.get().replace(',', ''))
+        except ValueError:
+            self.dialog.bell()
+            return
+        if self.preview_filter is not None:
+            self.render_preview(bisect.bisect_left(self.preview_filter, row - 1))
+        else:
+            self.render_preview(row - 1)
+    
+    def toggle_failed_filter(self):
+        """Switch the preview between all rows and rows that fail validation"""
+        if self.pager is None:
+            self.failed_only_var.set(0)
+            return
+        if not self.failed_only_var.get():
+            self.preview_filter = None
+            self.show_file_preview()
+            return
+        if self.preview_errors is not None:
+            self.preview_filter = list(self.preview_errors)
+            self.show_file_preview()
+            return
+        
+        data_type = self.current_data_type
+        pager = self.pager
+        # The mapping step's choices, once it has been set up for this file
+        mapping = None
+        if self.field_mapping and set(self.field_mapping) == set(pager.columns):
+            mapping = {column: field for column, field in self.field_mapping.items() if field}
+        self.preview_label.config(text="Validating file...")
+        
+        def work(progress, cancel_event):
+            return self.migration_manager.failed_rows(data_type, pager.file_path, cancel_event, mapping)
+        
+        def on_done(failures, error):
+            if self.pager is not pager or not self.failed_only_var.get():
+                return
+            if error is not None:
+                self.failed_only_var.set(0)
+                self.preview_label.config(text=f"Validation failed: {str(error)}")
+                return
+            self.preview_errors = failures
+            self.preview_filter = list(failures)
+            self.show_file_preview()
+        
+        self.run_in_background('preview_check', work, on_done)
     
-    def setup_field_mapping(self):
-        """Set up the field mapping interface"""
-        # Clear previous widgets
-        for widget in self.mapping_content.winfo_children():
-            widget.destroy()
+    def setup_field_mapping(self, suggestion=None):
+        """Set up the field mapping interface.
+        
+        suggestion is a (mapping, matches) pair from suggest_mapping, when
+        it was already computed off the UI thread.
+        """
+        self.mapping_tree.delete(*self.mapping_tree.get_children())
+        self.field_mapping = {}
         
         if not self.file_preview_data:
             return
@@ -436,42 +5494,42 @@ class MigrationDialog:
         if not template:
             return
         
-        # Create header
-        ttk.Label(self.mapping_content, text="File Field", font=('Helvetica', 10, 'bold')).grid(row=0, column=0, padx=5, pady=2)
-        ttk.Label(self.mapping_content, text="→", font=('Helvetica', 10, 'bold')).grid(row=0, column=1, padx=5, pady=2)
-        ttk.Label(self.mapping_content, text="System Field", font=('Helvetica', 10, 'bold')).grid(row=0, column=2, padx=5, pady=2)
-        
-        # Create mapping rows
         file_fields = list(self.file_preview_data[0].keys())
         system_fields = template['required_fields'] + template['optional_fields']
+        self.mapping_editor.config(values=[""] + system_fields)
+        self.mapping_var.set("")
         
-        self.field_mapping = {}
+        # Pre-fill from a saved profile or by name, alias and similarity
+        mapping, matches = suggestion or self.migration_manager.suggest_mapping(self.current_data_type, file_fields)
+        for i, file_field in enumerate(file_fields):
+            self.field_mapping[file_field] = mapping.get(file_field, "")
+            self.mapping_tree.insert('', 'end', iid=str(i), values=(
+                file_field, self.field_mapping[file_field], matches.get(file_field, "")
+            ))
         
-        for i, file_field in enumerate(file_fields, 1):
-            # File field label
-            ttk.Label(self.mapping_content, text=file_field).grid(row=i, column=0, padx=5, pady=2, sticky='e')
-            
-            # Arrow
-            ttk.Label(self.mapping_content, text="→").grid(row=i, column=1, padx=5, pady=2)
-            
-            # System field combobox
-            var = tk.StringVar()
-            cb = ttk.Combobox(
-                self.mapping_content,
-                textvariable=var,
-                values=system_fields,
-                state='readonly'
+        if matches and all(match == "saved" for match in matches.values()):
+            self.mapping_status.config(text="Using the mapping saved for files with this header")
+        else:
+            self.mapping_status.config(
+                text=f"{len(mapping)} of {len(file_fields)} file fields matched automatically"
             )
-            cb.grid(row=i, column=2, padx=5, pady=2, sticky='w')
-            
-            # Auto-select if names match
-            if file_field in system_fields:
-                var.set(file_field)
-            
-            self.field_mapping[file_field] = var
-        
         self.next_btn3.config(state='normal')
     
+    def on_mapping_select(self, event=None):
+        """Show the system field of the selected file field in the editor"""
+        selection = self.mapping_tree.selection()
+        if selection:
+            self.mapping_var.set(self.mapping_tree.set(selection[0], 'system'))
+    
+    def on_mapping_change(self, event=None):
+        """Map the selected file fields to the field picked in the editor"""
+        system_field = self.mapping_var.get()
+        file_fields = list(self.field_mapping)
+        for item in self.mapping_tree.selection():
+            file_field = file_fields[int(item)]
+            self.field_mapping[file_field] = system_field
+            self.mapping_tree.item(item, values=(file_field, system_field, "manual" if system_field else ""))
+    
     def validate_mappings(self):
         """Validate field mappings before proceeding"""
         template = self.migration_manager.get_migration_template(self.current_data_type)
@@ -482,8 +5540,7 @@ class MigrationDialog:
         missing_required = []
         mapping = {}
         
-        for file_field, var in self.field_mapping.items():
-            system_field = var.get()
+        for file_field, system_field in self.field_mapping.items():
             if system_field:
                 mapping[file_field] = system_field
         
@@ -498,7 +5555,14 @@ class MigrationDialog:
             )
             return
         
+        # Remember the mapping for the next file in this export format
+        try:
+            self.migration_manager.save_mapping_profile(self.current_data_type, list(self.field_mapping), mapping)
+        except sqlite3.Error:
+            pass  # Only a convenience; never block the import over it
+        
         # Proceed to next step
+        self.current_mapping = mapping
         self.notebook.tab(3, state='normal')
         self.notebook.select(3)
         self.update_summary()
@@ -508,100 +5572,337 @@ class MigrationDialog:
         if not self.current_data_type or not self.current_file:
             return
         
-        try:
-            if self.current_file.endswith('.csv'):
-                with open(self.current_file, 'r') as f:
-                    record_count = sum(1 for _ in f) - 1  # Subtract header
-            elif self.current_file.endswith(('.xls', '.xlsx')):
-                df = pd.read_excel(self.current_file)
-                record_count = len(df)
-            else:
-                record_count = "Unknown"
-        except:
-            record_count = "Unknown"
-        
         self.summary_type.config(text=self.current_data_type.capitalize())
         self.summary_file.config(text=os.path.basename(self.current_file))
-        self.summary_records.config(text=str(record_count))
+        if self.current_data_type == PACKAGE_DATA_TYPE:
+            self.summary_records.config(text=f"{len(self.file_preview_data)} part(s)")
+            self.summary_changes.config(text="")
+            return
+        self.summary_records.config(text="Counting...")
+        self.summary_changes.config(text="Comparing with previous imports...")
+        data_type = self.current_data_type
+        file_path = self.current_file
+        mapping = self.current_mapping
+        
+        def work(progress, cancel_event):
+            return self.migration_manager.count_records(file_path)
+        
+        def on_done(record_count, error):
+            if error is not None:
+                record_count = "Unknown"
+            self.summary_records.config(text=str(record_count))
+        
+        def diff_work(progress, cancel_event):
+            return self.migration_manager.diff_file(data_type, file_path, mapping)
+        
+        def on_diff_done(counts, error):
+            if error is not None:
+                self.summary_changes.config(text="Unknown")
+                return
+            self.summary_changes.config(
+                text=f"{counts['new']:,} new, {counts['changed']:,} changed, {counts['unchanged']:,} unchanged"
+            )
+        
+        self.run_in_background('summary', work, on_done)
+        self.run_in_background('diff', diff_work, on_diff_done)
     
     def run_import(self):
-        """Execute the data import"""
+        """Execute the data import on a worker thread"""
         if not self.current_data_type or not self.current_file:
             return
         
+        if self.current_data_type == PACKAGE_DATA_TYPE:
+            self.run_package_import()
+            return
+        
         # Build the mapping dictionary
         mapping = {}
-        for file_field, var in self.field_mapping.items():
-            system_field = var.get()
+        for file_field, system_field in self.field_mapping.items():
             if system_field:
                 mapping[file_field] = system_field
         
         dry_run = bool(self.dry_run_var.get())
+        data_type = self.current_data_type
+        file_path = self.current_file
+        started = time.monotonic()
+        rejects_path = os.path.join(
+            DEFAULT_REJECTS_DIR,
+            f"{os.path.splitext(os.path.basename(file_path))[0]}-{data_type}-"
+            f"{datetime.now():%Y%m%d-%H%M%S}-rejects.csv"
+        )
+        self.rejects_file = None
+        self.rejects_btn.config(state='disabled')
         
-        try:
-            # Simulate import for this example
-            # In a real implementation, you would call the migration_manager.import_data()
-            total_records = 100  # This would be the actual count from the file
-            success_count = 95    # Simulated success count
-            error_count = 5       # Simulated error count
+        self.import_btn.config(state='disabled')
+        self.cancel_btn.config(state='normal')
+        self.finish_btn.config(state='disabled')
+        self.progress_bar.config(value=0, maximum=1)
+        self.progress_label.config(text="Reading and validating file...")
+        
+        def work(progress, cancel_event):
+            if SERVICE_ADDRESS:
+                # The shared service does the work; this dialog only follows it
+                return JobClient(SERVICE_ADDRESS).run(
+                    file_path,
+                    data_type,
+                    mapping,
+                    dry_run,
+                    school=getattr(self.school, 'name', None),
+                    progress=progress,
+                    cancel_event=cancel_event,
+                    max_errors=ERROR_EXAMPLES
+                )
+            with self.import_manager(dry_run) as manager:
+                return manager.import_data(
+                    data_type,
+                    file_path,
+                    mapping,
+                    dry_run=dry_run,
+                    progress=progress,
+                    cancel_event=cancel_event,
+                    rejects_path=rejects_path,
+                    max_errors=ERROR_EXAMPLES,
+                    metrics=ImportMetrics(trace_memory='memory' in PROFILE_FLAGS, profile='cpu' in PROFILE_FLAGS)
+                )
+        
+        def on_progress(done, total):
+            self.progress_bar.config(value=done, maximum=max(total, 1))
+            elapsed = time.monotonic() - started
+            rate = done / elapsed if elapsed > 0 else 0
+            if rate > 0:
+                eta = (total - done) / rate
+                self.progress_label.config(
+                    text=f"{done:,} of {total:,} rows  |  {rate:,.0f} rows/sec  |  ETA {eta:.0f}s"
+                )
+            else:
+                self.progress_label.config(text=f"Importing {total:,} rows...")
+        
+        def on_done(result, error):
+            self.import_btn.config(state='normal')
+            self.cancel_btn.config(state='disabled')
             
-            # Display results
-            self.results_text.config(state='normal')
-            self.results_text.delete(1.0, tk.END)
+            if error is not None:
+                self.progress_label.config(text="Import failed")
+                messagebox.showerror("Import Error", f"Failed to import data: {str(error)}")
+                return
+            
+            elapsed = time.monotonic() - started
+            self.progress_label.config(
+                text=f"{'Cancelled' if result['cancelled'] else 'Finished'} in {elapsed:.1f}s"
+            )
+            self.show_import_results(result)
+        
+        self.run_in_background('import', work, on_done, on_progress)
+    
+    @contextmanager
+    def import_manager(self, dry_run):
+        """The manager an import runs with on the worker thread.
+        
+        A dry run holds its transaction, and the store lock, until it
+        finishes; on a scratch copy of the store that lock is not the one
+        the dialog's own calls (saving a mapping profile, the summary
+        diff) take on the Tk thread.
+        """
+        if not dry_run:
+            yield self.migration_manager
+            return
+        with self.migration_manager.store.scratch_copy() as store:
+            yield DataMigrationManager(self.school, store=store, file_cache=self.migration_manager.file_cache)
+    
+    def run_package_import(self):
+        """Import every part of a workbook or zip in dependency order"""
+        dry_run = bool(self.dry_run_var.get())
+        file_path = self.current_file
+        started = time.monotonic()
+        
+        self.import_btn.config(state='disabled')
+        self.cancel_btn.config(state='normal')
+        self.finish_btn.config(state='disabled')
+        self.progress_bar.config(value=0, maximum=1)
+        self.progress_label.config(text="Reading and validating all parts...")
+        
+        def work(progress, cancel_event):
+            with self.import_manager(dry_run) as manager:
+                return manager.import_package(
+                    file_path,
+                    dry_run=dry_run,
+                    progress=progress,
+                    cancel_event=cancel_event
+                )
+        
+        def on_progress(done, total):
+            self.progress_bar.config(value=done, maximum=max(total, 1))
+            self.progress_label.config(text=f"{done} of {total} parts finished")
+        
+        def on_done(result, error):
+            self.import_btn.config(state='normal')
+            self.cancel_btn.config(state='disabled')
             
-            self.results_text.insert(tk.END, f"Import {'(dry run) ' if dry_run else ''}completed!\n\n")
-            self.results_text.insert(tk.END, f"Total records processed: {total_records}\n")
-            self.results_text.insert(tk.END, f"Successfully imported: {success_count}\n")
-            self.results_text.insert(tk.END, f"Failed: {error_count}\n\n")
+            if error is not None:
+                self.progress_label.config(text="Import failed")
+                messagebox.showerror("Import Error", f"Failed to import data: {str(error)}")
+                return
             
-            # Simulated error details
-            if error_count > 0:
-                self.results_text.insert(tk.END, "Error details (sample):\n")
-                self.results_text.insert(tk.END, "Row 15: Invalid date format\n")
-                self.results_text.insert(tk.END, "Row 42: Missing required field 'gender'\n")
-                self.results_text.insert(tk.END, "Row 78: Duplicate admission number\n")
+            elapsed = time.monotonic() - started
+            self.progress_label.config(
+                text=f"{'Cancelled' if result['cancelled'] else 'Finished'} in {elapsed:.1f}s"
+            )
+            totals = result['totals']
+            lines = [
+                f"Import {'(dry run) ' if dry_run else ''}{'cancelled' if result['cancelled'] else 'completed'}!",
+                "",
+                f"Total records processed: {totals['total']}",
+                f"{'Valid' if dry_run else 'Successfully imported'}: {totals['imported']}",
+                f"Unchanged (skipped): {totals['unchanged']}",
+                f"Failed: {totals['failed']}",
+                ""
+            ]
+            lines.extend(format_import_summary(summary) for summary in result['files'])
             
+            self.results_text.config(state='normal')
+            self.results_text.delete(1.0, tk.END)
+            self.results_text.insert(tk.END, "\n".join(lines) + "\n")
             self.results_text.config(state='disabled')
             self.finish_btn.config(state='normal')
-            
-            if not dry_run:
-                messagebox.showinfo(
-                    "Import Complete",
-                    f"Successfully imported {success_count} of {total_records} records"
-                )
-                
-        except Exception as e:
-            messagebox.showerror("Import Error", f"Failed to import data: {str(e)}")
-            traceback.print_exc()
+        
+        self.run_in_background('import', work, on_done, on_progress)
+    
+    def cancel_import(self):
+        """Ask the running import to stop after the current batch"""
+        task = self.tasks.get('import')
+        if task:
+            task['cancel'].set()
+            self.cancel_btn.config(state='disabled')
+            self.progress_label.config(text="Cancelling after the current batch...")
+    
+    def show_import_results(self, result):
+        """Display the outcome of an import in the results pane"""
+        dry_run = result['dry_run']
+        total_records = result['total']
+        success_count = result['imported']
+        error_count = result['failed']
+        
+        # Build the whole report first; one insert keeps the widget fast
+        lines = [f"Import {'(dry run) ' if dry_run else ''}{'cancelled' if result['cancelled'] else 'completed'}!", ""]
+        if result.get('resumed_from'):
+            lines.append(f"Resumed after {result['resumed_from']} rows committed by an interrupted import")
+        lines.extend([
+            f"Total records processed: {total_records}",
+            f"{'Valid' if dry_run else 'Successfully imported'}: {success_count}",
+            f"  {result['new']} new, {result['changed']} changed; {result['unchanged']} unchanged (skipped)",
+            f"Failed: {error_count}",
+            "",
+            f"Time by stage: {format_stage_breakdown(result['metrics'])}",
+            ""
+        ])
+        
+        if result['metrics'].get('profile'):
+            lines.append("Slowest functions (cumulative):")
+            lines.extend(
+                f"  {entry['cumulative_seconds']:8.3f}s  {entry['function']}"
+                for entry in result['metrics']['profile'][:5]
+            )
+            lines.append("")
+        
+        if result['rule_counts']:
+            lines.append("Errors by rule:")
+            lines.extend(f"  {rule}: {count}" for rule, count in result['rule_counts'].items())
+            lines.append("")
+        
+        if result['errors']:
+            shown = len(result['errors'])
+            lines.append(f"First {shown} of {result['error_count']} errors:" if shown < result['error_count']
+                         else "Errors:")
+            lines.extend(f"Row {error['row']}: {error['error']}" for error in result['errors'])
+        
+        if result['rejects_file']:
+            lines.extend(["", f"All rejected rows: {result['rejects_file']}"])
+            self.rejects_file = result['rejects_file']
+            self.rejects_btn.config(state='normal')
+        
+        self.results_text.config(state='normal')
+        self.results_text.delete(1.0, tk.END)
+        self.results_text.insert(tk.END, "\n".join(lines) + "\n")
+        self.results_text.config(state='disabled')
+        self.finish_btn.config(state='normal')
+        
+        if not dry_run and not result['cancelled']:
+            messagebox.showinfo(
+                "Import Complete",
+                f"Successfully imported {success_count} of {total_records} records"
+            )
+    
+    def open_rejects(self):
+        """Open the rejects file of the last import"""
+        if not self.rejects_file:
+            return
+        try:
+            open_in_default_app(self.rejects_file)
+        except OSError as e:
+            messagebox.showerror("Error", f"Could not open {self.rejects_file}: {str(e)}")
     
     def download_template(self):
-        """Download a CSV template for the selected data type"""
+        """Save the selected type's template, or every template as one workbook"""
         if not self.current_data_type:
             messagebox.showerror("Error", "Please select a data type first")
             return
         
-        file_path = filedialog.asksaveasfilename(
-            defaultextension=".csv",
-            filetypes=[("CSV files", "*.csv")],
-            title=f"Save {self.current_data_type} template as",
-            initialfile=f"{self.current_data_type}_template.csv"
-        )
+        if self.current_data_type == PACKAGE_DATA_TYPE:
+            data_sets = None
+            file_path = filedialog.asksaveasfilename(
+                defaultextension=".xlsx",
+                filetypes=[("Excel workbook", "*.xlsx"), ("Zip of CSV files", "*.zip")],
+                title="Save all templates as",
+                initialfile="migration_templates.xlsx"
+            )
+        else:
+            data_sets = [self.current_data_type]
+            file_path = filedialog.asksaveasfilename(
+                defaultextension=".csv",
+                filetypes=[("CSV files", "*.csv"), ("Excel workbook", "*.xlsx")],
+                title=f"Save {self.current_data_type} template as",
+                initialfile=f"{self.current_data_type}_template.csv"
+            )
         
         if file_path:
             try:
-                template = self.migration_manager.get_migration_template(self.current_data_type)
-                if not template:
-                    messagebox.showerror("Error", "Invalid data type")
-                    return
-                
-                with open(file_path, 'w', newline='') as f:
-                    writer = csv.DictWriter(f, fieldnames=template['required_fields'] + template['optional_fields'])
-                    writer.writeheader()
-                    writer.writerow(template['sample_data'])
-                
+                self.migration_manager.export_data(file_path, data_sets, templates=True)
                 messagebox.showinfo("Success", f"Template saved to {file_path}")
             except Exception as e:
                 messagebox.showerror("Error", f"Failed to save template: {str(e)}")
+    
+    def export_data(self):
+        """Export every stored data set to one workbook or zip on a worker thread"""
+        file_path = filedialog.asksaveasfilename(
+            defaultextension=".xlsx",
+            filetypes=[("Excel workbook", "*.xlsx"), ("Zip of CSV files", "*.zip")],
+            title="Export stored data as",
+            initialfile="school_data.xlsx"
+        )
+        if not file_path:
+            return
+        
+        self.export_btn.config(state='disabled')
+        self.export_label.config(text="Exporting...")
+        
+        def work(progress, cancel_event):
+            return self.migration_manager.export_data(file_path, progress=progress, cancel_event=cancel_event)
+        
+        def on_progress(done, total):
+            self.export_label.config(text=f"Exported {done:,} of {total:,} rows")
+        
+        def on_done(result, error):
+            self.export_btn.config(state='normal')
+            if error:
+                self.export_label.config(text="Export failed")
+                messagebox.showerror("Error", f"Failed to export data: {error}")
+                return
+            self.export_label.config(
+                text=f"Exported {result['rows']:,} rows in {result['elapsed_seconds']:.1f}s"
+            )
+            messagebox.showinfo("Success", f"Data exported to {file_path}")
+        
+        self.run_in_background('export', work, on_done, on_progress)
 
 class SchoolSystemGUI:
     def __init__(self, root):
@@ -611,6 +5912,7 @@ class SchoolSystemGUI:
         
         # Sample school data
         self.school = type('School', (), {})()  # Simple mock school object
+        self.school.store = MigrationStore(DEFAULT_DB_PATH)
         
         # Add menu button
         menubar = tk.Menu(root)
@@ -623,7 +5925,528 @@ class SchoolSystemGUI:
         """Open the data migration dialog"""
         MigrationDialog(self.root, self.school)
 
-if __name__ == "__main__":
+def run_gui():
     root = tk.Tk()
     app = SchoolSystemGUI(root)
-    root.mainloop()
\ No newline at end of file
+    root.mainloop()
+
+def build_arg_parser():
+    parser = argparse.ArgumentParser(
+        prog="newsystem",
+        description="School system with data migration. Runs the GUI when no command is given."
+    )
+    commands = parser.add_subparsers(dest="command")
+    # Every command offers the data types the manager has templates for
+    data_types = list(DataMigrationManager(None).migration_templates)
+    
+    commands.add_parser("gui", help="Open the desktop application (default)")
+    
+    importer = commands.add_parser("import", help="Import a file without the GUI")
+    importer.add_argument("--type", required=True, dest="data_type", choices=data_types,
+                          help="Data type of the file")
+    importer.add_argument("--file", required=True, help="CSV or Excel file to import")
+    importer.add_argument("--mapping", help="JSON file mapping file columns to system fields "
+                                            "(default: columns named like system fields)")
+    importer.add_argument("--dry-run", action="store_true",
+                          help="Validate and write inside a transaction that is rolled back")
+    importer.add_argument("--db", default=DEFAULT_DB_PATH, help="SQLite database path")
+    importer.add_argument("--batch-size", type=int, default=IMPORT_BATCH_SIZE,
+                          help="Rows per committed batch")
+    importer.add_argument("--output", help="Write the JSON result here instead of stdout")
+    importer.add_argument("--max-errors", type=int, default=1000,
+                          help="Error rows to include in the JSON result")
+    importer.add_argument("--rejects", help="Write every rejected row, with the field and rule "
+                                            "that failed, to this CSV")
+    importer.add_argument("--metrics-log", help="Append a JSON line with stage timings to this file")
+    importer.add_argument("--profile", help="Run under cProfile and write the stats to this file")
+    importer.add_argument("--trace-memory", action="store_true",
+                          help="Record each stage's peak allocation with tracemalloc (slower)")
+    importer.add_argument("--service", default=SERVICE_ADDRESS,
+                          help="Hand the import to a job service (unix:/path or http://host:port; "
+                               "default: $MIGRATION_SERVICE) instead of running it here")
+    importer.add_argument("--school",
+                          help="School the data belongs to; its students are claimed for it and rows "
+                               "using another school's admission numbers are rejected")
+    
+    bulk = commands.add_parser("bulk", help="Import a directory, manifest, workbook or zip in parallel")
+    bulk.add_argument("source", help="Directory of CSV/Excel files, a JSON manifest, "
+                                     "a multi-sheet .xlsx or a .zip of CSV/Excel files")
+    bulk.add_argument("--dry-run", action="store_true",
+                      help="Validate and write inside a transaction that is rolled back")
+    bulk.add_argument("--workers", type=int, help="Parser processes (default: one per core)")
+    bulk.add_argument("--db", default=DEFAULT_DB_PATH, help="SQLite database path")
+    bulk.add_argument("--batch-size", type=int, default=IMPORT_BATCH_SIZE,
+                      help="Rows per committed batch")
+    bulk.add_argument("--output", help="Write the JSON result here instead of stdout")
+    bulk.add_argument("--max-errors", type=int, default=100,
+                      help="Error rows per file to include in the JSON result")
+    bulk.add_argument("--metrics-log", help="Append a JSON line with stage timings per file to this file")
+    
+    generator = commands.add_parser("generate", help="Write a synthetic data file from a template")
+    generator.add_argument("--type", required=True, dest="data_type", choices=data_types,
+                           help="Data type to generate")
+    generator.add_argument("--rows", type=int, required=True, help="Number of rows")
+    generator.add_argument("--output", required=True, help="File to write (.csv or .xlsx)")
+    generator.add_argument("--students", type=int,
+                           help="Admission numbers that references draw from (default: --rows)")
+    generator.add_argument("--error-rate", type=float, default=0.0, help="Share of rows breaking a rule")
+    generator.add_argument("--duplicate-rate", type=float, default=0.0,
+                           help="Share of rows repeating an earlier row")
+    generator.add_argument("--broken-ref-rate", type=float, default=0.0,
+                           help="Share of rows referencing unknown students")
+    generator.add_argument("--seed", type=int, default=0, help="Random seed")
+    
+    bench = commands.add_parser("benchmark", help="Time each import stage on generated data")
+    bench.add_argument("--rows", type=int, default=100000, help="Rows per generated file")
+    bench.add_argument("--types", nargs="+", choices=data_types, help="Data types (default: all)")
+    bench.add_argument("--format", choices=["csv", "xlsx"], default="csv", dest="file_format",
+                       help="Generated file format")
+    bench.add_argument("--error-rate", type=float, default=0.01, help="Share of rows breaking a rule")
+    bench.add_argument("--duplicate-rate", type=float, default=0.01,
+                       help="Share of rows repeating an earlier row")
+    bench.add_argument("--broken-ref-rate", type=float, default=0.01,
+                       help="Share of rows referencing unknown students")
+    bench.add_argument("--seed", type=int, default=0, help="Random seed")
+    bench.add_argument("--work-dir",
+                       help="Keep the generated files and database here; the database starts empty each run")
+    bench.add_argument("--output", help="Write the JSON baseline here instead of stdout")
+    bench.add_argument("--compare", help="Baseline JSON to compare against; exits 2 on a regression")
+    bench.add_argument("--tolerance", type=float, default=0.2,
+                       help="Allowed drop in rows/sec before a stage counts as a regression")
+    
+    fees = commands.add_parser("fees", help="Set term fees and report fee balances")
+    fees.add_argument("--db", default=DEFAULT_DB_PATH, help="SQLite database path")
+    fees.add_argument("--set-fee", nargs=2, metavar=("TERM", "AMOUNT"),
+                      help="Set the fee due for a term")
+    fees.add_argument("--grade", default="", help="Grade the --set-fee amount applies to (default: every grade)")
+    fees.add_argument("--student", help="Report one student's balance for every term")
+    fees.add_argument("--arrears", metavar="TERM", help="List students owing fees for a term")
+    fees.add_argument("--rebuild", action="store_true",
+                      help="Recompute the fee ledger from all payments")
+    fees.add_argument("--output", help="Write the JSON result here instead of stdout")
+    
+    report = commands.add_parser("report", help="End-of-term report cards from assessment aggregates")
+    report.add_argument("--db", default=DEFAULT_DB_PATH, help="SQLite database path")
+    report.add_argument("--grade", required=True, help="Class to report on, e.g. 'Grade 4'")
+    report.add_argument("--term", required=True, help="Term to report on")
+    report.add_argument("--student", help="Only this student's report card")
+    report.add_argument("--rebuild", action="store_true",
+                        help="Recompute the aggregates from all assessments first")
+    report.add_argument("--output", help="Write the JSON result here instead of stdout")
+    
+    serve = commands.add_parser("serve", help="Run the import job service for dialogs and CLIs to use")
+    serve.add_argument("--db", default=DEFAULT_DB_PATH, help="SQLite database path")
+    serve.add_argument("--socket", help="Listen on this Unix socket instead of TCP")
+    serve.add_argument("--host", default="127.0.0.1", help="TCP address to listen on")
+    serve.add_argument("--port", type=int, default=DEFAULT_SERVICE_PORT, help="TCP port to listen on")
+    serve.add_argument("--workers", type=int, help="Imports run at once (default: up to 4, one per core)")
+    serve.add_argument("--max-queued", type=int, default=SERVICE_MAX_QUEUED,
+                       help="Jobs allowed to wait before new ones are refused")
+    
+    export = commands.add_parser("export", help="Write stored data or blank templates to a workbook, zip or CSVs")
+    export.add_argument("--db", default=DEFAULT_DB_PATH, help="SQLite database path")
+    export.add_argument("--output", required=True,
+                        help="Where to write: .xlsx (a sheet per type), .zip or a directory (a CSV per type), "
+                             "or .csv (one type)")
+    export.add_argument("--types", nargs="+", choices=data_types + list(MigrationStore.EXPORT_REPORTS),
+                        help="Data sets to export (default: every template)")
+    export.add_argument("--templates", action="store_true",
+                        help="Write each template's header and sample row instead of stored data")
+    
+    dedupe = commands.add_parser("dedupe", help="Back up the database, then keep the latest row of each "
+                                                "natural key stored more than once")
+    dedupe.add_argument("--db", default=DEFAULT_DB_PATH, help="SQLite database path")
+    dedupe.add_argument("--table", required=True,
+                        choices=[table for table, key in STORE_NATURAL_KEYS.items() if len(key) > 1],
+                        help="Table to migrate to its natural key")
+    dedupe.add_argument("--backup", help="Where to write the backup (default: next to the database, "
+                                         "with a timestamp)")
+    
+    teachers = commands.add_parser("teachers", help="Find teachers by class and subject")
+    teachers.add_argument("--db", default=DEFAULT_DB_PATH, help="SQLite database path")
+    teachers.add_argument("--class", dest="class_name", help="Class taught, e.g. 'Grade 5'")
+    teachers.add_argument("--subject", help="Subject taught, e.g. 'Math'")
+    teachers.add_argument("--output", help="Write the JSON result here instead of stdout")
+    return parser
+
+def load_mapping(mapping_path, manager, data_type, file_path):
+    """Mapping from a saved JSON file, or as suggested for the file's header"""
+    if mapping_path:
+        with open(mapping_path) as f:
+            mapping = json.load(f)
+        if not isinstance(mapping, dict):
+            raise ValueError(f"Mapping file must contain a JSON object: {mapping_path}")
+        return mapping
+    
+    columns = list(manager.read_head(file_path, 0).columns)
+    mapping, _ = manager.suggest_mapping(data_type, columns)
+    return mapping
+
+def run_import_command(args):
+    """Run one headless import and write its JSON result"""
+    if args.service:
+        result = run_service_import(args)
+    else:
+        school = type('School', (), {})()
+        school.store = MigrationStore(args.db)
+        manager = DataMigrationManager(school)
+        
+        mapping = load_mapping(args.mapping, manager, args.data_type, args.file)
+        template = manager.get_migration_template(args.data_type)
+        missing_required = [f for f in template['required_fields'] if f not in mapping.values()]
+        if missing_required:
+            raise ValueError(f"The following required fields are not mapped: {', '.join(missing_required)}")
+        if args.mapping:
+            manager.save_mapping_profile(args.data_type, list(manager.read_head(args.file, 0).columns), mapping)
+        
+        started = time.monotonic()
+        metrics = ImportMetrics(trace_memory=args.trace_memory, profile=bool(args.profile))
+        result = manager.import_data(
+            args.data_type,
+            args.file,
+            mapping,
+            dry_run=args.dry_run,
+            batch_size=args.batch_size,
+            rejects_path=args.rejects,
+            max_errors=args.max_errors,
+            metrics=metrics,
+            school=args.school
+        )
+        result['file'] = os.path.abspath(args.file)
+        result['database'] = os.path.abspath(args.db)
+        result['mapping'] = mapping
+        result['elapsed_seconds'] = round(time.monotonic() - started, 3)
+        school.store.close()
+        
+        if args.profile:
+            metrics.profiler.dump_stats(args.profile)
+    if args.metrics_log:
+        append_metrics_log(args.metrics_log, {
+            "command": "import",
+            "file": result['file'],
+            "data_type": args.data_type,
+            "dry_run": args.dry_run,
+            "rows": result['total'],
+            "imported": result['imported'],
+            "failed": result['failed'],
+            "elapsed_seconds": result['elapsed_seconds'],
+            "metrics": result['metrics']
+        })
+    
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(result, f, indent=2)
+    else:
+        json.dump(result, sys.stdout, indent=2)
+        sys.stdout.write("\n")
+    
+    print(
+        f"{args.data_type}: {result['imported']} of {result['total']} records "
+        f"{'valid' if args.dry_run else 'imported'}, {result['failed']} failed "
+        f"in {result['elapsed_seconds']}s",
+        file=sys.stderr
+    )
+    print(f"  {format_stage_breakdown(result['metrics'])}", file=sys.stderr)
+    return 0
+
+def run_service_import(args):
+    """Queue the import on a job service and follow it to the end"""
+    if args.profile or args.trace_memory:
+        raise ValueError("--profile and --trace-memory only apply to imports run here; drop --service")
+    mapping = load_mapping(args.mapping, None, args.data_type, args.file) if args.mapping else None
+    
+    def progress(done, total):
+        if sys.stderr.isatty():
+            print(f"\r{done:,} of {total:,} rows", end='', file=sys.stderr, flush=True)
+    
+    result = JobClient(args.service).run(
+        args.file, args.data_type, mapping, args.dry_run,
+        school=args.school,
+        progress=progress,
+        batch_size=args.batch_size,
+        max_errors=args.max_errors
+    )
+    if sys.stderr.isatty():
+        print(file=sys.stderr)
+    result['service'] = args.service
+    if args.rejects and result.get('rejects_file'):
+        shutil.copyfile(result['rejects_file'], args.rejects)
+        result['rejects_file'] = os.path.abspath(args.rejects)
+    return result
+
+def run_serve_command(args):
+    """Run the job service until interrupted"""
+    service = JobService(args.db, args.workers, args.max_queued)
+    where = f"unix:{args.socket}" if args.socket else f"http://{args.host}:{args.port}"
+    
+    def ready():
+        print(f"Import service on {where} with {service.workers} workers; "
+              f"set MIGRATION_SERVICE={where} for clients", file=sys.stderr)
+    
+    try:
+        asyncio.run(service.serve(args.host, args.port, args.socket, ready))
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+def run_bulk_command(args):
+    """Run a headless bulk import and write its JSON result"""
+    school = type('School', (), {})()
+    school.store = MigrationStore(args.db)
+    manager = DataMigrationManager(school)
+    
+    started = time.monotonic()
+    if args.source.endswith(('.xlsx', '.zip')):
+        result = manager.import_package(args.source, dry_run=args.dry_run, workers=args.workers,
+                                        batch_size=args.batch_size)
+    else:
+        result = manager.bulk_import(args.source, dry_run=args.dry_run, workers=args.workers,
+                                     batch_size=args.batch_size)
+    result['database'] = os.path.abspath(args.db)
+    result['elapsed_seconds'] = round(time.monotonic() - started, 3)
+    for summary in result['files']:
+        summary['error_count'] = len(summary['errors'])
+        summary['errors'] = summary['errors'][:args.max_errors]
+    school.store.close()
+    
+    if args.metrics_log:
+        for summary in result['files']:
+            append_metrics_log(args.metrics_log, {
+                "command": "bulk",
+                "file": summary['file'],
+                "sheet": summary['sheet'],
+                "data_type": summary['data_type'],
+                "dry_run": args.dry_run,
+                "rows": summary['total'],
+                "imported": summary['imported'],
+                "failed": summary['failed'],
+                "error": summary['error'],
+                "elapsed_seconds": summary['elapsed_seconds'],
+                "metrics": summary['metrics']
+            })
+    
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(result, f, indent=2)
+    else:
+        json.dump(result, sys.stdout, indent=2)
+        sys.stdout.write("\n")
+    
+    for summary in result['files']:
+        print(format_import_summary(summary), file=sys.stderr)
+    totals = result['totals']
+    print(
+        f"{totals['files']} files: {totals['imported']} of {totals['total']} records "
+        f"{'valid' if args.dry_run else 'imported'}, {totals['failed']} failed "
+        f"in {result['elapsed_seconds']}s",
+        file=sys.stderr
+    )
+    return 0
+
+def run_generate_command(args):
+    """Write one synthetic data file"""
+    manager = DataMigrationManager(None)
+    started = time.monotonic()
+    generate_dataset(
+        manager, args.data_type, args.rows, args.output,
+        error_rate=args.error_rate,
+        duplicate_rate=args.duplicate_rate,
+        broken_ref_rate=args.broken_ref_rate,
+        students=args.students,
+        seed=args.seed
+    )
+    print(f"{args.data_type}: {args.rows} rows written to {args.output} "
+          f"in {time.monotonic() - started:.1f}s", file=sys.stderr)
+    return 0
+
+def run_fees_command(args):
+    """Update term fees or report balances from the fee ledger"""
+    store = MigrationStore(args.db)
+    result = {}
+    try:
+        if args.set_fee:
+            term, amount = args.set_fee
+            store.set_term_fee(term, float(amount), args.grade)
+            result['fee'] = {"term": term, "grade": args.grade, "amount": float(amount)}
+        if args.rebuild:
+            store.rebuild_fee_ledger()
+            result['rebuilt'] = True
+        if args.student:
+            result['student'] = args.student
+            result['balances'] = store.fee_balances(args.student)
+        if args.arrears:
+            arrears = store.fee_arrears(args.arrears)
+            result['term'] = args.arrears
+            result['arrears'] = arrears
+            result['total_outstanding'] = sum(row['balance'] for row in arrears)
+    finally:
+        store.close()
+    if not result:
+        raise ValueError("Nothing to do; give --set-fee, --rebuild, --student or --arrears")
+    
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(result, f, indent=2)
+    else:
+        json.dump(result, sys.stdout, indent=2)
+        sys.stdout.write("\n")
+    if args.arrears:
+        print(f"{args.arrears}: {len(result['arrears'])} students owe "
+              f"{result['total_outstanding']:,.2f}", file=sys.stderr)
+    return 0
+
+def run_report_command(args):
+    """Write a class's report cards, with subject aggregates"""
+    school = type('School', (), {})()
+    school.store = MigrationStore(args.db)
+    manager = DataMigrationManager(school)
+    try:
+        started = time.monotonic()
+        if args.rebuild:
+            school.store.rebuild_assessment_stats()
+        cards = manager.report_cards(args.grade, args.term)
+        result = {
+            "grade": args.grade,
+            "term": args.term,
+            "subjects": school.store.assessment_stats(args.grade, args.term),
+            "competencies": school.store.assessment_stats(args.grade, args.term, "competency_stats"),
+            "report_cards": [card for card in cards if card['admission_number'] == args.student]
+                            if args.student else cards
+        }
+        elapsed = time.monotonic() - started
+    finally:
+        school.store.close()
+    
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(result, f, indent=2)
+    else:
+        json.dump(result, sys.stdout, indent=2)
+        sys.stdout.write("\n")
+    print(f"{args.grade} {args.term}: {len(cards)} report cards in {elapsed:.2f}s", file=sys.stderr)
+    return 0
+
+def run_dedupe_command(args):
+    """Collapse a table's duplicated natural keys after backing the database up"""
+    store = MigrationStore(args.db)
+    try:
+        conflicts = store.key_conflicts.get(args.table)
+        if conflicts is None:
+            result = {"table": args.table, "deleted": 0, "backup": None}
+        else:
+            backup = args.backup or f"{args.db}.{datetime.now():%Y%m%d-%H%M%S}.bak"
+            deleted = store.collapse_duplicate_keys(args.table, backup)
+            result = {"table": args.table, "deleted": deleted, "backup": backup,
+                      "examples": [{"key": list(row[:-1]), "rows": row[-1]} for row in conflicts]}
+    finally:
+        store.close()
+    
+    json.dump(result, sys.stdout, indent=2)
+    sys.stdout.write("\n")
+    print(f"{args.table}: deleted {result['deleted']:,} older duplicate rows"
+          + (f"; backup at {result['backup']}" if result['backup'] else ""), file=sys.stderr)
+    return 0
+
+def run_teachers_command(args):
+    """List teachers of a class and/or subject with their full lists"""
+    store = MigrationStore(args.db)
+    try:
+        result = store.find_teachers(args.class_name, args.subject)
+        for teacher in result:
+            teacher.update(store.teacher_lists(teacher['tsc_number']))
+    finally:
+        store.close()
+    
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(result, f, indent=2)
+    else:
+        json.dump(result, sys.stdout, indent=2)
+        sys.stdout.write("\n")
+    return 0
+
+def run_export_command(args):
+    """Export stored data sets, or blank templates, in one file or directory"""
+    if args.templates:
+        result = DataMigrationManager(None).export_data(args.output, args.types, templates=True)
+    else:
+        school = type('School', (), {})()
+        school.store = MigrationStore(args.db)
+        try:
+            result = DataMigrationManager(school).export_data(args.output, args.types)
+        finally:
+            school.store.close()
+    
+    for name, rows in result['sets'].items():
+        print(f"{name}: {rows:,} rows", file=sys.stderr)
+    print(f"Exported {result['rows']:,} rows to {args.output} in {result['elapsed_seconds']:.2f}s",
+          file=sys.stderr)
+    return 0
+
+def run_benchmark_command(args):
+    """Run the benchmark and write its JSON baseline"""
+    if args.work_dir:
+        os.makedirs(args.work_dir, exist_ok=True)
+        result = run_benchmark(args.rows, args.work_dir, args.types, args.file_format, args.error_rate,
+                               args.duplicate_rate, args.broken_ref_rate, args.seed)
+    else:
+        with tempfile.TemporaryDirectory(prefix='migration_bench_') as work_dir:
+            result = run_benchmark(args.rows, work_dir, args.types, args.file_format, args.error_rate,
+                                   args.duplicate_rate, args.broken_ref_rate, args.seed)
+    
+    regressions = []
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare_benchmarks(json.load(f), result, args.tolerance)
+        result['regressions'] = regressions
+    
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(result, f, indent=2)
+    else:
+        json.dump(result, sys.stdout, indent=2)
+        sys.stdout.write("\n")
+    
+    for data_type, summary in result['results'].items():
+        print(data_type, file=sys.stderr)
+        for stage, timing in summary['stages'].items():
+            print(f"  {stage:<9}{timing['seconds']:>9.3f}s  {timing['rows_per_sec'] or 0:>12,} rows/sec  "
+                  f"peak {timing['peak_rss_mb']} MB", file=sys.stderr)
+    for regression in regressions:
+        print(f"Regression: {regression['data_type']} {regression['stage']} at "
+              f"{regression['ratio']:.0%} of baseline throughput", file=sys.stderr)
+    return 2 if regressions else 0
+
+def main(argv=None):
+    args = build_arg_parser().parse_args(argv)
+    if args.command in (None, "gui"):
+        run_gui()
+        return 0
+    
+    try:
+        if args.command == "generate":
+            return run_generate_command(args)
+        if args.command == "benchmark":
+            return run_benchmark_command(args)
+        if args.command == "fees":
+            return run_fees_command(args)
+        if args.command == "report":
+            return run_report_command(args)
+        if args.command == "teachers":
+            return run_teachers_command(args)
+        if args.command == "dedupe":
+            return run_dedupe_command(args)
+        if args.command == "export":
+            return run_export_command(args)
+        if args.command == "serve":
+            return run_serve_command(args)
+        if args.command == "bulk":
+            return run_bulk_command(args)
+        return run_import_command(args)
+    except Exception as e:
+        print(f"{'Import' if args.command in ('import', 'bulk') else args.command.capitalize()} failed: {e}",
+              file=sys.stderr)
+        return 1
+
+if __name__ == "__main__":
+    sys.exit(main())
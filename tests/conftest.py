@@ -0,0 +1,49 @@
+import csv
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import newsystem
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = newsystem.MigrationStore(str(tmp_path / "school.db"))
+    yield store
+    store.close()
+
+
+@pytest.fixture
+def manager(store, tmp_path):
+    school = type("School", (), {})()
+    school.store = store
+    return newsystem.DataMigrationManager(school, file_cache=newsystem.ParsedFileCache(spill_dir=str(tmp_path / "cache")))
+
+
+@pytest.fixture
+def write_csv(tmp_path):
+    """Write rows (dicts) to a CSV under tmp_path and return its path"""
+    def write(name, rows, fields=None):
+        path = tmp_path / name
+        fields = fields or list(rows[0])
+        with open(path, "w", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=fields)
+            writer.writeheader()
+            writer.writerows(rows)
+        return str(path)
+    return write
+
+
+def students(count, start=0, grade="Grade 4"):
+    return [
+        {"name": f"Pupil {n}", "birth_date": "2015-05-15", "gender": "Male" if n % 2 else "Female",
+         "admission_number": f"ADM{n:05d}", "current_grade": grade}
+        for n in range(start, start + count)
+    ]
+
+
+def identity(rows):
+    return {field: field for field in rows[0]}
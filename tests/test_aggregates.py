@@ -0,0 +1,127 @@
+import pytest
+
+from conftest import identity, students
+
+
+def assessment(n, subject, score, name="Midterm", term="Term 1", competency="Numeracy"):
+    return {"student_admission": f"ADM{n:05d}", "name": name, "subject": subject, "score": str(score),
+            "date": "2024-03-05", "term": term, "competency_area": competency}
+
+
+def stats(store):
+    tables = {}
+    for table in ("assessment_stats", "competency_stats"):
+        rows = store.conn.execute(f"SELECT * FROM {table} ORDER BY 1, 2, 3").fetchall()
+        tables[table] = [row[:4] + tuple(pytest.approx(value) for value in row[4:]) for row in rows]
+    return tables
+
+
+@pytest.fixture
+def pupils(manager, write_csv):
+    rows = students(4)
+    manager.import_data("students", write_csv("students.csv", rows), identity(rows))
+
+
+def import_assessments(manager, write_csv, rows, name, batch_size=2):
+    return manager.import_data("assessments", write_csv(name, rows), identity(rows), batch_size=batch_size)
+
+
+def test_incremental_stats_match_a_rebuild(manager, pupils, write_csv):
+    import_assessments(manager, write_csv, [
+        assessment(0, "Math", 80), assessment(1, "Math", 60), assessment(2, "Math", 70),
+        assessment(0, "English", 55, competency="Literacy"), assessment(1, "English", 65, competency="Literacy"),
+    ], "first.csv")
+    # A corrected score, a score repeated within a batch and a new row
+    import_assessments(manager, write_csv, [
+        assessment(1, "Math", 90), assessment(3, "Math", 40), assessment(3, "Math", 45),
+        assessment(2, "English", 75, competency="Literacy"),
+    ], "second.csv")
+    incremental = stats(manager.store)
+    
+    manager.store.rebuild_assessment_stats()
+    
+    assert incremental == stats(manager.store)
+    math = {row["subject"]: row for row in manager.store.assessment_stats("Grade 4", "Term 1")}["Math"]
+    assert (math["count"], math["mean"], math["min"], math["max"]) == (4, 71.25, 45, 90)
+
+
+def test_rankings_share_positions_and_refresh_after_import(manager, pupils, write_csv):
+    import_assessments(manager, write_csv, [
+        assessment(0, "Math", 80), assessment(1, "Math", 80), assessment(2, "Math", 60),
+    ], "first.csv")
+    
+    cards = manager.report_cards("Grade 4", "Term 1")
+    assert [(card["admission_number"], card["position"]) for card in cards] == [
+        ("ADM00000", 1), ("ADM00001", 1), ("ADM00002", 3)
+    ]
+    assert manager.store.unranked_classes([("Grade 4", "Term 1")]) == []
+    
+    import_assessments(manager, write_csv, [assessment(2, "Math", 95)], "second.csv")
+    assert manager.store.unranked_classes([("Grade 4", "Term 1")]) == [("Grade 4", "Term 1")]
+    
+    cards = manager.report_cards("Grade 4", "Term 1")
+    assert [(card["admission_number"], card["position"]) for card in cards][0] == ("ADM00002", 1)
+    assert cards[0]["subjects"][0]["class_mean"] == pytest.approx(85)
+
+
+def test_promoted_students_leave_their_old_grade(manager, pupils, write_csv):
+    import_assessments(manager, write_csv, [
+        assessment(0, "Math", 80), assessment(1, "Math", 60), assessment(2, "Math", 70),
+    ], "scores.csv")
+    assert len(manager.report_cards("Grade 4", "Term 1")) == 3
+    
+    promoted = students(2, grade="Grade 5")
+    manager.import_data("students", write_csv("promoted.csv", promoted), identity(promoted))
+    
+    assert manager.store.unranked_classes([("Grade 4", "Term 1")]) == [("Grade 4", "Term 1")]
+    assert [card["admission_number"] for card in manager.report_cards("Grade 4", "Term 1")] == ["ADM00002"]
+    assert [card["position"] for card in manager.report_cards("Grade 5", "Term 1")] == [1, 2]
+    incremental = stats(manager.store)
+    manager.store.rebuild_assessment_stats()
+    assert incremental == stats(manager.store)
+    grade5 = manager.store.assessment_stats("Grade 5", "Term 1")[0]
+    assert (grade5["count"], grade5["mean"]) == (2, 70)
+
+
+def test_fee_ledger_matches_a_rebuild(manager, pupils, write_csv):
+    def payment(n, amount, term, date):
+        return {"student_admission": f"ADM{n:05d}", "amount": str(amount), "payment_date": date, "term": term}
+    
+    for name, rows in (("first.csv", [payment(0, 1000, "Term 1", "2024-01-10"), payment(0, 500, "Term 1", "2024-02-01"),
+                                      payment(1, 750.5, "Term 2", "2024-05-03")]),
+                       ("second.csv", [payment(0, 250, "Term 1", "2024-03-01"), payment(2, 100, "", "2024-03-02")])):
+        manager.import_data("payments", write_csv(name, rows), identity(rows), batch_size=2)
+    ledger = "SELECT * FROM fee_ledger ORDER BY student_admission, term"
+    incremental = manager.store.conn.execute(ledger).fetchall()
+    
+    manager.store.rebuild_fee_ledger()
+    
+    assert incremental == manager.store.conn.execute(ledger).fetchall()
+    assert ("ADM00000", "Term 1", 1750.0, 3, "2024-03-01") in incremental
+
+
+def test_corrected_payment_replaces_its_slip(manager, pupils, write_csv):
+    def payment(slip, amount, term="Term 1"):
+        return {"student_admission": "ADM00000", "amount": str(amount), "payment_date": "2024-01-10",
+                "term": term, "bank_slip_no": slip}
+    
+    def ledger():
+        return manager.store.conn.execute(
+            "SELECT term, paid, payments FROM fee_ledger WHERE student_admission = 'ADM00000' ORDER BY term"
+        ).fetchall()
+    
+    for name, rows in (("upload.csv", [payment("MP1", 1500)]), ("corrected.csv", [payment("MP1", 1000)])):
+        manager.import_data("payments", write_csv(name, rows), identity(rows))
+    assert manager.store.count("payments") == 1
+    assert ledger() == [("Term 1", 1000.0, 1)]
+    
+    # Payments without a slip still add up; a slip moved to another term
+    # leaves the old term
+    rows = [payment("MP1", 1000, "Term 2"), payment("", 200), payment("", 200)]
+    manager.import_data("payments", write_csv("moved.csv", rows), identity(rows))
+    assert manager.store.count("payments") == 3
+    assert ledger() == [("Term 1", 400.0, 2), ("Term 2", 1000.0, 1)]
+    
+    incremental = ledger()
+    manager.store.rebuild_fee_ledger()
+    assert ledger() == incremental
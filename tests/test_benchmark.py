@@ -0,0 +1,25 @@
+import sqlite3
+
+import newsystem
+
+
+def test_reused_work_dir_starts_from_an_empty_database(tmp_path):
+    def run():
+        return newsystem.run_benchmark(300, str(tmp_path), ["students"], error_rate=0, duplicate_rate=0)
+    
+    run()
+    conn = sqlite3.connect(str(tmp_path / "benchmark.db"))
+    conn.execute("CREATE TABLE left_over (id INTEGER)")
+    conn.commit()
+    conn.close()
+    
+    result = run()
+    
+    conn = sqlite3.connect(str(tmp_path / "benchmark.db"))
+    assert conn.execute("SELECT COUNT(*) FROM sqlite_master WHERE name = 'left_over'").fetchone() == (0,)
+    assert conn.execute("SELECT COUNT(*) FROM students").fetchone() == (300,)
+    conn.close()
+    stages = result["results"]["students"]["stages"]
+    assert set(stages) == {"header", "count", "index", "parse", "validate", "commit"}
+    memory = [next(value for key, value in stage.items() if key.endswith("_mb")) for stage in stages.values()]
+    assert all(value > 0 for value in memory)
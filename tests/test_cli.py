@@ -0,0 +1,13 @@
+import newsystem
+
+
+def test_commands_offer_every_template():
+    templates = list(newsystem.DataMigrationManager(None).migration_templates)
+    commands = newsystem.build_arg_parser()._subparsers._group_actions[0].choices
+    
+    choices = {
+        name: next(action.choices for action in commands[name]._actions if action.dest in ("data_type", "types"))
+        for name in ("import", "generate", "benchmark")
+    }
+    
+    assert choices == {name: templates for name in choices}
@@ -0,0 +1,75 @@
+import re
+import zipfile
+
+import pytest
+from openpyxl import Workbook
+
+import newsystem
+
+
+@pytest.fixture
+def small_chunks(monkeypatch):
+    # Quotes and row tags then fall across chunk boundaries
+    monkeypatch.setattr(newsystem, "COUNT_CHUNK_SIZE", 7)
+
+
+@pytest.mark.parametrize("chunked", [False, True])
+def test_csv_count_ignores_quoted_newlines(tmp_path, request, chunked):
+    if chunked:
+        request.getfixturevalue("small_chunks")
+    path = tmp_path / "notes.csv"
+    path.write_bytes(
+        b'name,notes\n'
+        b'Ann,"line one\nline two"\n'
+        b'Ben,"said ""hi""\nthen left"\n'
+        b'Cal,plain\n'
+        b'Dee,"\n\n"'  # Last record without a trailing newline
+    )
+    
+    assert newsystem.count_csv_records(str(path)) == 4
+
+
+def test_csv_count_of_header_only_and_empty_files(tmp_path):
+    header = tmp_path / "header.csv"
+    header.write_bytes(b"name,notes\n")
+    empty = tmp_path / "empty.csv"
+    empty.write_bytes(b"")
+    
+    assert newsystem.count_csv_records(str(header)) == newsystem.count_csv_records(str(empty)) == 0
+
+
+def workbook(path, rows, dimension):
+    """An xlsx of rows data rows under a header, with its <dimension>
+    replaced by dimension (None removes it)"""
+    book = Workbook()
+    sheet = book.active
+    sheet.append(["name", "grade"])
+    for n in range(rows):
+        sheet.append([f"Pupil {n}", "Grade 4"])
+    book.save(path)
+    with zipfile.ZipFile(path) as zf:
+        parts = {name: zf.read(name) for name in zf.namelist()}
+    xml = parts["xl/worksheets/sheet1.xml"]
+    replacement = b"" if dimension is None else f'<dimension ref="{dimension}"/>'.encode()
+    parts["xl/worksheets/sheet1.xml"] = re.sub(rb"<dimension[^>]*/>", replacement, xml)
+    with zipfile.ZipFile(path, "w") as zf:
+        for name, data in parts.items():
+            zf.writestr(name, data)
+    return str(path)
+
+
+@pytest.mark.parametrize("dimension, expected", [
+    ("A1:B13", 12),       # Trusted without reading the rows
+    ("A1:B100", 99),      # Even when it overstates them
+    (None, 12),           # Missing: rows are counted
+    ("A1", 12),           # No range
+    ("A1:A1", 12),        # Never computed by the writer
+])
+def test_xlsx_count_uses_a_usable_dimension(tmp_path, small_chunks, dimension, expected):
+    path = workbook(tmp_path / "pupils.xlsx", 12, dimension)
+    
+    assert newsystem.count_xlsx_records(path) == expected
+
+
+def test_xlsx_count_of_a_header_only_sheet(tmp_path):
+    assert newsystem.count_xlsx_records(workbook(tmp_path / "empty.xlsx", 0, "A1:B1")) == 0
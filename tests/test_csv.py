@@ -0,0 +1,79 @@
+import pandas as pd
+import pytest
+
+import newsystem
+
+
+ROWS = [["name", "phone", "amount"], ["Zoë Müller", "007", "392"], ["José “Pepe” Ñuñez", "0712345678", "15.50"]]
+
+
+@pytest.fixture
+def cp1252_file(tmp_path):
+    path = tmp_path / "parents.csv"
+    path.write_bytes(("\r\n".join(";".join(row) for row in ROWS) + "\r\n").encode("cp1252"))
+    return str(path)
+
+
+@pytest.fixture(params=["pyarrow", "pandas"])
+def reader_path(request, monkeypatch):
+    if request.param == "pandas":
+        monkeypatch.setattr(newsystem, "_has_pyarrow", lambda: False)
+    else:
+        def no_fallback(*args, **kwargs):
+            raise AssertionError("fell back to the pandas parser")
+        monkeypatch.setattr(newsystem.pd, "read_csv", no_fallback)
+    return request.param
+
+
+def test_sniffs_cp1252_and_semicolons(cp1252_file):
+    assert newsystem.sniff_csv(cp1252_file) == newsystem.CsvFormat("cp1252", ";")
+
+
+def test_read_csv_keeps_text_verbatim(cp1252_file, reader_path):
+    df = newsystem.read_csv(cp1252_file)
+    
+    assert list(df.columns) == ROWS[0]
+    assert df.values.tolist() == ROWS[1:]
+
+
+def test_streamed_chunks_keep_text_verbatim(cp1252_file, reader_path, monkeypatch):
+    monkeypatch.setattr(newsystem, "CSV_BLOCK_BYTES", 40)  # One record per block
+    
+    chunks = list(newsystem.iter_csv_chunks(cp1252_file, chunksize=1, columns=["phone", "name"]))
+    
+    assert [chunk.index[0] for chunk in chunks] == [0, 1]
+    assert [row for chunk in chunks for row in chunk.values.tolist()] == [[row[1], row[0]] for row in ROWS[1:]]
+
+
+STUDENTS = [["Adm", "Pupil", "Sex", "Class", "Notes"],
+            ["007", "Ann", "Female", "04", "transferred in"],
+            ["0012", "Ben", "Male", "04", ""],
+            ["013", "Cal", "Male", "05", "see office"]]
+MAPPING = {"Adm": "admission_number", "Sex": "gender", "Class": "current_grade"}
+
+
+@pytest.fixture
+def students_file(tmp_path):
+    path = tmp_path / "students.csv"
+    path.write_text("\n".join(",".join(row) for row in STUDENTS) + "\n", encoding="utf-8")
+    return str(path)
+
+
+def test_template_dtypes_load_categoricals_and_text(manager):
+    assert manager.read_dtypes("students", MAPPING) == {"Adm": str, "Sex": "category", "Class": "category"}
+
+
+@pytest.mark.parametrize("streamed", [False, True])
+def test_loads_only_mapped_columns_keeping_leading_zeros(manager, students_file, reader_path, monkeypatch, streamed):
+    if streamed:
+        monkeypatch.setattr(newsystem, "STREAM_THRESHOLD_BYTES", 0)
+    columns = list(MAPPING)
+    
+    chunks = list(manager.iter_chunks(students_file, chunksize=2, columns=columns,
+                                      dtypes=manager.read_dtypes("students", MAPPING)))
+    
+    assert all(list(chunk.columns) == columns for chunk in chunks)  # Pupil and Notes are never loaded
+    assert all(isinstance(chunk[field].dtype, pd.CategoricalDtype) for chunk in chunks for field in ("Sex", "Class"))
+    df = pd.concat([chunk.astype(str) for chunk in chunks])
+    assert df["Adm"].tolist() == ["007", "0012", "013"]
+    assert df["Class"].tolist() == ["04", "04", "05"]
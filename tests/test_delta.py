@@ -0,0 +1,71 @@
+import numpy as np
+
+from newsystem import ROW_HASH_VERSION
+
+from conftest import identity, students
+
+
+def payments(amount, date):
+    return [
+        {"student_admission": "ADM00000", "amount": amount, "payment_date": date, "term": "Term 1"},
+        {"student_admission": "ADM00000", "amount": amount, "payment_date": date, "term": "Term 1"},
+        {"student_admission": "ADM00001", "amount": "250.5", "payment_date": "2024-02-01", "term": "Term 1"},
+    ]
+
+
+def import_file(manager, write_csv, data_type, rows, name):
+    return manager.import_data(data_type, write_csv(name, rows), identity(rows))
+
+
+def test_reimport_unchanged_rows_writes_nothing(manager, write_csv):
+    import_file(manager, write_csv, "students", students(100), "students.csv")
+    again = import_file(manager, write_csv, "students", students(100), "again.csv")
+    
+    assert (again["new"], again["changed"], again["unchanged"]) == (0, 0, 100)
+    assert again["imported"] == 0
+
+
+def test_reformatted_payments_are_not_written_again(manager, write_csv):
+    import_file(manager, write_csv, "students", students(2), "students.csv")
+    first = import_file(manager, write_csv, "payments", payments("1401", "2024-01-05"), "payments.csv")
+    ledger = manager.store.conn.execute("SELECT paid, payments FROM fee_ledger").fetchall()
+    
+    # As read back from an xlsx: numbers as floats, dates without padding
+    again = import_file(manager, write_csv, "payments", payments("1401.0 ", "2024-1-5"), "again.csv")
+    
+    assert first["imported"] == 3
+    assert (again["new"], again["unchanged"], again["imported"]) == (0, 3, 0)
+    assert manager.store.count("payments") == 3
+    assert manager.store.conn.execute("SELECT paid, payments FROM fee_ledger").fetchall() == ledger
+
+
+def test_reformatted_assessment_is_unchanged(manager, write_csv):
+    import_file(manager, write_csv, "students", students(1), "students.csv")
+    row = {"student_admission": "ADM00000", "name": "Midterm", "subject": "Math", "score": "85", "date": "2024-03-05"}
+    import_file(manager, write_csv, "assessments", [row], "first.csv")
+    
+    again = import_file(manager, write_csv, "assessments", [{**row, "score": "85.0", "date": "2024-3-5"}], "again.csv")
+    
+    assert (again["new"], again["changed"], again["unchanged"]) == (0, 0, 1)
+    assert manager.store.count("assessments") == 1
+
+
+def test_hashes_from_an_older_version_are_rebuilt(manager, write_csv):
+    import_file(manager, write_csv, "students", students(2), "students.csv")
+    rows = payments("1401", "2024-01-05")
+    import_file(manager, write_csv, "payments", rows, "payments.csv")
+    store = manager.store
+    with store.transaction():
+        # What a database hashed on raw text is left with
+        for data_type in ("students", "payments"):
+            store.clear_row_hashes(data_type)
+            keys = np.arange(3, dtype=np.int64)
+            store.save_row_hashes(data_type, keys, keys)
+        store.save_row_hash_version(0)
+    
+    again = import_file(manager, write_csv, "payments", rows, "again.csv")
+    
+    assert store.load_row_hash_version() == ROW_HASH_VERSION
+    assert (again["new"], again["unchanged"]) == (0, 3)
+    assert store.count("payments") == 3
+
@@ -0,0 +1,60 @@
+import os
+import threading
+
+import pandas as pd
+
+import newsystem
+
+
+def spill_files(spill_dir):
+    return sorted(name for name in os.listdir(spill_dir) if name.endswith(".feather"))
+
+
+def test_concurrent_puts_of_one_file_do_not_race(tmp_path, capsys):
+    source = tmp_path / "upload.csv"
+    source.write_text("a\n1\n")
+    cache = newsystem.ParsedFileCache(spill_dir=str(tmp_path / "cache"))
+    df = pd.DataFrame({"a": [str(n) for n in range(10000)]})
+    
+    threads = [threading.Thread(target=cache.put, args=(str(source), df)) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    
+    assert "Traceback" not in capsys.readouterr().err
+    assert len(spill_files(tmp_path / "cache")) == 1
+    assert not [name for name in os.listdir(tmp_path / "cache") if name.endswith(".tmp")]
+
+
+def test_spill_dir_is_trimmed_to_size(tmp_path):
+    df = pd.DataFrame({"a": [f"value {n}" for n in range(20000)]})
+    probe = newsystem.ParsedFileCache(spill_dir=str(tmp_path / "probe"))
+    (tmp_path / "probe.csv").write_text("a\n")
+    probe.put(str(tmp_path / "probe.csv"), df)
+    size = os.path.getsize(os.path.join(tmp_path / "probe", spill_files(tmp_path / "probe")[0]))
+    
+    cache = newsystem.ParsedFileCache(max_entries=1, spill_dir=str(tmp_path / "cache"),
+                                      max_spill_bytes=int(size * 2.5))
+    for n in range(5):
+        path = tmp_path / f"upload{n}.csv"
+        path.write_text(f"a\n{n}\n")
+        cache.put(str(path), df)
+    
+    assert len(spill_files(tmp_path / "cache")) == 2
+    # The most recent spills survive
+    assert cache.get(str(tmp_path / "upload4.csv")) is not None
+
+
+def test_spill_files_past_max_age_are_deleted(tmp_path):
+    cache = newsystem.ParsedFileCache(spill_dir=str(tmp_path / "cache"), max_spill_age=60)
+    path = tmp_path / "upload.csv"
+    path.write_text("a\n1\n")
+    cache.put(str(path), pd.DataFrame({"a": ["1"]}))
+    (spilled,) = spill_files(tmp_path / "cache")
+    old = os.path.getmtime(tmp_path / "cache" / spilled) - 3600
+    os.utime(tmp_path / "cache" / spilled, (old, old))
+    
+    cache.trim_spill()
+    
+    assert spill_files(tmp_path / "cache") == []
@@ -0,0 +1,106 @@
+import sqlite3
+import threading
+
+import pandas as pd
+import pytest
+
+from conftest import identity, students
+
+
+def test_cancelled_import_reports_rows_processed(manager, write_csv):
+    rows = students(3000)
+    path = write_csv("students.csv", rows)
+    cancel = threading.Event()
+    
+    def progress(done, total):
+        if done >= 1000:
+            cancel.set()
+    
+    result = manager.import_data("students", path, identity(rows), batch_size=500,
+                                 progress=progress, cancel_event=cancel)
+    
+    assert result["cancelled"]
+    assert 0 < result["imported"] < 3000
+    assert result["total"] >= result["imported"] + result["failed"]
+    assert manager.store.count("students") == result["imported"]
+
+
+def test_cancelled_import_resumes_from_checkpoint(manager, write_csv):
+    rows = students(3000)
+    path = write_csv("students.csv", rows)
+    cancel = threading.Event()
+    
+    def progress(done, total):
+        if done >= 1000:
+            cancel.set()
+    
+    first = manager.import_data("students", path, identity(rows), batch_size=500,
+                                progress=progress, cancel_event=cancel)
+    second = manager.import_data("students", path, identity(rows), batch_size=500)
+    
+    assert second["resumed_from"] == first["imported"]
+    assert first["imported"] + second["imported"] == 3000
+    assert manager.store.count("students") == 3000
+
+
+def test_failed_batch_keeps_earlier_batches_and_resumes(manager, write_csv, monkeypatch):
+    rows = students(2000)
+    path = write_csv("students.csv", rows)
+    insert_rows = manager.store.insert_rows
+    calls = []
+    
+    def crash_on_third_batch(*args, **kwargs):
+        calls.append(1)
+        if len(calls) == 3:
+            raise OSError("disk went away")
+        return insert_rows(*args, **kwargs)
+    
+    monkeypatch.setattr(manager.store, "insert_rows", crash_on_third_batch)
+    with pytest.raises(OSError):
+        manager.import_data("students", path, identity(rows), batch_size=500)
+    assert manager.store.count("students") == 1000
+    
+    monkeypatch.setattr(manager.store, "insert_rows", insert_rows)
+    result = manager.import_data("students", path, identity(rows), batch_size=500)
+    
+    assert result["resumed_from"] == 1000
+    assert result["imported"] == 1000
+    assert manager.store.count("students") == 2000
+
+
+def test_admission_index_sees_other_connections(manager, write_csv):
+    rows = students(2)
+    manager.import_data("students", write_csv("students.csv", rows), identity(rows))
+    index = manager.store.admission_index
+    assert len(index) == 2
+    # Another process importing into the same database
+    conn = sqlite3.connect(manager.store.db_path)
+    conn.execute("INSERT INTO students (name, birth_date, gender, admission_number) "
+                 "VALUES ('Other', '2015-01-01', 'Male', 'OTHER1')")
+    conn.commit()
+    conn.close()
+    payment = [{"student_admission": "OTHER1", "amount": "100", "payment_date": "2024-01-10"}]
+    
+    result = manager.import_data("payments", write_csv("payments.csv", payment), identity(payment))
+    
+    assert (result["imported"], result["failed"]) == (1, 0)
+    assert len(index) == 3
+
+
+def test_dry_run_admissions_are_staged(manager, write_csv):
+    rows = students(3)
+    path = write_csv("students.csv", rows)
+    index = manager.store.admission_index
+    staged = []
+    
+    def progress(done, total):
+        if done:
+            staged.append(index.contains(pd.Series(["ADM00000"])).all())
+    
+    result = manager.import_data("students", path, identity(rows), dry_run=True, progress=progress)
+    
+    assert result["imported"] == 3 and staged and all(staged)
+    assert len(index) == 0
+    payment = [{"student_admission": "ADM00000", "amount": "100", "payment_date": "2024-01-10"}]
+    assert manager.import_data("payments", write_csv("payments.csv", payment), identity(payment))["failed"] == 1
+
@@ -0,0 +1,48 @@
+import json
+
+import newsystem
+from conftest import students
+
+
+def test_import_appends_one_json_line_per_run(write_csv, tmp_path, monkeypatch, capsys):
+    monkeypatch.setattr(newsystem, "SERVICE_ADDRESS", None)
+    rows = students(20)
+    rows[3]["gender"] = "X"
+    path = write_csv("students.csv", rows)
+    log = tmp_path / "metrics.jsonl"
+    
+    for dry_run in (["--dry-run"], []):
+        assert newsystem.main(["import", "--type", "students", "--file", path, "--db", str(tmp_path / "school.db"),
+                               "--metrics-log", str(log), "--output", str(tmp_path / "result.json"), *dry_run]) == 0
+    capsys.readouterr()
+    
+    records = [json.loads(line) for line in log.read_text(encoding="utf-8").splitlines()]
+    assert [(record["command"], record["dry_run"]) for record in records] == [("import", True), ("import", False)]
+    for record in records:
+        assert record["file"] == path
+        assert record["data_type"] == "students"
+        assert (record["rows"], record["imported"], record["failed"]) == (20, 19, 1)
+        stages = record["metrics"]["stages"]
+        assert {"index", "read", "validate", "write"} <= set(stages)
+        assert stages["validate"]["rows"] == 20
+        assert stages["write"]["rows"] == 19
+        assert all(stats["calls"] >= 1 and stats["seconds"] >= 0 for stats in stages.values())
+        assert "time" in record
+
+
+def test_metrics_fold_in_stages_from_elsewhere():
+    metrics = newsystem.ImportMetrics()
+    with metrics.stage("validate", 10):
+        pass
+    with metrics.stage("validate", 5):
+        pass
+    metrics.add({"validate": {"seconds": 1.0, "calls": 1, "rows": 5},
+                 "write": {"seconds": 2.0, "calls": 3, "rows": 8}})
+    
+    result = json.loads(json.dumps(metrics.finish()))
+    
+    assert list(result["stages"]) == ["validate", "write"]
+    assert {name: (stats["calls"], stats["rows"]) for name, stats in result["stages"].items()} == {
+        "validate": (3, 20), "write": (3, 8)}
+    assert result["stages"]["write"]["rows_per_sec"] == 4
+    assert result["stages"]["validate"]["seconds"] >= 1.0
@@ -0,0 +1,90 @@
+import os
+import zipfile
+
+import pytest
+from openpyxl import Workbook
+
+from conftest import identity, students
+
+
+PAYMENTS = [
+    {"student_admission": "ADM00000", "amount": "1500", "payment_date": "2024-01-10", "term": "Term 1"},
+    {"student_admission": "ADM00001", "amount": "250.5", "payment_date": "2024-01-11", "term": "Term 1"},
+    {"student_admission": "MISSING", "amount": "100", "payment_date": "2024-01-12", "term": "Term 1"},
+]
+
+
+def csv_text(rows):
+    lines = [",".join(rows[0])] + [",".join(row.values()) for row in rows]
+    return "\n".join(lines) + "\n"
+
+
+def test_zip_package_writes_students_before_references(manager, tmp_path):
+    path = tmp_path / "school.zip"
+    with zipfile.ZipFile(path, "w") as zf:
+        # Payments first in the archive; they still see the students
+        zf.writestr("fees.csv", csv_text(PAYMENTS))
+        zf.writestr("pupils.csv", csv_text(students(3)))
+    
+    result = manager.import_package(str(path), workers=1)
+    
+    by_type = {summary["data_type"]: summary for summary in result["files"]}
+    assert by_type["students"]["imported"] == 3
+    assert (by_type["payments"]["imported"], by_type["payments"]["failed"]) == (2, 1)
+    assert manager.store.count("payments") == 2
+
+
+def test_workbook_package_detects_each_sheet(manager, tmp_path):
+    workbook = Workbook()
+    workbook.remove(workbook.active)
+    for name, rows in (("Learners", students(2)), ("Payments", PAYMENTS[:2])):
+        sheet = workbook.create_sheet(name)
+        sheet.append(list(rows[0]))
+        for row in rows:
+            sheet.append(list(row.values()))
+    path = tmp_path / "school.xlsx"
+    workbook.save(path)
+    
+    jobs = manager.discover_package_jobs(str(path), str(tmp_path / "extract"))
+    assert {job["sheet"]: job["data_type"] for job in jobs} == {"Learners": "students", "Payments": "payments"}
+    
+    result = manager.import_package(str(path), workers=1)
+    assert result["totals"]["imported"] == 4
+
+
+def test_package_dry_run_saves_nothing(manager, tmp_path):
+    path = tmp_path / "school.zip"
+    with zipfile.ZipFile(path, "w") as zf:
+        zf.writestr("students.csv", csv_text(students(3)))
+        zf.writestr("payments.csv", csv_text(PAYMENTS[:2]))
+    
+    result = manager.import_package(str(path), dry_run=True, workers=1)
+    
+    assert result["totals"]["imported"] == 5
+    assert manager.store.count("students") == manager.store.count("payments") == 0
+
+
+@pytest.mark.parametrize("extension", ["zip", "xlsx"])
+def test_export_with_reports_imports_back_unchanged(manager, store, write_csv, tmp_path, extension):
+    rows = students(3)
+    manager.import_data("students", write_csv("students.csv", rows), identity(rows))
+    payments = [dict(row, amount=row["amount"] + ".00") if n == 0 else row for n, row in enumerate(PAYMENTS[:2])]
+    manager.import_data("payments", write_csv("payments.csv", payments), identity(payments))
+    ledger = store.conn.execute("SELECT * FROM fee_ledger ORDER BY student_admission, term").fetchall()
+    path = str(tmp_path / f"export.{extension}")
+    manager.export_data(path, ["students", "payments", "fee_ledger"])
+    
+    result = manager.import_package(path, workers=1)
+    
+    assert sorted(summary["data_type"] for summary in result["files"]) == ["payments", "students"]
+    assert result["totals"]["imported"] == 0
+    assert store.count("payments") == 2
+    assert store.conn.execute("SELECT * FROM fee_ledger ORDER BY student_admission, term").fetchall() == ledger
+
+
+def test_bulk_directory_skips_report_files(manager, tmp_path):
+    export_dir = tmp_path / "export"
+    manager.export_data(str(export_dir), ["students", "fee_ledger"])
+    
+    assert sorted(os.listdir(export_dir)) == ["fee_ledger.csv", "students.csv"]
+    assert [os.path.basename(job["file"]) for job in manager.discover_bulk_jobs(str(export_dir))] == ["students.csv"]
@@ -0,0 +1,79 @@
+import gc
+import os
+
+import pytest
+from openpyxl import Workbook
+
+import newsystem
+
+
+ROWS = [[f"Pupil {n}", f"ADM{n:05d}", "line one\nline two" if n % 7 == 0 else None] for n in range(2500)]
+
+
+@pytest.fixture
+def no_full_reads(manager, monkeypatch):
+    def refuse(*args, **kwargs):
+        raise AssertionError("the preview must not load the whole file")
+    monkeypatch.setattr(manager, "load_file", refuse)
+    monkeypatch.setattr(manager, "read_file", refuse)
+
+
+def check_pages(pager):
+    assert pager.columns == ["name", "admission_number", "note"]
+    assert pager.total == len(ROWS)
+    for positions in ([0, 1, 2], [99, 100, 101], [1234, 1500], [2499]):
+        got = pager.rows(positions)
+        assert list(got.index) == positions
+        assert got.fillna("").values.tolist() == [[value or "" for value in ROWS[n]] for n in positions]
+
+
+def test_xlsx_pages_are_streamed(manager, no_full_reads, tmp_path):
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet()
+    sheet.append(["name", "admission_number", "note"])
+    for row in ROWS:
+        sheet.append(row)
+    path = tmp_path / "students.xlsx"
+    workbook.save(path)
+    
+    pager = newsystem.FilePager(manager, str(path), page_size=100).open()
+    
+    check_pages(pager)
+    spool = pager._source
+    assert os.path.exists(spool)
+    del pager
+    gc.collect()
+    assert not os.path.exists(spool)
+
+
+def test_utf16_csv_pages_are_streamed(manager, no_full_reads, tmp_path):
+    lines = ["name\tadmission_number\tnote"]
+    lines += ["\t".join([name, number, f'"{note}"' if note else ""]) for name, number, note in ROWS]
+    path = tmp_path / "students.csv"
+    path.write_text("\r\n".join(lines) + "\r\n", encoding="utf-16")
+    
+    pager = newsystem.FilePager(manager, str(path), page_size=100).open()
+    
+    check_pages(pager)
+
+
+def test_failed_rows_maps_alias_headers(manager, write_csv):
+    rows = [
+        {"Adm No": "ADM00001", "Student Name": "Ann", "DOB": "2015-05-15", "Sex": "Female", "Grade": "Grade 4"},
+        {"Adm No": "ADM00002", "Student Name": "", "DOB": "2015-05-15", "Sex": "Male", "Grade": "Grade 4"},
+        {"Adm No": "ADM00003", "Student Name": "Cy", "DOB": "15/05/2015", "Sex": "Male", "Grade": "Grade 4"},
+    ]
+    path = write_csv("students.csv", rows)
+    
+    failures = manager.failed_rows("students", path)
+    
+    assert failures == {1: ["Missing required field 'name'"], 2: ["Invalid date for 'birth_date' (expected e.g. 2015-05-15)"]}
+
+
+def test_failed_rows_uses_the_given_mapping(manager, write_csv):
+    rows = [{"Adm No": "ADM00001", "Learner": "Ann", "Born": "2015-05-15", "Sex": "Female"}]
+    path = write_csv("students.csv", rows)
+    mapping = {"Adm No": "admission_number", "Learner": "name", "Born": "birth_date", "Sex": "gender"}
+    
+    assert manager.failed_rows("students", path, mapping=mapping) == {}
+
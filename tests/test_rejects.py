@@ -0,0 +1,66 @@
+import csv
+
+import pandas as pd
+
+import newsystem
+from conftest import identity, students
+
+
+def read_rejects(path):
+    with open(path, newline="", encoding="utf-8") as f:
+        return list(csv.reader(f))
+
+
+def test_import_writes_every_rejected_row(manager, write_csv, tmp_path):
+    rows = students(5)
+    rows[1]["gender"] = "X"
+    rows[3]["birth_date"] = "nope"
+    rows[4]["admission_number"] = "ADM00000"
+    rejects_path = str(tmp_path / "rejects" / "students-rejects.csv")
+    
+    result = manager.import_data("students", write_csv("students.csv", rows), identity(rows),
+                                 rejects_path=rejects_path, max_errors=1)
+    
+    assert result["imported"] == 2
+    assert result["error_count"] == 3
+    assert result["rule_counts"] == {"gender: enum": 1, "birth_date: date": 1, "admission_number: unique": 1}
+    assert [error["row"] for error in result["errors"]] == [2]  # only max_errors kept in memory
+    assert result["rejects_file"] == rejects_path
+    
+    header, *rejected = read_rejects(rejects_path)
+    assert header == ["row", "field", "rule", "error", *rows[0]]
+    assert [line[:3] for line in rejected] == [["2", "gender", "enum"], ["4", "birth_date", "date"],
+                                              ["5", "admission_number", "unique"]]
+    # The original values follow, as read from the file
+    assert [line[4:] for line in rejected] == [list(rows[n].values()) for n in (1, 3, 4)]
+
+
+def test_error_log_spans_chunks(tmp_path):
+    rejects_path = str(tmp_path / "rejects.csv")
+    error_log = newsystem.ErrorLog(rejects_path, max_examples=2)
+    first = pd.DataFrame({"Adm": ["001", "002"], "Notes": ["ok", None]}, index=[0, 1])
+    second = pd.DataFrame({"Adm": ["003", "004"], "Notes": ["late", "ok"]}, index=[2, 3])
+    
+    error_log.add([{"row": 2, "field": "Adm", "rule": "unique", "error": "Duplicate"},
+                   {"row": 1, "field": "Adm", "rule": "unique", "error": "Duplicate"}], first)
+    error_log.add([], second)
+    error_log.add([{"row": 3, "field": None, "rule": "store", "error": "Rejected by the database"}], second)
+    
+    assert error_log.close() == rejects_path
+    assert error_log.count == 3
+    assert error_log.rule_counts == {"Adm: unique": 2, "store": 1}
+    assert [error["row"] for error in error_log.examples] == [1, 2]
+    assert read_rejects(rejects_path) == [
+        ["row", "field", "rule", "error", "Adm", "Notes"],
+        ["1", "Adm", "unique", "Duplicate", "001", "ok"],
+        ["2", "Adm", "unique", "Duplicate", "002", ""],
+        ["3", "", "store", "Rejected by the database", "003", "late"],
+    ]
+
+
+def test_error_log_without_errors_writes_nothing(tmp_path):
+    error_log = newsystem.ErrorLog(str(tmp_path / "rejects.csv"))
+    error_log.add([], pd.DataFrame({"Adm": ["001"]}))
+    
+    assert error_log.close() is None
+    assert not (tmp_path / "rejects.csv").exists()
@@ -0,0 +1,60 @@
+import os
+
+from conftest import identity, students
+
+
+def payments(numbers):
+    return [{"student_admission": number, "amount": "1500", "payment_date": "2024-01-10", "term": "Term 1"}
+            for number in numbers]
+
+
+def test_other_schools_admission_numbers_are_rejected(manager, write_csv):
+    ours = students(5)
+    manager.import_data("students", write_csv("a.csv", ours), identity(ours), school="A")
+    
+    theirs = [dict(row, name=f"Other {n}") for n, row in enumerate(students(5, start=3))]
+    result = manager.import_data("students", write_csv("b.csv", theirs), identity(theirs), school="B")
+    
+    assert result["imported"] == 3
+    assert result["rule_counts"] == {"admission_number: school": 2}
+    names = dict(manager.store.conn.execute("SELECT admission_number, name FROM students"))
+    assert names["ADM00003"] == "Pupil 3"
+    assert names["ADM00007"] == "Other 4"
+
+
+def test_references_to_another_schools_students_are_rejected(manager, write_csv):
+    rows = students(2)
+    manager.import_data("students", write_csv("a.csv", rows), identity(rows), school="A")
+    paid = payments(["ADM00000", "ADM00001"])
+    
+    other = manager.import_data("payments", write_csv("b.csv", paid), identity(paid), school="B")
+    same = manager.import_data("payments", write_csv("a_pay.csv", paid), identity(paid), school="A")
+    
+    assert (other["imported"], other["rule_counts"]) == (0, {"student_admission: school": 2})
+    assert same["imported"] == 2
+
+
+def test_unnamed_imports_do_not_claim(manager, write_csv):
+    rows = students(3)
+    manager.import_data("students", write_csv("s.csv", rows), identity(rows))
+    result = manager.import_data("students", write_csv("s2.csv", rows), identity(rows), school="A")
+    
+    assert result["failed"] == 0
+    assert manager.store.conn.execute("SELECT COUNT(*) FROM student_schools").fetchone() == (3,)
+
+
+def test_bulk_import_rejects_collisions_across_school_directories(manager, tmp_path):
+    for school in ("north", "south"):
+        os.makedirs(tmp_path / "bulk" / school)
+        rows = students(4, start=0 if school == "north" else 2)
+        with open(tmp_path / "bulk" / school / "students.csv", "w") as f:
+            f.write(",".join(rows[0]) + "\n")
+            f.writelines(",".join(row.values()) + "\n" for row in rows)
+    
+    result = manager.bulk_import(str(tmp_path / "bulk"), workers=1)
+    
+    assert result["totals"]["imported"] == 6
+    assert result["totals"]["failed"] == 2
+    owners = dict(manager.store.conn.execute("SELECT admission_number, school FROM student_schools"))
+    assert owners["ADM00003"] == "north"
+    assert owners["ADM00005"] == "south"
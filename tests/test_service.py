@@ -0,0 +1,128 @@
+import asyncio
+import glob
+import os
+import sqlite3
+import threading
+import types
+
+import pytest
+
+import newsystem
+from conftest import identity, students
+
+
+@pytest.fixture
+def service(tmp_path):
+    service = newsystem.JobService(str(tmp_path / "school.db"), workers=1, rejects_dir=str(tmp_path / "rejects"))
+    service._wakeup = asyncio.Event()
+    service._loop = types.SimpleNamespace(call_soon_threadsafe=lambda callback, *args: None)
+    yield service
+    service.close()
+
+
+@pytest.mark.parametrize("field", ["batch_size", "max_errors"])
+@pytest.mark.parametrize("value", [0, -5, "abc", "1.5", 2.5, True, None])
+def test_submit_rejects_bad_limits(service, write_csv, field, value):
+    path = write_csv("students.csv", students(1))
+    spec = {"file": path, "type": "students", field: value}
+    if value is None:
+        assert service.submit(spec).spec[field] > 0  # Absent means the default
+        return
+    
+    with pytest.raises(newsystem.ServiceError) as raised:
+        service.submit(spec)
+    
+    assert raised.value.status == 400
+    assert field in str(raised.value)
+
+
+def test_submit_accepts_positive_limits(service, write_csv):
+    path = write_csv("students.csv", students(1))
+    
+    job = service.submit({"file": path, "type": "students", "batch_size": 250, "max_errors": "10"})
+    
+    assert (job.spec["batch_size"], job.spec["max_errors"]) == (250, 10)
+
+
+def test_dry_run_leaves_the_store_writable(service, write_csv, tmp_path):
+    rows = students(3000)
+    path = write_csv("students.csv", rows)
+    store = service.school.store
+    job = service.submit({"file": path, "type": "students", "mapping": identity(rows),
+                          "dry_run": True, "batch_size": 500})
+    written = []
+    
+    def write_elsewhere():
+        # Another job's write, from another thread and connection
+        if store.lock.acquire(timeout=1):
+            store.lock.release()
+            conn = sqlite3.connect(store.db_path, timeout=1)
+            conn.execute("INSERT INTO students (name, birth_date, gender, admission_number) "
+                         "VALUES ('Other', '2015-01-01', 'Male', 'OTHER1')")
+            conn.commit()
+            conn.close()
+            written.append(True)
+    
+    def progress(callback, job, done, total):
+        if done and not written:
+            thread = threading.Thread(target=write_elsewhere)
+            thread.start()
+            thread.join()
+    
+    service._loop = types.SimpleNamespace(call_soon_threadsafe=progress)
+    result = service._run(job)
+    
+    assert written
+    assert result["dry_run"] and result["imported"] == 3000
+    assert store.count("students") == 1
+    service._dry_runs.close()
+    assert glob.glob(os.path.join(tmp_path, ".dry-run-*")) == []
+
+
+def test_dry_runs_reuse_scratch_copies_until_the_store_changes(service, write_csv, tmp_path):
+    rows = students(10)
+    path = write_csv("students.csv", rows)
+    
+    def run(dry_run):
+        job = service.submit({"file": path, "type": "students", "mapping": identity(rows), "dry_run": dry_run})
+        return service._run(job)
+    
+    def copies():
+        return glob.glob(os.path.join(tmp_path, ".dry-run-*.db"))
+    
+    run(True)
+    first = copies()
+    run(True)
+    assert copies() == first and len(first) == 1
+    
+    assert run(False)["imported"] == 10
+    assert run(True)["unchanged"] == 10  # A fresh copy sees the import
+    assert len(copies()) == 1 and copies() != first
+    
+    service._dry_runs.close()
+    assert copies() == []
+
+
+def test_dialog_dry_run_leaves_the_store_lock_free(manager, write_csv):
+    rows = students(3000)
+    path = write_csv("students.csv", rows)
+    dialog = types.SimpleNamespace(migration_manager=manager, school=manager.school)
+    saved = []
+    
+    def save_profile():
+        # What validate_mappings does on the Tk thread
+        manager.save_mapping_profile("students", list(rows[0]), identity(rows))
+        saved.append(True)
+    
+    def progress(done, total):
+        if done and not saved:
+            thread = threading.Thread(target=save_profile, daemon=True)
+            thread.start()
+            thread.join(timeout=5)
+            assert saved, "saving a mapping profile waited on the dry run"
+    
+    with newsystem.MigrationDialog.import_manager(dialog, True) as dry:
+        result = dry.import_data("students", path, identity(rows), dry_run=True, batch_size=500, progress=progress)
+    
+    assert saved and result["imported"] == 3000
+    assert manager.store.count("students") == 0
@@ -0,0 +1,124 @@
+import sqlite3
+
+import pytest
+
+import newsystem
+from conftest import identity, students
+
+
+def test_insert_rows_upserts_on_natural_key(store):
+    columns = ["name", "birth_date", "gender", "admission_number"]
+    with store.transaction():
+        assert store.insert_rows("students", columns, [("Ann", "2015-01-01", "Female", "A1")]) == []
+    with store.transaction():
+        store.insert_rows("students", columns, [("Ann B", "2015-01-01", "Female", "A1")])
+    
+    assert store.count("students") == 1
+    assert store.conn.execute("SELECT name FROM students").fetchone() == ("Ann B",)
+
+
+def test_insert_rows_rejects_only_offending_rows(store):
+    columns = ["name", "birth_date", "gender", "admission_number"]
+    with store.transaction():
+        failures = store.insert_rows("students", columns, [
+            ("Ann", "2015-01-01", "Female", "A1"),
+            (None, "2015-01-01", "Male", "A2"),
+            ("Cy", "2015-01-01", "Male", "A3"),
+        ])
+    
+    assert [position for position, _ in failures] == [1]
+    assert store.count("students") == 2
+
+
+def test_transaction_rollback_leaves_nothing(store):
+    with store.transaction(rollback=True):
+        store.insert_rows("students", ["name", "birth_date", "gender", "admission_number"],
+                          [("Ann", "2015-01-01", "Female", "A1")])
+    assert store.count("students") == 0
+
+
+def test_transaction_rolls_back_on_error(store):
+    with pytest.raises(sqlite3.OperationalError):
+        with store.transaction():
+            store.insert_rows("students", ["name", "birth_date", "gender", "admission_number"],
+                              [("Ann", "2015-01-01", "Female", "A1")])
+            store.conn.execute("SELECT * FROM missing_table")
+    assert store.count("students") == 0
+
+
+def test_store_uses_wal(store):
+    assert store.conn.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+
+
+def test_row_hash_version_is_a_store_setting(store):
+    store.conn.execute("PRAGMA user_version = 7")  # Left to whoever embeds the database
+    assert store.load_row_hash_version() == 0
+    with store.transaction():
+        store.save_row_hash_version(2)
+    store.close()
+    
+    reopened = newsystem.MigrationStore(store.db_path)
+    
+    assert reopened.load_row_hash_version() == 2
+    assert reopened.conn.execute("PRAGMA user_version").fetchone() == (7,)
+    reopened.close()
+
+
+def test_import_and_dry_run(manager, write_csv):
+    rows = students(20)
+    path = write_csv("students.csv", rows)
+    
+    dry = manager.import_data("students", path, identity(rows), dry_run=True)
+    assert (dry["imported"], dry["failed"]) == (20, 0)
+    assert manager.store.count("students") == 0
+    
+    result = manager.import_data("students", path, identity(rows))
+    assert (result["total"], result["imported"], result["failed"]) == (20, 20, 0)
+    assert manager.store.count("students") == 20
+
+
+@pytest.fixture
+def legacy_db(tmp_path):
+    """A database from before the assessments natural key, holding a repeated key"""
+    path = str(tmp_path / "legacy.db")
+    store = newsystem.MigrationStore(path)
+    with store.transaction():
+        store.conn.execute("DROP INDEX ux_assessments_natural_key")
+        store.insert_rows("students", ["name", "birth_date", "gender", "admission_number"],
+                          [("Ann", "2015-01-01", "Female", "A1")])
+        store.conn.executemany(
+            "INSERT INTO assessments (student_admission, name, subject, score, date) VALUES (?, ?, ?, ?, ?)",
+            [("A1", "Midterm", "Math", 40, "2024-03-05"), ("A1", "Midterm", "Math", 70, "2024-03-05"),
+             ("A1", "Final", "Math", 90, "2024-06-05")]
+        )
+    store.close()
+    return path
+
+
+def test_duplicate_keys_are_kept_and_reported(legacy_db):
+    store = newsystem.MigrationStore(legacy_db)
+    
+    assert store.count("assessments") == 3
+    assert store.key_conflicts == {"assessments": [("A1", "Midterm", "Math", "2024-03-05", 2)]}
+    with pytest.raises(ValueError, match="dedupe --table assessments"):
+        with store.transaction():
+            store.insert_rows("assessments", ["student_admission", "name", "subject", "score", "date"],
+                              [("A1", "Final", "Math", 95, "2024-06-05")])
+    store.close()
+
+
+def test_collapse_duplicate_keys_backs_up_first(legacy_db, tmp_path):
+    store = newsystem.MigrationStore(legacy_db)
+    backup = str(tmp_path / "before.db")
+    
+    assert store.collapse_duplicate_keys("assessments", backup) == 1
+    
+    assert store.key_conflicts == {}
+    assert store.conn.execute("SELECT name, score FROM assessments ORDER BY id").fetchall() == [
+        ("Midterm", 70), ("Final", 90)
+    ]
+    math = store.assessment_stats("", "")[0]
+    assert (math["count"], math["mean"]) == (2, 80)
+    assert sqlite3.connect(backup).execute("SELECT COUNT(*) FROM assessments").fetchone() == (3,)
+    store.close()
+    assert newsystem.MigrationStore(legacy_db).key_conflicts == {}
@@ -0,0 +1,63 @@
+import sqlite3
+
+import newsystem
+from conftest import identity
+
+
+def teacher(tsc_number, name, classes, subjects):
+    return {"name": name, "tsc_number": tsc_number, "specialization": "Languages",
+            "classes_teaching": classes, "subjects_teaching": subjects}
+
+
+def tsc_numbers(teachers):
+    return [teacher["tsc_number"] for teacher in teachers]
+
+
+def test_find_teachers_by_class_and_subject(manager, write_csv):
+    rows = [teacher("T1", "Amina", "Grade 4, Grade 5", "Kiswahili, Français"),
+            teacher("T2", "Brian", "grade 5", "ÉDUCATION Physique, kiswahili"),
+            teacher("T3", "Chebet", "Grade 6", "FRANÇAIS")]
+    manager.import_data("teachers", write_csv("teachers.csv", rows), identity(rows))
+    store = manager.store
+    
+    assert tsc_numbers(store.find_teachers(class_name="GRADE  5")) == ["T1", "T2"]
+    # Non-ASCII case differences match too, which NOCASE would miss
+    assert tsc_numbers(store.find_teachers(subject="français")) == ["T1", "T3"]
+    assert tsc_numbers(store.find_teachers(subject="éducation physique")) == ["T2"]
+    assert tsc_numbers(store.find_teachers(class_name="Grade 5", subject="Kiswahili")) == ["T1", "T2"]
+    assert tsc_numbers(store.find_teachers(class_name="Grade 6", subject="Kiswahili")) == []
+    assert store.conn.execute("SELECT COUNT(*) FROM subjects").fetchone() == (3,)
+
+
+def test_teacher_reimport_replaces_their_lists(manager, write_csv):
+    rows = [teacher("T1", "Amina", "Grade 4", "Kiswahili"), teacher("T2", "Brian", "Grade 4", "Math")]
+    manager.import_data("teachers", write_csv("teachers.csv", rows), identity(rows))
+    
+    moved = [teacher("T1", "Amina", "Grade 7, Grade 8", "English")]
+    manager.import_data("teachers", write_csv("moved.csv", moved), identity(moved))
+    store = manager.store
+    
+    assert tsc_numbers(store.find_teachers(class_name="Grade 4")) == ["T2"]
+    assert tsc_numbers(store.find_teachers(subject="kiswahili")) == []
+    assert tsc_numbers(store.find_teachers(class_name="grade 8", subject="ENGLISH")) == ["T1"]
+    assert store.teacher_lists("T1") == {"classes_teaching": ["Grade 7", "Grade 8"], "subjects_teaching": ["English"]}
+
+
+def test_nocase_lists_are_rebuilt_with_name_keys(tmp_path):
+    path = str(tmp_path / "old.db")
+    conn = sqlite3.connect(path)
+    conn.execute("CREATE TABLE teachers (id INTEGER PRIMARY KEY, name TEXT NOT NULL, "
+                 "tsc_number TEXT NOT NULL UNIQUE, specialization TEXT NOT NULL, phone TEXT, email TEXT, "
+                 "classes_teaching TEXT, subjects_teaching TEXT)")
+    conn.execute("INSERT INTO teachers (name, tsc_number, specialization, classes_teaching, subjects_teaching) "
+                 "VALUES ('Amina', 'T1', 'Languages', 'Grade 4', 'Français')")
+    for lookup, links_table, id_column in newsystem.TEACHER_LISTS.values():
+        conn.execute(f"CREATE TABLE {lookup} (id INTEGER PRIMARY KEY, name TEXT NOT NULL UNIQUE COLLATE NOCASE)")
+        conn.execute(f"CREATE TABLE {links_table} ({id_column} INTEGER NOT NULL, tsc_number TEXT NOT NULL)")
+    conn.commit()
+    conn.close()
+    
+    store = newsystem.MigrationStore(path)
+    
+    assert tsc_numbers(store.find_teachers(subject="FRANÇAIS")) == ["T1"]
+    store.close()
@@ -0,0 +1,75 @@
+from datetime import datetime
+
+import pandas as pd
+import pytest
+from openpyxl import Workbook
+
+import newsystem
+
+
+def workbook(path, rows, header=("name", "grade", "birth_date")):
+    book = Workbook()
+    sheet = book.active
+    sheet.append([])  # A title gap above the header is skipped
+    sheet.append(list(header) + [None])
+    for row in rows:
+        sheet.append(row)
+    book.save(path)
+    return str(path)
+
+
+def pupils(count):
+    return [[f"Pupil {n}", 4, datetime(2015, 5, n % 28 + 1)] for n in range(count)]
+
+
+@pytest.mark.parametrize("rows, sizes", [(7, [3, 3, 1]), (6, [3, 3]), (2, [2]), (0, [0])])
+def test_chunks_split_at_chunksize_with_running_index(tmp_path, rows, sizes):
+    path = workbook(tmp_path / "pupils.xlsx", pupils(rows))
+    
+    chunks = list(newsystem.iter_xlsx_chunks(path, chunksize=3))
+    
+    assert [len(chunk) for chunk in chunks] == sizes
+    assert [list(chunk.index) for chunk in chunks] == [
+        list(range(sum(sizes[:n]), sum(sizes[:n + 1]))) for n in range(len(sizes))
+    ]
+    assert all(list(chunk.columns) == ["name", "grade", "birth_date"] for chunk in chunks)
+
+
+def test_chunks_hold_text_as_a_csv_export_would(tmp_path):
+    path = workbook(tmp_path / "pupils.xlsx", pupils(2) + [[None, None, None], ["  Last  ", 4.0, None]])
+    
+    df = pd.concat(list(newsystem.iter_xlsx_chunks(path, chunksize=2)))
+    
+    assert df.values.tolist() == [
+        ["Pupil 0", "4", "2015-05-01"], ["Pupil 1", "4", "2015-05-02"], ["Last", "4", None]
+    ]
+
+
+def test_nrows_stops_reading_early(tmp_path):
+    path = workbook(tmp_path / "pupils.xlsx", pupils(10))
+    
+    chunks = list(newsystem.iter_xlsx_chunks(path, chunksize=3, nrows=4))
+    
+    assert [len(chunk) for chunk in chunks] == [3, 1]
+
+
+def test_columns_are_picked_in_order_and_checked(tmp_path):
+    path = workbook(tmp_path / "pupils.xlsx", pupils(2))
+    
+    chunk = next(newsystem.iter_xlsx_chunks(path, columns=["birth_date", "name"]))
+    assert chunk.values.tolist() == [["2015-05-01", "Pupil 0"], ["2015-05-02", "Pupil 1"]]
+    
+    with pytest.raises(ValueError, match="Columns not found in file: gender"):
+        next(newsystem.iter_xlsx_chunks(path, columns=["name", "gender"]))
+
+
+def test_read_head_returns_the_header_without_reading_rows(manager, tmp_path):
+    path = workbook(tmp_path / "pupils.xlsx", pupils(50), header=("name", None, "birth_date"))
+    
+    head = manager.read_head(path, 0)
+    
+    # Trailing empty header cells are dropped; inner ones get placeholder names
+    assert list(head.columns) == ["name", "Unnamed: 1", "birth_date"]
+    assert len(head) == 0
+    assert len(manager.read_head(path, 5)) == 5
+